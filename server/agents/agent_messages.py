@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Message models of the news fetcher and relevance scorer agents
+Kept apart from the agents' processing code, which only imports uagents
+when it actually creates an agent, so offline tools (benchmarks, shard
+workers, the supervisor) do not pay for loading uagents and its
+dependencies.
+"""
+
+from typing import List, Dict, Any
+from uagents import Model
+
+# News fetcher
+class NewsRequest(Model):
+    action: str
+    # Articles, or for fetch_sources the feeds to fetch: {"url", "name", "category"}
+    data: List[Dict[str, Any]]
+    user_profile: Dict[str, Any] = None
+    # Page of the ranking returned by process_and_score; None returns every item
+    limit: int = None
+    offset: int = 0
+    # "full" echoes whole articles, "delta" sends {id, computed fields}, "columns" parallel arrays
+    response_format: str = "full"
+    # process_news only: reply in chunks of this many items as they finish
+    chunk_size: int = None
+    # process_news only: this request is chunk `sequence` (from 0) of an input stream
+    stream_id: str = None
+    sequence: int = None
+    is_final: bool = True
+    # Drop near-duplicate copies of a story (here or in the sender's earlier requests),
+    # keeping the most credible one
+    deduplicate: bool = False
+    # process_and_score only: "substring" or "tfidf", and profile_id/profile_version
+    # to register or reuse a profile, as for calculate_relevance
+    scoring_mode: str = "substring"
+    profile_id: str = None
+    profile_version: str = None
+    # Encodings the sender reads ("json", "msgpack", either with "+zstd"), most preferred
+    # first; the response's bulky fields then come in `encoded` (see wire_codec)
+    accept_encoding: List[str] = None
+    # Set when this request's bulky fields (data, user_profiles) are in `encoded`
+    encoding: str = None
+    encoded: str = None
+    # "interactive" (the default) or "batch": batch requests such as backfills queue behind
+    # interactive ones (see request_scheduler)
+    priority: str = None
+    # Milliseconds from arrival within which to answer, else the request is dropped or its
+    # chunked response cut short; None takes the priority's default, 0 means no deadline
+    deadline_ms: int = None
+
+class NewsResponse(Model):
+    success: bool
+    data: List[Dict[str, Any]]
+    processing_time: float
+    agent_name: str
+    offset: int = 0
+    total_items: int = None
+    response_format: str = "full"
+    # Set for the delta and columns formats
+    schema_version: int = None
+    columns: Dict[str, List[Any]] = None
+    # Chunked replies: the chunk answered, whether it is the last one, and
+    # for input streams how many more chunks may be sent before waiting
+    stream_id: str = None
+    sequence: int = None
+    is_final: bool = True
+    window: int = None
+    # Dropped near-duplicate id -> id of the copy that was kept
+    duplicates: Dict[str, str] = None
+    # fetch_sources only: per-feed status ("fetched", "not_modified" or "error"), items and timing
+    feeds: List[Dict[str, Any]] = None
+    # Set when data and columns are in `encoded`, base64 of the named encoding (see wire_codec)
+    encoding: str = None
+    encoded: str = None
+    # Set on the final chunk of a chunked response the deadline cut short
+    truncated: bool = False
+    # Set when the request was shed because the agent is overloaded: seconds to wait before retrying
+    retry_after: float = None
+    # Why the request failed, e.g. an unknown profile_id/profile_version
+    error: str = None
+
+# Relevance scorer
+class RelevanceRequest(Model):
+    action: str
+    data: List[Dict[str, Any]]
+    user_profile: Dict[str, Any] = None
+    # Profiles for calculate_relevance_bulk, each ranked against the same data
+    user_profiles: List[Dict[str, Any]] = None
+    # Page of the ranking to return; None returns every item
+    limit: int = None
+    offset: int = 0
+    # When set, the page is streamed back as several ranked chunks
+    chunk_size: int = None
+    # "full" echoes whole articles, "delta" sends {id, computed fields}, "columns" parallel arrays
+    response_format: str = "full"
+    # "substring" matches interests/history phrases, "tfidf" scores content similarity to them
+    scoring_mode: str = "substring"
+    # Sent with user_profile to register it; sent alone afterwards to reuse it
+    profile_id: str = None
+    profile_version: str = None
+    # Encodings the sender reads ("json", "msgpack", either with "+zstd"), most preferred
+    # first; the response's bulky fields then come in `encoded` (see wire_codec)
+    accept_encoding: List[str] = None
+    # Set when this request's bulky fields (data, user_profiles) are in `encoded`
+    encoding: str = None
+    encoded: str = None
+    # "interactive" (the default) or "batch": batch requests such as backfills queue behind
+    # interactive ones (see request_scheduler)
+    priority: str = None
+    # Milliseconds from arrival within which to answer, else the request is dropped or its
+    # chunked response cut short; None takes the priority's default, 0 means no deadline
+    deadline_ms: int = None
+
+class RelevanceResponse(Model):
+    success: bool
+    data: List[Dict[str, Any]]
+    processing_time: float
+    agent_name: str
+    offset: int = 0
+    total_items: int = None
+    is_final: bool = True
+    response_format: str = "full"
+    # Set for the delta and columns formats
+    schema_version: int = None
+    columns: Dict[str, List[Any]] = None
+    # Set when data and columns are in `encoded`, base64 of the named encoding (see wire_codec)
+    encoding: str = None
+    encoded: str = None
+    # Set on the final chunk of a chunked response the deadline cut short
+    truncated: bool = False
+    # Set when the request was shed because the agent is overloaded: seconds to wait before retrying
+    retry_after: float = None
+    # Why the request failed, e.g. an unknown profile_id/profile_version
+    error: str = None
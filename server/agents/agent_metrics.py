@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+Process-wide metrics for the agents
+Per-stage timings (time.perf_counter_ns), request latency and batch size
+histograms, cache statistics and event-loop lag, served on a local HTTP
+endpoint in the Prometheus text format (/metrics) and as JSON (/metrics.json,
+which run_agents.py aggregates). An optional sampling profiler
+(cProfile or pyinstrument) can capture individual large batches.
+
+Stages timed inside the scoring engine are recorded by whichever process
+runs them, so with AGENT_EXECUTOR=process they stay in the pool workers and
+only the agent-level stages appear here.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT_OFFSET = 1000
+DEFAULT_LAG_INTERVAL = 0.5
+
+# Upper bounds of the histogram buckets; the last bucket is unbounded
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+SIZE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+
+PROFILERS = ('cprofile', 'pyinstrument')
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Snapshot fields with a family of their own; every other field is a source, exported as gauges
+_CORE_FIELDS = ('pid', 'uptime_seconds', 'in_flight', 'requests', 'stages_ms', 'event_loop_lag_ms')
+# Source fields keyed by a value rather than a name, exported with that value as this label
+_LABELLED_FIELDS = {'feature_cache': 'namespace', 'classes': 'priority', 'encoded': 'encoding', 'decoded': 'encoding'}
+# Source fields that only ever grow, exported as <path>_total counters
+_COUNTER_FIELDS = frozenset({
+    'fetched', 'not_modified', 'errors', 'bytes',
+    'encoded', 'decoded', 'fallbacks', 'plain_bytes', 'wire_bytes',
+    'hits', 'coalesced', 'misses', 'evictions',
+    'checked', 'duplicates', 'indexed', 'reused',
+    'lookups', 'rescores', 'rebuilds', 'inserted',
+    'admitted', 'shed', 'expired', 'truncated'
+})
+_INVALID_NAME = re.compile(r'[^a-zA-Z0-9_]')
+
+
+class Histogram:
+    """Fixed-bucket histogram with count, sum, max and interpolated percentiles"""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        index = 0
+        while index < len(self.bounds) and value > self.bounds[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction: float) -> float:
+        """Value below which `fraction` of the observations fall, interpolated within its bucket"""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = self.bounds[index - 1] if index else 0.0
+                high = self.bounds[index] if index < len(self.bounds) else self.max
+                return min(low + (high - low) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "buckets": [[bound, count] for bound, count in zip(list(self.bounds) + ['+Inf'], self.counts)]
+        }
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float):
+        if math.isnan(value):
+            return 'NaN'
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class PrometheusExposition:
+    """Metric families in the Prometheus text format, built from snapshot()s.
+
+    Every snapshot is added with labels of its own (e.g. its replica), and each
+    family is written once with all their samples, as the format requires.
+    Timings recorded in milliseconds are exported in seconds.
+    """
+
+    def __init__(self):
+        # name -> (type, help, sample lines)
+        self.families: Dict[str, Tuple[str, str, List[str]]] = {}
+
+    def sample(self, family: str, kind: str, help_text: str, labels: Dict[str, Any], value: float,
+               suffix: str = ''):
+        """Add one sample to a family, creating it on first use"""
+        lines = self.families.setdefault(family, (kind, help_text, []))[2]
+        label_text = ','.join(f'{_INVALID_NAME.sub("_", key)}="{_escape(label)}"' for key, label in labels.items())
+        lines.append(f"{family}{suffix}{{{label_text}}} {_format_value(value)}" if label_text else
+                     f"{family}{suffix} {_format_value(value)}")
+
+    def histogram(self, family: str, help_text: str, labels: Dict[str, Any], snapshot: Dict[str, Any],
+                  scale: float = 1.0):
+        """Add a Histogram.snapshot() as cumulative _bucket samples with _sum and _count"""
+        cumulative = 0
+        for bound, count in snapshot['buckets']:
+            cumulative += count
+            le = '+Inf' if bound == '+Inf' else _format_value(float(bound) * scale)
+            self.sample(family, 'histogram', help_text, {**labels, 'le': le}, cumulative, '_bucket')
+        self.sample(family, 'histogram', help_text, labels, snapshot['sum'] * scale, '_sum')
+        self.sample(family, 'histogram', help_text, labels, snapshot['count'], '_count')
+
+    def add_snapshot(self, snapshot: Dict[str, Any], labels: Optional[Dict[str, Any]] = None):
+        """Add an AgentMetrics.snapshot(): requests, stages, loop lag, and every source's numbers"""
+        labels = labels or {}
+        self.sample('agent_uptime_seconds', 'gauge', "Seconds since the agent process started",
+                    labels, snapshot['uptime_seconds'])
+        self.sample('agent_requests_in_flight', 'gauge', "Requests being handled", labels, snapshot['in_flight'])
+        for action, entry in snapshot['requests'].items():
+            action_labels = {**labels, 'action': action}
+            self.sample('agent_requests_total', 'counter', "Handled requests per action",
+                        action_labels, entry['count'])
+            self.sample('agent_request_errors_total', 'counter', "Failed requests per action",
+                        action_labels, entry['errors'])
+            self.histogram('agent_request_duration_seconds', "Request latency per action",
+                           action_labels, entry['latency_ms'], 1e-3)
+            self.histogram('agent_request_batch_size', "Items per request per action",
+                           action_labels, entry['batch_size'])
+        for stage, histogram in snapshot['stages_ms'].items():
+            self.histogram('agent_stage_duration_seconds', "Time per run of a processing stage",
+                           {**labels, 'stage': stage}, histogram, 1e-3)
+        self.histogram('agent_event_loop_lag_seconds', "How late the event loop wakes a sleeping task",
+                       labels, snapshot['event_loop_lag_ms'], 1e-3)
+
+        for source, value in snapshot.items():
+            if source not in _CORE_FIELDS:
+                self._add_source(source if source.startswith('agent') else f'agent_{source}',
+                                 source, source, value, labels, 1.0)
+
+    def _add_source(self, family: str, source: str, field: str, value: Any, labels: Dict[str, Any],
+                    scale: float):
+        """Numbers become gauges named by their path (counters for _COUNTER_FIELDS), histograms histograms,
+        and a dict's strings labels of <path>_info"""
+        if isinstance(value, (bool, int, float)):
+            if field in _COUNTER_FIELDS:
+                self.sample(f'{family}_total', 'counter', f"From the {source} stats", labels, float(value) * scale)
+            else:
+                self.sample(family, 'gauge', f"From the {source} stats", labels, float(value) * scale)
+        elif isinstance(value, dict):
+            if 'buckets' in value:
+                self.histogram(family, f"From the {source} stats", labels, value, scale)
+                return
+            if field in _LABELLED_FIELDS:
+                # Per-label numbers keep the field's type, per-label dicts are walked as usual
+                for key, item in value.items():
+                    self._add_source(family, source, '' if isinstance(item, dict) else field, item,
+                                     {**labels, _LABELLED_FIELDS[field]: key}, scale)
+                return
+            info = {key: item for key, item in value.items() if isinstance(item, str) and key != 'error'}
+            if info:
+                self.sample(f'{family}_info', 'gauge', f"Descriptive fields of the {source} stats",
+                            {**labels, **info}, 1)
+            for key, item in value.items():
+                name = _INVALID_NAME.sub('_', str(key))
+                if name.endswith('_ms'):
+                    self._add_source(f'{family}_{name[:-3]}_seconds', source, key, item, labels, 1e-3)
+                else:
+                    self._add_source(f'{family}_{name}', source, key, item, labels, scale)
+
+    def text(self) -> str:
+        out = []
+        for family, (kind, help_text, lines) in self.families.items():
+            out.append(f"# HELP {family} {help_text}")
+            out.append(f"# TYPE {family} {kind}")
+            out.extend(lines)
+        return '\n'.join(out) + '\n'
+
+
+class SamplingProfiler:
+    """Profiles a sampled fraction of large requests and writes one file per capture.
+
+    Configured by AGENT_PROFILER (cprofile or pyinstrument), AGENT_PROFILE_RATE
+    (fraction of eligible requests), AGENT_PROFILE_MIN_ITEMS and AGENT_PROFILE_DIR.
+    """
+
+    def __init__(self, kind: Optional[str] = None, rate: float = 1.0, min_items: int = 0,
+                 directory: str = '.'):
+        self.kind = kind
+        self.rate = rate
+        self.min_items = min_items
+        self.directory = directory
+        self.captures = 0
+
+    @classmethod
+    def from_env(cls) -> 'SamplingProfiler':
+        kind = (os.getenv('AGENT_PROFILER') or '').lower() or None
+        if kind is not None and kind not in PROFILERS:
+            logger.warning(f"Ignoring invalid AGENT_PROFILER={kind!r}, expected one of {PROFILERS}")
+            kind = None
+        try:
+            rate = float(os.getenv('AGENT_PROFILE_RATE', 1.0))
+            min_items = int(os.getenv('AGENT_PROFILE_MIN_ITEMS', 0))
+        except ValueError as e:
+            logger.warning(f"Invalid profiler settings, using defaults: {e}")
+            rate, min_items = 1.0, 0
+        return cls(kind, rate, min_items, os.getenv('AGENT_PROFILE_DIR', '.'))
+
+    @contextmanager
+    def capture(self, label: str, items: int) -> Iterator[None]:
+        """Profile the block if this request is sampled"""
+        if self.kind is None or items < self.min_items or random.random() >= self.rate:
+            yield
+            return
+
+        path = os.path.join(self.directory, f"{label}-{time.strftime('%Y%m%d-%H%M%S')}-{self.captures}")
+        if self.kind == 'cprofile':
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                profiler.dump_stats(path + '.prof')
+        else:
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                logger.warning("AGENT_PROFILER=pyinstrument but pyinstrument is not installed; profiling disabled")
+                self.kind = None
+                yield
+                return
+            profiler = Profiler(async_mode='enabled')
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                with open(path + '.html', 'w') as f:
+                    f.write(profiler.output_html())
+        self.captures += 1
+        logger.info(f"Profiled {label} ({items} items) to {path}")
+
+
+class AgentMetrics:
+    """Metrics of the agent(s) running in this process"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages: Dict[str, Histogram] = {}
+        self.requests: Dict[str, Dict[str, Any]] = {}
+        self.in_flight = 0
+        self.loop_lag = Histogram(LATENCY_BUCKETS_MS)
+        self.profiler = SamplingProfiler.from_env()
+        self._sources: Dict[str, Callable[[], Any]] = {}
+        self._lock = threading.Lock()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._lag_task: Optional[asyncio.Task] = None
+
+    def record_stage(self, stage: str, elapsed_ns: int):
+        """Add one timing of a stage, in nanoseconds"""
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram(LATENCY_BUCKETS_MS)
+            histogram.observe(elapsed_ns / 1e6)
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """Time the block as one run of a stage"""
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.record_stage(stage, time.perf_counter_ns() - start)
+
+    def begin_request(self) -> int:
+        """Count a request as in flight until its record_request(); returns its start time"""
+        with self._lock:
+            self.in_flight += 1
+        return time.perf_counter_ns()
+
+    def record_request(self, action: str, items: int, elapsed_ns: int, success: bool):
+        """Add one handled request to the latency and batch size histograms of its action"""
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            entry = self.requests.get(action)
+            if entry is None:
+                entry = self.requests[action] = {
+                    "count": 0,
+                    "errors": 0,
+                    "latency_ms": Histogram(LATENCY_BUCKETS_MS),
+                    "batch_size": Histogram(SIZE_BUCKETS)
+                }
+            entry["count"] += 1
+            entry["errors"] += not success
+            entry["latency_ms"].observe(elapsed_ns / 1e6)
+            entry["batch_size"].observe(items)
+
+    def reset(self):
+        """Forget the recorded timings, e.g. between benchmark scenarios"""
+        with self._lock:
+            self.stages.clear()
+            self.requests.clear()
+            self.loop_lag = Histogram(LATENCY_BUCKETS_MS)
+
+    def add_source(self, name: str, source: Callable[[], Any]):
+        """Report source() (e.g. a cache's stats()) under name in every snapshot"""
+        self._sources[name] = source
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Everything recorded so far, as JSON-serializable data"""
+        with self._lock:
+            snapshot = {
+                "pid": os.getpid(),
+                "uptime_seconds": time.time() - self.started,
+                "stages_ms": {stage: histogram.snapshot() for stage, histogram in self.stages.items()},
+                "requests": {
+                    action: {
+                        "count": entry["count"],
+                        "errors": entry["errors"],
+                        "latency_ms": entry["latency_ms"].snapshot(),
+                        "batch_size": entry["batch_size"].snapshot()
+                    }
+                    for action, entry in self.requests.items()
+                },
+                "in_flight": self.in_flight,
+                "event_loop_lag_ms": self.loop_lag.snapshot()
+            }
+
+        for name, source in self._sources.items():
+            try:
+                snapshot[name] = source()
+            except Exception as e:
+                snapshot[name] = {"error": str(e)}
+        return snapshot
+
+    def prometheus(self) -> str:
+        """The snapshot in the Prometheus text format"""
+        exposition = PrometheusExposition()
+        exposition.add_snapshot(self.snapshot())
+        return exposition.text()
+
+    async def start(self, port: Optional[int], lag_interval: float = DEFAULT_LAG_INTERVAL):
+        """Start the event-loop lag monitor and, when port is set, the HTTP endpoint"""
+        if self._lag_task is None:
+            self._lag_task = asyncio.get_running_loop().create_task(self._monitor_lag(lag_interval))
+        if port and self._server is None:
+            try:
+                self._server = await asyncio.start_server(self._serve, '127.0.0.1', port)
+                logger.info(f"Metrics on http://127.0.0.1:{port}/metrics")
+            except OSError as e:
+                logger.warning(f"Metrics endpoint disabled, cannot listen on port {port}: {e}")
+
+    async def stop(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _monitor_lag(self, interval: float):
+        """Record how late the loop wakes a task that sleeps for `interval`"""
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            lag_ms = max(0.0, loop.time() - expected) * 1000
+            with self._lock:
+                self.loop_lag.observe(lag_ms)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Minimal HTTP/1.0 responder for GET /metrics (Prometheus) and /metrics.json"""
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Drain the headers
+            while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+                pass
+            parts = request_line.decode('latin-1').split()
+            path = parts[1].split('?')[0] if len(parts) >= 2 and parts[0] == 'GET' else None
+            if path == '/metrics':
+                status, content_type, body = '200 OK', PROMETHEUS_CONTENT_TYPE, self.prometheus().encode()
+            elif path == '/metrics.json':
+                status, content_type = '200 OK', 'application/json'
+                body = json.dumps(self.snapshot(), default=str).encode()
+            else:
+                status, content_type, body = '404 Not Found', 'application/json', b'{"error": "not found"}'
+            writer.write(
+                f"HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def metrics_port(agent_port: int) -> Optional[int]:
+    """Metrics port of an agent: its port plus METRICS_PORT_OFFSET, or None when METRICS_PORT_OFFSET=0"""
+    try:
+        offset = int(os.getenv('METRICS_PORT_OFFSET', DEFAULT_PORT_OFFSET))
+    except ValueError:
+        logger.warning(f"Ignoring invalid METRICS_PORT_OFFSET, using {DEFAULT_PORT_OFFSET}")
+        offset = DEFAULT_PORT_OFFSET
+    return agent_port + offset if offset else None
+
+
+def agent_placement(default_port: int) -> Tuple[int, int]:
+    """Port and replica index of this agent process, from AGENT_PORT and AGENT_REPLICA set by run_agents.py"""
+    try:
+        return int(os.getenv('AGENT_PORT', default_port)), int(os.getenv('AGENT_REPLICA', 0))
+    except ValueError as e:
+        logger.warning(f"Invalid agent placement, using port {default_port}: {e}")
+        return default_port, 0
+
+
+def queue_depth(agent: Any) -> Dict[str, int]:
+    """Messages waiting in a uAgents agent's inbox and requests being handled"""
+    inbox = getattr(agent, '_message_queue', None)
+    pending = inbox.qsize() if inbox is not None else 0
+    return {"pending": pending, "in_flight": metrics.in_flight, "depth": pending + metrics.in_flight}
+
+
+metrics = AgentMetrics()
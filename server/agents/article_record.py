@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Compact article record used along the processing path
+A record keeps a reference to the article dict it was built from and holds the
+fields the agents add in slots, so each stage adds a small fixed-size object
+instead of copying every key of the article into a new dict. Records read like
+the merged dict they stand for and are turned into wire dicts only when a
+response is built.
+"""
+
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, Iterator, List, Sequence
+
+# Fields the agents add to an article, in the order they first appear on the wire
+RECORD_FIELDS = (
+    'processed_by',
+    'processing_timestamp',
+    'quality_score',
+    'language',
+    'word_count',
+    'has_image',
+    'source_credibility',
+    'relevance_score',
+    'personalized_score',
+    'engagement_potential',
+    'recency_score',
+    'personalization_factors',
+)
+_FIELD_SET = frozenset(RECORD_FIELDS)
+_UNSET = object()
+
+# Response formats: the whole merged articles, {id, computed fields} per
+# article, or one array per computed field in id order
+RESPONSE_FORMATS = ('full', 'delta', 'columns')
+# Version of the delta/columns layouts, bumped on incompatible changes
+WIRE_SCHEMA_VERSION = 1
+
+
+class ArticleRecord(Mapping):
+    """Read-only view of an article plus the fields the agents computed for it.
+
+    The source article is shared, never copied; deriving a record for a later
+    stage copies only the computed slots.
+    """
+
+    __slots__ = ('item',) + RECORD_FIELDS
+
+    def __init__(self, item: Dict[str, Any], **fields):
+        self.item = item
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    @classmethod
+    def derive(cls, item: Mapping, **fields) -> 'ArticleRecord':
+        """Record of item with fields set on top; a record's article and fields carry over"""
+        if isinstance(item, ArticleRecord):
+            return cls(item.item, **{**item.fields(), **fields})
+        return cls(item, **fields)
+
+    def fields(self) -> Dict[str, Any]:
+        """The computed fields that are set, in wire order"""
+        fields = {}
+        for name in RECORD_FIELDS:
+            value = getattr(self, name, _UNSET)
+            if value is not _UNSET:
+                fields[name] = value
+        return fields
+
+    def __getitem__(self, key: str) -> Any:
+        if key in _FIELD_SET:
+            value = getattr(self, key, _UNSET)
+            if value is not _UNSET:
+                return value
+        return self.item[key]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        # Hot in the scorers; avoids Mapping.get's __getitem__/KeyError round trip
+        if key in _FIELD_SET:
+            value = getattr(self, key, _UNSET)
+            if value is not _UNSET:
+                return value
+        return self.item.get(key, default)
+
+    def __contains__(self, key: object) -> bool:
+        if key in _FIELD_SET and getattr(self, key, _UNSET) is not _UNSET:
+            return True
+        return key in self.item
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.item
+        for name in self.fields():
+            if name not in self.item:
+                yield name
+
+    def __len__(self) -> int:
+        return len(self.item) + sum(1 for name in self.fields() if name not in self.item)
+
+    def __repr__(self) -> str:
+        return f"ArticleRecord({self.to_wire()!r})"
+
+    def to_wire(self, changed_only: bool = False) -> Dict[str, Any]:
+        """The response dict: the whole merged article, or just its id and the computed fields"""
+        if changed_only:
+            return {"id": self.item.get('id'), **self.fields()}
+        return {**self.item, **self.fields()}
+
+
+def to_wire(item: Mapping, changed_only: bool = False) -> Dict[str, Any]:
+    """Wire dict of a record or a plain article (plain articles were passed through unchanged)"""
+    if isinstance(item, ArticleRecord):
+        return item.to_wire(changed_only)
+    if changed_only:
+        return {"id": item.get('id')}
+    return item
+
+
+def wire_items(items: Iterable[Mapping], changed_only: bool = False) -> List[Dict[str, Any]]:
+    """to_wire() for a whole response"""
+    return [to_wire(item, changed_only) for item in items]
+
+
+def wire_columns(items: Sequence[Mapping]) -> Dict[str, List[Any]]:
+    """Computed fields as parallel arrays aligned with "id"; None where an item lacks a field"""
+    deltas = wire_items(items, changed_only=True)
+    names = [name for name in RECORD_FIELDS if any(name in delta for delta in deltas)]
+    columns = {"id": [delta["id"] for delta in deltas]}
+    for name in names:
+        columns[name] = [delta.get(name) for delta in deltas]
+    return columns
+
+
+def wire_payload(items: Sequence[Mapping], response_format: str = 'full') -> Dict[str, Any]:
+    """Response fields (data, columns, response_format, schema_version) for items in the requested format"""
+    if response_format not in RESPONSE_FORMATS:
+        raise ValueError(f"Unknown response_format {response_format!r}, expected one of {RESPONSE_FORMATS}")
+
+    if response_format == 'full':
+        return {"data": wire_items(items), "response_format": response_format}
+
+    payload = {"response_format": response_format, "schema_version": WIRE_SCHEMA_VERSION}
+    if response_format == 'delta':
+        payload["data"] = wire_items(items, changed_only=True)
+    else:
+        payload["data"] = []
+        payload["columns"] = wire_columns(items)
+    return payload
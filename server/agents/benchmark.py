@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of the agents' processing and scoring paths
+Runs the news fetcher and relevance scorer functions (and the full
+fetch -> score pipeline) over deterministic synthetic feeds without starting
+the uAgents network, reporting items/sec, p50/p99 latency and peak memory.
+
+    python benchmark.py --items 2000 --runs 20
+    python benchmark.py --save baseline.json
+    python benchmark.py --compare baseline.json --max-regression 0.15
+    python benchmark.py --only scorer --stages
+
+--compare exits non-zero when a scenario's throughput drops more than
+--max-regression below the baseline, so it can gate regressions in CI.
+--stages adds each scenario's mean per-stage times from agent_metrics.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from synthetic_data import BENCHMARK_EPOCH, generate_articles, generate_profiles, parse_source_mix
+
+DEFAULT_ITEMS = 1000
+DEFAULT_RUNS = 10
+DEFAULT_WARMUP = 2
+DEFAULT_MAX_REGRESSION = 0.15
+
+# Scenario name -> (description, function of the benchmark context returning a zero-argument callable)
+SCENARIOS: Dict[str, Tuple[str, Callable[['BenchmarkContext'], Callable[[], Any]]]] = {}
+
+
+def scenario(name: str, description: str):
+    """Register a benchmark scenario"""
+    def register(factory):
+        SCENARIOS[name] = (description, factory)
+        return factory
+    return register
+
+
+class BenchmarkContext:
+    """Agents, event loop and synthetic payloads shared by every scenario"""
+
+    def __init__(self, articles: List[Dict[str, Any]], profiles: List[Dict[str, Any]]):
+        # Imported here so --cold can configure the feature cache first
+        from news_fetcher_agent import NewsFetcherAgent
+        from relevance_scorer_agent import RelevanceScorerAgent
+        from timeparse import FixedClock
+
+        clock = FixedClock(BENCHMARK_EPOCH)
+        self.articles = articles
+        self.profiles = profiles
+        self.profile = profiles[0]
+        self.loop = asyncio.new_event_loop()
+        self.fetcher = NewsFetcherAgent(create_agent=False, clock=clock)
+        self.scorer = RelevanceScorerAgent(create_agent=False, clock=clock)
+        # The scorer scenarios measure full scoring passes, the ranked_index ones the index
+        self.scorer.ranked.max_profiles = 0
+        # The scorer normally receives the fetcher's enriched items
+        self.processed = self.fetcher.process_news_items(articles)
+
+    def run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def close(self):
+        self.fetcher.executor.shutdown()
+        self.fetcher.scorer.executor.shutdown()
+        self.scorer.executor.shutdown()
+        self.loop.close()
+
+
+@scenario('fetcher.process_news_items', "News fetcher feature extraction, synchronous")
+def _fetcher_items(ctx):
+    return lambda: ctx.fetcher.process_news_items(ctx.articles)
+
+
+@scenario('fetcher.process_news', "News fetcher through the shard executor")
+def _fetcher_async(ctx):
+    return lambda: ctx.run(ctx.fetcher.process_news(ctx.articles))
+
+
+@scenario('langid.detect_languages', "Batch language identification of title + summary")
+def _langid(ctx):
+    import langid
+    texts = [ctx.fetcher.language_text(item) for item in ctx.articles]
+    return lambda: langid.detect_languages(texts)
+
+
+@scenario('fetcher.deduplicate', "Near-duplicate detection with an empty index (signatures computed)")
+def _dedup_cold(ctx):
+    from dedup_index import DedupIndex
+
+    def deduplicate():
+        ctx.fetcher.dedup = DedupIndex.from_env()
+        return ctx.run(ctx.fetcher.deduplicate(ctx.articles))
+    return deduplicate
+
+
+@scenario('fetcher.deduplicate.warm', "Near-duplicate detection of a feed the index has already seen")
+def _dedup_warm(ctx):
+    return lambda: ctx.run(ctx.fetcher.deduplicate(ctx.articles))
+
+
+@scenario('scorer.calculate_relevance_scores', "Full ranking of the feed for one profile")
+def _scorer(ctx):
+    return lambda: ctx.run(ctx.scorer.calculate_relevance_scores(ctx.processed, ctx.profile))
+
+
+@scenario('scorer.calculate_relevance_scores.top20', "First page of 20 for one profile")
+def _scorer_top(ctx):
+    return lambda: ctx.run(ctx.scorer.calculate_relevance_scores(ctx.processed, ctx.profile, limit=20))
+
+
+@scenario('scorer.calculate_relevance_scores.tfidf', "Full ranking scored by TF-IDF content similarity")
+def _scorer_tfidf(ctx):
+    return lambda: ctx.run(ctx.scorer.calculate_relevance_scores(ctx.processed, ctx.profile, scoring_mode='tfidf'))
+
+
+@scenario('scorer.calculate_relevance_scores.herd', "20 identical concurrent first-page requests, coalesced")
+def _scorer_herd(ctx):
+    # Plain dicts, as decoded from the agents' messages
+    payload = [dict(item) for item in ctx.processed]
+
+    async def herd():
+        # Emptied each run so the first request computes and the others wait on it
+        ctx.scorer.results.clear()
+        return await asyncio.gather(*[
+            ctx.scorer.cached_relevance_scores(payload, ctx.profile, limit=20) for _ in range(20)
+        ])
+    return lambda: ctx.run(herd())
+
+
+@scenario('scorer.ranked_index.lookup', "First page of 20 of an unchanged feed from the profile's ranked feed")
+def _ranked_lookup(ctx):
+    from ranked_index import RankedIndex
+    index = RankedIndex()
+    profile = ctx.scorer.profiles.compile(ctx.profile)
+    now = ctx.scorer.clock.now()
+    # Plain dicts, as decoded from the agents' messages
+    payload = [dict(item) for item in ctx.processed]
+    return lambda: ctx.run(index.page(payload, profile, now, limit=20, executor=ctx.scorer.executor))
+
+
+@scenario('scorer.ranked_index.arrivals', "First page of 20 after 10 new articles replace the 10 oldest")
+def _ranked_arrivals(ctx):
+    from ranked_index import RankedIndex
+    index = RankedIndex()
+    profile = ctx.scorer.profiles.compile(ctx.profile)
+    now = ctx.scorer.clock.now()
+    # More arrivals than the feed holds, so articles only come back around after dropping out of it
+    pool = generate_articles(len(ctx.processed) + 100, seed=1)
+    for position, item in enumerate(pool):
+        item['id'] = f"arrival_{position}"
+    pool = [dict(item) for item in ctx.fetcher.process_news_items(pool)]
+    arrivals = itertools.cycle([pool[start:start + 10] for start in range(0, len(pool) - 9, 10)])
+    state = {"feed": [dict(item) for item in ctx.processed]}
+
+    def arrive():
+        state["feed"] = next(arrivals) + state["feed"][:-10]
+        return ctx.run(index.page(state["feed"], profile, now, limit=20, executor=ctx.scorer.executor))
+    return arrive
+
+
+@scenario('scorer.calculate_relevance_scores_per_item', "Per-item reference scoring path")
+def _scorer_per_item(ctx):
+    return lambda: ctx.scorer.calculate_relevance_scores_per_item(ctx.processed, ctx.profile)
+
+
+@scenario('scorer.calculate_relevance_bulk', "Ranked ids of the feed for every profile")
+def _scorer_bulk(ctx):
+    return lambda: ctx.run(ctx.scorer.calculate_relevance_bulk(ctx.processed, ctx.profiles, limit=20))
+
+
+@scenario('pipeline.fetch_score', "process_news followed by calculate_relevance_scores")
+def _pipeline(ctx):
+    async def pipeline():
+        processed = await ctx.fetcher.process_news(ctx.articles)
+        return await ctx.scorer.calculate_relevance_scores(processed, ctx.profile)
+    return lambda: ctx.run(pipeline())
+
+
+@scenario('pipeline.process_and_score', "Fused in-process fetch + score (process_and_score action)")
+def _fused_pipeline(ctx):
+    return lambda: ctx.run(ctx.fetcher.process_and_score(ctx.articles, ctx.profile))
+
+
+def measure(call: Callable[[], Any], items: int, runs: int, warmup: int) -> Dict[str, float]:
+    """Time `runs` calls after `warmup` untimed ones, then trace one more call for peak memory"""
+    for _ in range(warmup):
+        call()
+
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latencies = np.array(latencies)
+    return {
+        "items": items,
+        "runs": runs,
+        "items_per_sec": items * runs / latencies.sum(),
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+        "peak_memory_mb": peak / (1024 * 1024)
+    }
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            max_regression: float) -> List[str]:
+    """Scenarios whose throughput fell more than max_regression below the baseline"""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        floor = reference["items_per_sec"] * (1 - max_regression)
+        if result["items_per_sec"] < floor:
+            regressions.append(
+                f"{name}: {result['items_per_sec']:.0f} items/sec, baseline {reference['items_per_sec']:.0f}"
+            )
+    return regressions
+
+
+def print_stages(stages: Dict[str, Dict[str, Dict[str, float]]]):
+    for name, timings in stages.items():
+        breakdown = ', '.join(f"{stage} {timing['mean']:.2f}" for stage, timing in timings.items())
+        print(f"  {name}: {breakdown or 'no stages recorded'} (mean ms)")
+
+
+def print_table(results: Dict[str, Dict[str, float]]):
+    print(f"{'scenario':45} {'items/sec':>12} {'p50 ms':>10} {'p99 ms':>10} {'peak MiB':>10}")
+    for name, result in results.items():
+        print(f"{name:45} {result['items_per_sec']:12.0f} {result['p50_ms']:10.2f} "
+              f"{result['p99_ms']:10.2f} {result['peak_memory_mb']:10.2f}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the agents' scoring paths on synthetic feeds")
+    parser.add_argument('--items', type=int, default=DEFAULT_ITEMS, help="articles per feed")
+    parser.add_argument('--summary-words', type=int, default=60, help="mean summary length in words")
+    parser.add_argument('--history', type=int, default=20, help="reading history entries per profile")
+    parser.add_argument('--interests', type=int, default=5, help="interests per profile")
+    parser.add_argument('--profiles', type=int, default=10, help="profiles for the bulk scenario")
+    parser.add_argument('--sources', help='source mix, e.g. "CoinDesk=3,Medium=1"')
+    parser.add_argument('--duplicates', type=float, default=0.0, help="fraction of syndicated copies in the feed")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS)
+    parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP)
+    parser.add_argument('--only', action='append', help="scenario name prefix to run (repeatable)")
+    parser.add_argument('--cold', action='store_true', help="disable the news fetcher's feature cache")
+    parser.add_argument('--list', action='store_true', help="list scenarios and exit")
+    parser.add_argument('--save', help="write results as JSON to this path")
+    parser.add_argument('--compare', help="baseline JSON written by --save")
+    parser.add_argument('--max-regression', type=float, default=DEFAULT_MAX_REGRESSION,
+                        help="allowed throughput drop against --compare, as a fraction")
+    parser.add_argument('--stages', action='store_true', help="report per-stage timings of each scenario")
+    parser.add_argument('--verbose', action='store_true', help="keep the agents' INFO logging")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, (description, _) in SCENARIOS.items():
+            print(f"{name:45} {description}")
+        return 0
+
+    if args.cold:
+        os.environ['FEATURE_CACHE_SIZE'] = '0'
+        os.environ.pop('FEATURE_CACHE_PATH', None)
+
+    source_mix = parse_source_mix(args.sources) if args.sources else None
+    articles = generate_articles(args.items, seed=args.seed, summary_words=args.summary_words,
+                                 source_mix=source_mix, duplicate_ratio=args.duplicates)
+    profiles = generate_profiles(max(1, args.profiles), seed=args.seed, interests=args.interests,
+                                 history_length=args.history, source_mix=source_mix)
+
+    context = BenchmarkContext(articles, profiles)
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    from agent_metrics import metrics
+
+    results = {}
+    stages = {}
+    try:
+        for name, (_, factory) in SCENARIOS.items():
+            if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                continue
+            metrics.reset()
+            results[name] = measure(factory(context), args.items, args.runs, args.warmup)
+            stages[name] = metrics.snapshot()['stages_ms']
+    finally:
+        context.close()
+
+    print(f"{args.items} items, {args.runs} runs, executor {os.getenv('AGENT_EXECUTOR', 'thread')}, "
+          f"Python {platform.python_version()}{', cold caches' if args.cold else ''}")
+    print_table(results)
+    if args.stages:
+        print("Stage timings:")
+        print_stages(stages)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        if regressions:
+            print("Throughput regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Sequenced chunk streams for agent requests
+Large payloads arrive as numbered chunks of one stream; chunks are released in
+sequence order as soon as they can be processed, and each stream has a window
+of chunks that may be outstanding at once so a fast sender cannot make the
+agent buffer an entire backfill in memory.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW = 4
+DEFAULT_MAX_CHUNK_ITEMS = 1000
+DEFAULT_IDLE_TIMEOUT = 300.0
+
+
+class StreamError(ValueError):
+    """A chunk that breaks the stream protocol (bad sequence, full window, oversized chunk)"""
+
+
+class StreamState:
+    """Progress of one stream: the next sequence to release and the chunks waiting for it"""
+
+    def __init__(self):
+        self.next_sequence = 0
+        self.pending: Dict[int, Tuple[Any, bool]] = {}
+        # Chunks accepted but not yet answered, buffered ones included
+        self.in_flight = 0
+        self.items_done = 0
+        self.final_sequence: Optional[int] = None
+        self.last_seen = time.monotonic()
+        # Serializes processing so responses leave in sequence order
+        self.lock = asyncio.Lock()
+
+
+class ChunkStreams:
+    """Reassembles sequenced chunks per stream key and enforces the per-stream window"""
+
+    def __init__(self, window: int = DEFAULT_WINDOW, max_chunk_items: int = DEFAULT_MAX_CHUNK_ITEMS,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT):
+        self.window = max(1, window)
+        self.max_chunk_items = max_chunk_items
+        self.idle_timeout = idle_timeout
+        self.streams: Dict[Hashable, StreamState] = {}
+
+    @classmethod
+    def from_env(cls, prefix: str = 'NEWS_STREAM') -> 'ChunkStreams':
+        """Build from <prefix>_WINDOW, _MAX_CHUNK_ITEMS and _IDLE_TIMEOUT"""
+        try:
+            return cls(
+                window=int(os.getenv(f'{prefix}_WINDOW', DEFAULT_WINDOW)),
+                max_chunk_items=int(os.getenv(f'{prefix}_MAX_CHUNK_ITEMS', DEFAULT_MAX_CHUNK_ITEMS)),
+                idle_timeout=float(os.getenv(f'{prefix}_IDLE_TIMEOUT', DEFAULT_IDLE_TIMEOUT))
+            )
+        except ValueError as e:
+            logger.warning(f"Invalid {prefix} settings, using defaults: {e}")
+            return cls()
+
+    def accept(self, key: Hashable, sequence: Optional[int], data: List[Any],
+               is_final: bool) -> List[Tuple[int, List[Any], bool]]:
+        """Register a chunk and return the (sequence, data, is_final) chunks now ready, in order.
+
+        Raises StreamError without changing the stream when the chunk is rejected.
+        """
+        self.expire()
+
+        if sequence is None or sequence < 0:
+            raise StreamError(f"Stream chunks need a non-negative sequence, got {sequence!r}")
+        if len(data) > self.max_chunk_items:
+            raise StreamError(f"Chunk {sequence} has {len(data)} items, the limit is {self.max_chunk_items}")
+
+        # A new stream is only registered once its first chunk is accepted
+        state = self.streams.get(key) or StreamState()
+
+        if sequence < state.next_sequence or sequence in state.pending:
+            raise StreamError(f"Duplicate chunk {sequence}")
+        if state.final_sequence is not None and sequence > state.final_sequence:
+            raise StreamError(f"Chunk {sequence} is past the final chunk {state.final_sequence}")
+        if is_final and any(pending > sequence for pending in state.pending):
+            raise StreamError(f"Chunk {sequence} is marked final but later chunks were received")
+        if state.in_flight >= self.window:
+            raise StreamError(f"Stream window of {self.window} chunks is full")
+        if sequence >= state.next_sequence + self.window:
+            raise StreamError(f"Chunk {sequence} is beyond the window starting at {state.next_sequence}")
+
+        self.streams[key] = state
+        state.last_seen = time.monotonic()
+        state.in_flight += 1
+        state.pending[sequence] = (data, is_final)
+        if is_final:
+            state.final_sequence = sequence
+
+        ready = []
+        while state.next_sequence in state.pending:
+            chunk_data, chunk_final = state.pending.pop(state.next_sequence)
+            ready.append((state.next_sequence, chunk_data, chunk_final))
+            state.next_sequence += 1
+        return ready
+
+    def state(self, key: Hashable) -> Optional[StreamState]:
+        return self.streams.get(key)
+
+    def complete(self, key: Hashable, items: int, is_final: bool) -> int:
+        """Mark one released chunk as answered; returns the stream's remaining window"""
+        state = self.streams.get(key)
+        if state is None:
+            return self.window
+        state.in_flight -= 1
+        state.items_done += items
+        if is_final:
+            del self.streams[key]
+        return self.window - state.in_flight
+
+    def credits(self, key: Hashable) -> int:
+        """Chunks the sender may still send before waiting for a response"""
+        state = self.streams.get(key)
+        return self.window - (state.in_flight if state else 0)
+
+    def expire(self):
+        """Drop streams that have been idle longer than idle_timeout"""
+        cutoff = time.monotonic() - self.idle_timeout
+        for key in [key for key, state in self.streams.items() if state.last_seen < cutoff]:
+            logger.warning(f"Dropping idle stream {key}")
+            del self.streams[key]
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Compiled user profiles
+A profile is turned once into the structures scoring needs (interest and
+history matchers, lower-cased source and topic sets, reading-length bounds)
+and kept in a bounded LRU keyed by a hash of its content. Callers can also
+register a profile under an id and version and send only those afterwards.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from pattern_matcher import MultiPatternMatcher, compile_patterns
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 1024
+
+# Inclusive word-count bounds of each reading_time_preference, None for unbounded
+READING_TIME_BOUNDS: Dict[str, Tuple[int, Optional[int]]] = {
+    'short': (0, 99),
+    'medium': (100, 300),
+    'long': (301, None),
+}
+
+
+class UnknownProfileError(LookupError):
+    """A profile id/version was sent without the profile and is not registered"""
+
+
+def profile_key(user_profile: Dict[str, Any]) -> str:
+    """Content hash of a profile (or of a CompiledProfile's source); equal profiles get equal keys whatever their key order"""
+    if isinstance(user_profile, CompiledProfile):
+        return user_profile.key
+    content = json.dumps(user_profile, sort_keys=True, default=str)
+    return hashlib.blake2b(content.encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
+
+
+class CompiledProfile:
+    """A well-formed profile (see scoring_engine.supports_profile) prepared for batch scoring"""
+
+    __slots__ = ('profile', 'key', 'interests', 'interest_matcher', 'history_matcher',
+                 'preferred_sources', 'topic_preferences', 'reading_time_preference', 'length_bounds')
+
+    def __init__(self, user_profile: Dict[str, Any], key: Optional[str] = None):
+        self.profile = user_profile
+        self.key = key or profile_key(user_profile)
+
+        # Matchers and sets are None when the profile does not have the key at all
+        self.interests: Tuple[str, ...] = tuple(user_profile.get('interests') or ())
+        self.interest_matcher: Optional[MultiPatternMatcher] = (
+            compile_patterns(self.interests) if 'interests' in user_profile else None
+        )
+        self.history_matcher: Optional[MultiPatternMatcher] = (
+            compile_patterns(user_profile['reading_history']) if 'reading_history' in user_profile else None
+        )
+        self.preferred_sources = (
+            frozenset(source.lower() for source in user_profile['preferred_sources'])
+            if 'preferred_sources' in user_profile else None
+        )
+        self.topic_preferences = (
+            frozenset(topic.lower() for topic in user_profile['topic_preferences'])
+            if 'topic_preferences' in user_profile else None
+        )
+        self.reading_time_preference = user_profile.get('reading_time_preference')
+        self.length_bounds = (
+            READING_TIME_BOUNDS.get(self.reading_time_preference)
+            if isinstance(self.reading_time_preference, str) else None
+        )
+
+    def __bool__(self) -> bool:
+        return bool(self.profile)
+
+    def __reduce__(self):
+        # Pool workers get the plain profile and compile it from their own cache
+        return compile_profile, (self.profile,)
+
+    def get(self, name: str, default: Any = None) -> Any:
+        return self.profile.get(name, default)
+
+    def has_reading_time(self) -> bool:
+        return 'reading_time_preference' in self.profile
+
+    def length_matches(self, word_count: np.ndarray) -> np.ndarray:
+        """Articles whose word count falls in the preferred reading-length bucket"""
+        if self.length_bounds is None:
+            return np.zeros(len(word_count), dtype=bool)
+        low, high = self.length_bounds
+        hits = word_count >= low
+        if high is not None:
+            hits &= word_count <= high
+        return hits
+
+
+class ProfileCache:
+    """LRU of compiled profiles by content hash, plus the latest version registered per profile id"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max(1, max_entries)
+        self.pid = os.getpid()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._compiled: 'OrderedDict[str, CompiledProfile]' = OrderedDict()
+        self._registered: 'OrderedDict[str, Tuple[str, CompiledProfile]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'ProfileCache':
+        """Build a cache from PROFILE_CACHE_SIZE"""
+        try:
+            return cls(max_entries=int(os.getenv('PROFILE_CACHE_SIZE', DEFAULT_MAX_ENTRIES)))
+        except ValueError as e:
+            logger.warning(f"Invalid profile cache settings, using defaults: {e}")
+            return cls()
+
+    def compile(self, user_profile: Dict[str, Any]) -> CompiledProfile:
+        """The compiled form of a profile, built on the first request that sends it"""
+        if isinstance(user_profile, CompiledProfile):
+            return user_profile
+
+        key = profile_key(user_profile)
+        with self._lock:
+            compiled = self._compiled.get(key)
+            if compiled is not None:
+                self._compiled.move_to_end(key)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+
+        compiled = CompiledProfile(user_profile, key)
+        with self._lock:
+            self._compiled[key] = compiled
+            while len(self._compiled) > self.max_entries:
+                self._compiled.popitem(last=False)
+                self.evictions += 1
+        return compiled
+
+    def register(self, profile_id: str, version: str, user_profile: Dict[str, Any]) -> CompiledProfile:
+        """Compile a profile and remember it as the current version of profile_id"""
+        compiled = self.compile(user_profile)
+        with self._lock:
+            self._registered[profile_id] = (version, compiled)
+            self._registered.move_to_end(profile_id)
+            while len(self._registered) > self.max_entries:
+                self._registered.popitem(last=False)
+        return compiled
+
+    def lookup(self, profile_id: str, version: str) -> CompiledProfile:
+        """The registered profile for an id and version; UnknownProfileError if absent or superseded"""
+        with self._lock:
+            entry = self._registered.get(profile_id)
+            if entry is None or entry[0] != version:
+                raise UnknownProfileError(
+                    f"Profile {profile_id!r} version {version!r} is not registered, send user_profile with it"
+                )
+            self._registered.move_to_end(profile_id)
+            return entry[1]
+
+    def snapshot_state(self) -> Dict[str, Any]:
+        """The raw profiles behind the compiled and registered ones, for a state snapshot"""
+        with self._lock:
+            return {
+                "compiled": [compiled.profile for compiled in self._compiled.values()],
+                "registered": [(profile_id, version, compiled.profile)
+                               for profile_id, (version, compiled) in self._registered.items()]
+            }
+
+    def restore_state(self, state: Dict[str, Any]):
+        """Compile and register the profiles of snapshot_state() again"""
+        for user_profile in state["compiled"]:
+            self.compile(user_profile)
+        for profile_id, version, user_profile in state["registered"]:
+            self.register(profile_id, version, user_profile)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current sizes"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._compiled),
+            "registered": len(self._registered),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+
+_shared: Optional[ProfileCache] = None
+_shared_lock = threading.Lock()
+
+
+def shared_profile_cache() -> ProfileCache:
+    """The per-process profile cache, created from the environment on first use"""
+    global _shared
+    with _shared_lock:
+        if _shared is None or _shared.pid != os.getpid():
+            _shared = ProfileCache.from_env()
+        return _shared
+
+
+def compile_profile(user_profile: Dict[str, Any]) -> CompiledProfile:
+    """CompiledProfile of a profile through the per-process cache"""
+    return shared_profile_cache().compile(user_profile)
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate detection for syndicated articles
+Articles are reduced to MinHash signatures over word shingles of their title
+and summary, and an LSH index over signature bands finds the earlier articles
+that may be copies of a new one without comparing it against all of them.
+Copies are grouped into clusters and only the best article of each cluster
+(by source credibility, then quality score) is kept. The index outlives a
+batch, so a copy arriving after its original is recognised too. Articles are
+indexed per scope (the sending agent), so one client's articles are never
+dropped as copies of another client's.
+"""
+
+import logging
+import os
+import re
+import time
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NUM_PERM = 64
+DEFAULT_BANDS = 16
+DEFAULT_THRESHOLD = 0.7
+DEFAULT_SHINGLE_SIZE = 3
+DEFAULT_MAX_ENTRIES = 50000
+DEFAULT_TTL_SECONDS = 48 * 3600
+
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+# Odd multipliers combining the word hashes of a shingle and the rows of a band
+_SHINGLE_MULTIPLIERS = np.array(
+    [0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93,
+     0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53, 0x94D049BB133111EB, 0xBF58476D1CE4E5B9],
+    dtype=np.uint64
+)
+# Signatures are computed for this many shingles at a time to bound the temporary matrix
+_BLOCK_SHINGLES = 8192
+
+_WORD_RE = re.compile(r'\w+')
+
+# Layout of the indexed keys, part of the snapshot parameters: (scope, article id)
+_KEY_LAYOUT = 'scoped'
+
+
+@lru_cache(maxsize=65536)
+def _word_hash(word: str) -> int:
+    return zlib.crc32(word.encode('utf-8', 'surrogatepass'))
+
+
+def article_text(item: Dict[str, Any]) -> str:
+    """The text an article's signature is computed from"""
+    return item.get('title', '') + ' ' + item.get('summary', '')
+
+
+class _Entry:
+    """An indexed article: its signature, band keys, text hash, cluster and rank"""
+
+    __slots__ = ('signature', 'band_keys', 'text_hash', 'cluster', 'rank', 'order', 'stored_at')
+
+    def __init__(self, signature: np.ndarray, band_keys: Tuple[int, ...], text_hash: int, cluster: Hashable,
+                 rank: Tuple, order: int, stored_at: float):
+        self.signature = signature
+        self.band_keys = band_keys
+        self.text_hash = text_hash
+        self.cluster = cluster
+        self.rank = rank
+        self.order = order
+        self.stored_at = stored_at
+
+
+class DedupIndex:
+    """MinHash/LSH index of recently seen articles, keyed by article id.
+
+    With `bands` bands of num_perm / bands rows, articles whose shingle sets
+    have a Jaccard similarity around (1 / bands) ** (bands / num_perm) or more
+    become candidates; candidates are confirmed as copies when their
+    signatures agree on at least `threshold` of the positions.
+    """
+
+    def __init__(self, num_perm: int = DEFAULT_NUM_PERM, bands: int = DEFAULT_BANDS,
+                 threshold: float = DEFAULT_THRESHOLD, shingle_size: int = DEFAULT_SHINGLE_SIZE,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL_SECONDS, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        if shingle_size > len(_SHINGLE_MULTIPLIERS):
+            raise ValueError(f"shingle_size must be at most {len(_SHINGLE_MULTIPLIERS)}")
+
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.seed = seed
+
+        # Fixed seed so signatures stay comparable across restarts
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 1 << 63, size=(num_perm, 1), dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 1 << 63, size=(num_perm, 1), dtype=np.uint64)
+        self._band_multipliers = rng.integers(1, 1 << 63, size=self.rows, dtype=np.uint64) | np.uint64(1)
+
+        self._entries: 'OrderedDict[Hashable, _Entry]' = OrderedDict()
+        # One bucket table per band: band key -> ids of the articles in the bucket
+        self._buckets: List[Dict[int, Set[Hashable]]] = [{} for _ in range(bands)]
+        self._clusters: Dict[Hashable, Set[Hashable]] = {}
+        self._order = 0
+
+        self.checked = 0
+        self.duplicates = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls) -> 'DedupIndex':
+        """Build an index from DEDUP_THRESHOLD, DEDUP_INDEX_SIZE and DEDUP_INDEX_TTL"""
+        try:
+            return cls(
+                threshold=float(os.getenv('DEDUP_THRESHOLD', DEFAULT_THRESHOLD)),
+                max_entries=int(os.getenv('DEDUP_INDEX_SIZE', DEFAULT_MAX_ENTRIES)),
+                ttl=float(os.getenv('DEDUP_INDEX_TTL', DEFAULT_TTL_SECONDS))
+            )
+        except ValueError as e:
+            logger.warning(f"Invalid dedup settings, using defaults: {e}")
+            return cls()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def shingles(self, text: str) -> np.ndarray:
+        """32-bit hashes of the text's word shingles (the words themselves for very short texts)"""
+        return self._shingle_batch([text])[0]
+
+    def _shingle_batch(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Shingle hashes of every text concatenated, and the number belonging to each text"""
+        word_lists = [[_word_hash(word) for word in _WORD_RE.findall(text.lower())] for text in texts]
+        lengths = np.array([len(words) for words in word_lists], dtype=np.int64)
+        words = np.fromiter((word for words in word_lists for word in words), dtype=np.uint64, count=int(lengths.sum()))
+
+        # Shingles start at every word that has shingle_size - 1 words after it in
+        # the same text; texts shorter than that contribute their words unshingled
+        ends = np.cumsum(lengths)
+        starts = ends - lengths
+        short = lengths < self.shingle_size
+        owner = np.repeat(np.arange(len(texts)), lengths)
+        position = np.arange(len(words)) - starts[owner]
+        first_word = (position <= (lengths - self.shingle_size)[owner]) | short[owner]
+
+        combined = words * _SHINGLE_MULTIPLIERS[0]
+        for offset in range(1, self.shingle_size):
+            shifted = np.zeros_like(words)
+            shifted[:len(words) - offset] = words[offset:]
+            combined ^= shifted * _SHINGLE_MULTIPLIERS[offset]
+        combined = (combined >> np.uint64(32)) ^ (combined & _MAX_HASH)
+        hashes = np.where(short[owner], words, combined)
+
+        counts = np.where(short, lengths, lengths - self.shingle_size + 1)
+        return hashes[first_word], counts
+
+    def signatures(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """(n, num_perm) MinHash signatures and a mask of the texts that had any words"""
+        flat, sizes = self._shingle_batch(texts)
+        signatures = np.full((len(texts), self.num_perm), _MAX_HASH, dtype=np.uint64)
+        valid = sizes > 0
+        if not valid.any():
+            return signatures.astype(np.uint32), valid
+
+        # Permute every shingle of the batch at once, a block at a time, then
+        # take the minimum of each text's columns
+        rows = np.flatnonzero(valid)
+        starts = np.concatenate(([0], np.cumsum(sizes[rows])[:-1]))
+        for block_start in range(0, len(flat), _BLOCK_SHINGLES):
+            block_end = block_start + _BLOCK_SHINGLES
+            # Multiply-shift hashing: the high 32 bits of a * x + b (mod 2 ** 64)
+            permuted = self._a * flat[block_start:block_end]
+            permuted += self._b
+            permuted >>= np.uint64(32)
+            # Texts overlapping this block, clipped to it
+            first = np.searchsorted(starts, block_start, side='right') - 1
+            last = np.searchsorted(starts, block_end, side='left')
+            offsets = np.clip(starts[first:last], block_start, None) - block_start
+            minima = np.minimum.reduceat(permuted, offsets, axis=1).T
+            signatures[rows[first:last]] = np.minimum(signatures[rows[first:last]], minima)
+        return signatures.astype(np.uint32), valid
+
+    def band_keys(self, signatures: np.ndarray) -> np.ndarray:
+        """(n, bands) bucket keys, one hash of each band's rows"""
+        banded = signatures.astype(np.uint64).reshape(len(signatures), self.bands, self.rows)
+        return (banded * self._band_multipliers).sum(axis=2, dtype=np.uint64)
+
+    def similarity(self, first: np.ndarray, second: np.ndarray) -> float:
+        """Estimated Jaccard similarity of two signatures"""
+        return float(np.count_nonzero(first == second)) / self.num_perm
+
+    def deduplicate(self, items: Sequence[Dict[str, Any]], rank: Callable[[Dict[str, Any]], Tuple],
+                    now: Optional[float] = None, scope: Hashable = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Index the items and return (kept items in input order, {dropped id: kept id}).
+
+        `rank` orders copies of a story, highest kept; on a tie the copy seen
+        first stays. An item whose best copy arrived in an earlier batch of the
+        same scope is dropped in favour of it. Items without an id or without
+        any text, and malformed ones (e.g. a None title or source), are always
+        kept and never indexed.
+        """
+        if now is None:
+            now = time.time()
+        self._expire(now)
+
+        ids: List[Optional[Tuple[Hashable, Hashable]]] = [None] * len(items)
+        indexed = {}
+        ranks = {}
+        for position, item in enumerate(items):
+            try:
+                doc_id = item.get('id') or item.get('url')
+                if doc_id is None:
+                    continue
+                hash(doc_id)
+                text = article_text(item)
+                text_hash = zlib.crc32(text.encode('utf-8', 'surrogatepass'))
+                ranks[position] = rank(item)
+            except Exception:
+                # Passed through undeduplicated, like the scorers pass malformed articles through
+                continue
+            ids[position] = (scope, doc_id)
+            indexed[position] = (text, text_hash)
+
+        # Signatures are only computed for articles the index has not seen with this text
+        fresh = {}
+        for position, (text, text_hash) in indexed.items():
+            entry = self._entries.get(ids[position])
+            if (entry is None or entry.text_hash != text_hash) and (ids[position], text_hash) not in fresh:
+                fresh[ids[position], text_hash] = position
+        signatures, valid = self.signatures([indexed[position][0] for position in fresh.values()])
+        keys = self.band_keys(signatures)
+        computed = {position: row for row, position in enumerate(fresh.values()) if valid[row]}
+
+        touched = {}
+        for position, (_, text_hash) in indexed.items():
+            doc_id = ids[position]
+            entry = self._entries.get(doc_id)
+            if entry is not None and entry.text_hash == text_hash:
+                entry.rank = ranks[position]
+                entry.stored_at = now
+                self._entries.move_to_end(doc_id)
+                touched[position] = entry.cluster
+                continue
+
+            row = computed.get(fresh[doc_id, text_hash])
+            if entry is not None:
+                # The article was edited; index it again under its new text
+                self._remove(doc_id, evicted=False)
+            if row is not None:
+                touched[position] = self._add(doc_id, signatures[row], keys[row], text_hash,
+                                              ranks[position], now)
+        self.checked += len(touched)
+
+        best = {cluster: self._best(cluster) for cluster in set(touched.values())}
+        kept = []
+        duplicates = {}
+        emitted = set()
+        for position, item in enumerate(items):
+            cluster = touched.get(position)
+            doc_id = ids[position]
+            if cluster is None:
+                kept.append(item)
+            elif best[cluster] == doc_id and doc_id not in emitted:
+                kept.append(item)
+                emitted.add(doc_id)
+            else:
+                # Repeats of an id already kept are dropped without a mapping
+                if best[cluster] != doc_id:
+                    duplicates[doc_id[1]] = best[cluster][1]
+                self.duplicates += 1
+
+        self._evict()
+        return kept, duplicates
+
+    def _add(self, doc_id: Hashable, signature: np.ndarray, keys: np.ndarray, text_hash: int,
+             rank: Tuple, now: float) -> Hashable:
+        """Index a new article under the cluster of its most similar confirmed copy; returns the cluster"""
+        self._order += 1
+        band_keys = tuple(int(key) for key in keys)
+        # Clusters are named after the order of their first article
+        cluster = self._order
+        best_similarity = 0.0
+        for candidate in self._candidates(band_keys):
+            if candidate[0] != doc_id[0]:
+                # Another scope's article
+                continue
+            similarity = self.similarity(signature, self._entries[candidate].signature)
+            if similarity >= self.threshold and similarity > best_similarity:
+                cluster = self._entries[candidate].cluster
+                best_similarity = similarity
+
+        self._entries[doc_id] = _Entry(signature, band_keys, text_hash, cluster, rank, self._order, now)
+        self._clusters.setdefault(cluster, set()).add(doc_id)
+        for band, key in enumerate(band_keys):
+            self._buckets[band].setdefault(key, set()).add(doc_id)
+        return cluster
+
+    def _candidates(self, band_keys: Tuple[int, ...]) -> Set[Hashable]:
+        candidates = set()
+        for band, key in enumerate(band_keys):
+            bucket = self._buckets[band].get(key)
+            if bucket:
+                candidates |= bucket
+        return candidates
+
+    def _best(self, cluster: Hashable) -> Hashable:
+        """Id of the highest-ranked member of a cluster, the earliest on a tie"""
+        return max(
+            self._clusters[cluster],
+            key=lambda doc_id: (self._entries[doc_id].rank, -self._entries[doc_id].order)
+        )
+
+    def _remove(self, doc_id: Hashable, evicted: bool = True):
+        entry = self._entries.pop(doc_id)
+        for band, key in enumerate(entry.band_keys):
+            bucket = self._buckets[band][key]
+            bucket.discard(doc_id)
+            if not bucket:
+                del self._buckets[band][key]
+        members = self._clusters[entry.cluster]
+        members.discard(doc_id)
+        if not members:
+            del self._clusters[entry.cluster]
+        if evicted:
+            self.evictions += 1
+
+    def _expire(self, now: float):
+        """Drop entries older than the TTL; refreshed entries move to the end, so stop at the first live one"""
+        cutoff = now - self.ttl
+        while self._entries:
+            doc_id, entry = next(iter(self._entries.items()))
+            if entry.stored_at >= cutoff:
+                break
+            self._remove(doc_id)
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def snapshot_state(self) -> Dict[str, Any]:
+        """The indexed articles as columns, least recently seen first, for a state snapshot"""
+        entries = list(self._entries.values())
+        return {
+            "params": (self.num_perm, self.bands, self.shingle_size, self.seed, _KEY_LAYOUT),
+            "ids": list(self._entries),
+            "signatures": np.array([entry.signature for entry in entries], dtype=np.uint32).reshape(-1, self.num_perm),
+            "text_hashes": [entry.text_hash for entry in entries],
+            "clusters": [entry.cluster for entry in entries],
+            "ranks": [entry.rank for entry in entries],
+            "orders": [entry.order for entry in entries],
+            "stored_at": [entry.stored_at for entry in entries],
+            "order": self._order
+        }
+
+    def restore_state(self, state: Dict[str, Any]):
+        """Replace the index with the articles of snapshot_state(); expired ones go on the next batch"""
+        params = (self.num_perm, self.bands, self.shingle_size, self.seed, _KEY_LAYOUT)
+        if tuple(state["params"]) != params:
+            logger.warning(f"Ignoring dedup snapshot built with {tuple(state['params'])}, index uses {params}")
+            return
+
+        self._entries.clear()
+        self._buckets = [{} for _ in range(self.bands)]
+        self._clusters = {}
+        ids = state["ids"]
+        signatures = state["signatures"]
+        keys = self.band_keys(signatures)
+        columns = zip(ids, map(tuple, keys.tolist()), state["text_hashes"], state["clusters"],
+                      state["ranks"], state["orders"], state["stored_at"])
+        for row, (doc_id, band_keys, text_hash, cluster, rank, order, stored_at) in enumerate(columns):
+            self._entries[doc_id] = _Entry(signatures[row], band_keys, text_hash, cluster, rank, order, stored_at)
+            members = self._clusters.get(cluster)
+            if members is None:
+                self._clusters[cluster] = {doc_id}
+            else:
+                members.add(doc_id)
+        # Band by band, creating a set only for keys not seen yet
+        for buckets, band_keys in zip(self._buckets, keys.T.tolist()):
+            for doc_id, key in zip(ids, band_keys):
+                bucket = buckets.get(key)
+                if bucket is None:
+                    buckets[key] = {doc_id}
+                else:
+                    bucket.add(doc_id)
+        self._order = state["order"]
+        self._evict()
+
+    def stats(self) -> Dict[str, Any]:
+        """Index size and how many checked articles were dropped as copies"""
+        return {
+            "size": len(self._entries),
+            "clusters": len(self._clusters),
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+            "evictions": self.evictions,
+            "duplicate_rate": self.duplicates / self.checked if self.checked else 0.0
+        }
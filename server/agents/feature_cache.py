@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Incremental feature cache shared by the agents
+Per-article features are keyed by article id plus a hash of the content they
+depend on, kept in a bounded LRU with a TTL and optionally persisted to SQLite
+so restarted agents do not start cold (sqlite3 is only imported then)
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 50000
+DEFAULT_TTL_SECONDS = 6 * 3600
+
+
+def feature_key(item: Dict[str, Any]) -> str:
+    """Cache key of an article: its id plus a hash of the fields features are derived from"""
+    content = repr((
+        item.get('title', ''),
+        item.get('summary', ''),
+        item.get('source', ''),
+        bool(item.get('image_url')),
+        item.get('published_at', '')
+    ))
+    digest = hashlib.blake2b(content.encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
+    return f"{item.get('id', 'unknown')}:{digest}"
+
+
+class FeatureCache:
+    """Bounded LRU + TTL cache of per-article feature dicts with optional SQLite persistence"""
+
+    def __init__(self, namespace: str, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 ttl: float = DEFAULT_TTL_SECONDS, path: Optional[str] = None):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.pid = os.getpid()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries: 'OrderedDict[str, Tuple[float, Dict[str, Any]]]' = OrderedDict()
+        self._pending: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self._db: Optional['sqlite3.Connection'] = None
+
+        if path:
+            self._open(path)
+
+    @classmethod
+    def from_env(cls, namespace: str) -> 'FeatureCache':
+        """Build a cache from FEATURE_CACHE_SIZE, FEATURE_CACHE_TTL and FEATURE_CACHE_PATH"""
+        try:
+            max_entries = int(os.getenv('FEATURE_CACHE_SIZE', DEFAULT_MAX_ENTRIES))
+            ttl = float(os.getenv('FEATURE_CACHE_TTL', DEFAULT_TTL_SECONDS))
+        except ValueError as e:
+            logger.warning(f"Invalid feature cache settings, using defaults: {e}")
+            max_entries, ttl = DEFAULT_MAX_ENTRIES, DEFAULT_TTL_SECONDS
+        return cls(namespace, max_entries=max_entries, ttl=ttl, path=os.getenv('FEATURE_CACHE_PATH') or None)
+
+    def _open(self, path: str):
+        """Open the SQLite store and warm the in-memory cache from it"""
+        import sqlite3
+
+        try:
+            self._db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS features ('
+                'namespace TEXT NOT NULL, key TEXT NOT NULL, stored_at REAL NOT NULL, features TEXT NOT NULL, '
+                'PRIMARY KEY (namespace, key))'
+            )
+            self._db.commit()
+            self._warm()
+        except sqlite3.Error as e:
+            logger.warning(f"Feature cache persistence disabled ({path}): {e}")
+            self._db = None
+
+    def _warm(self):
+        """Load the most recent unexpired entries of this namespace"""
+        cutoff = time.time() - self.ttl
+        rows = self._db.execute(
+            'SELECT key, stored_at, features FROM features WHERE namespace = ? AND stored_at > ? '
+            'ORDER BY stored_at DESC LIMIT ?',
+            (self.namespace, cutoff, self.max_entries)
+        ).fetchall()
+        # Oldest first so the most recent entries end up most-recently-used
+        for key, stored_at, features in reversed(rows):
+            self._entries[key] = (stored_at, json.loads(features))
+        logger.info(f"Feature cache '{self.namespace}' warmed with {len(rows)} entries")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Cached features for key, or None on a miss or expired entry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, features: Dict[str, Any]):
+        """Store features for key, evicting the least recently used entries beyond max_entries"""
+        entry = (time.time(), features)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            if self._db is not None:
+                self._pending[key] = entry
+
+    def flush(self):
+        """Write entries added since the last flush to the SQLite store"""
+        if self._db is None:
+            return
+        import sqlite3
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            try:
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO features (namespace, key, stored_at, features) VALUES (?, ?, ?, ?)',
+                    [(self.namespace, key, stored_at, json.dumps(features)) for key, (stored_at, features) in pending.items()]
+                )
+                self._db.execute(
+                    'DELETE FROM features WHERE namespace = ? AND stored_at < ?',
+                    (self.namespace, time.time() - self.ttl)
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to persist feature cache '{self.namespace}': {e}")
+
+    def snapshot_state(self) -> Dict[str, Any]:
+        """Unexpired entries, least recently used first, for a state snapshot"""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            return {"entries": [(key, entry) for key, entry in self._entries.items() if entry[0] > cutoff]}
+
+    def restore_state(self, state: Dict[str, Any]):
+        """Add the unexpired entries of snapshot_state() as the least recently used ones"""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            current, self._entries = self._entries, OrderedDict(
+                (key, entry) for key, entry in state["entries"] if entry[0] > cutoff
+            )
+            self._entries.update(current)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        lookups = self.hits + self.misses
+        return {
+            "namespace": self.namespace,
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+    def close(self):
+        """Flush pending entries and close the SQLite store"""
+        self.flush()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+_shared_caches: Dict[str, FeatureCache] = {}
+_shared_lock = threading.Lock()
+
+
+def shared_cache(namespace: str) -> FeatureCache:
+    """The per-process cache for a namespace, created from the environment on first use"""
+    with _shared_lock:
+        cache = _shared_caches.get(namespace)
+        # A forked pool worker must not reuse its parent's SQLite connection,
+        # but starts from the entries it inherited (e.g. from a restored snapshot)
+        if cache is None or cache.pid != os.getpid():
+            inherited = cache
+            cache = FeatureCache.from_env(namespace)
+            if inherited is not None:
+                cache.restore_state({"entries": list(inherited._entries.items())})
+            _shared_caches[namespace] = cache
+        return cache
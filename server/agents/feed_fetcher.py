@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+"""
+Feed ingestion for the news fetcher agent
+RSS, Atom and JSON Feed sources are fetched concurrently through one pooled
+httpx.AsyncClient, with a cap on concurrent requests per host, and with
+conditional requests (ETag / Last-Modified) so an unchanged feed costs a 304
+and no parsing. Validators are kept per scope (the sending agent), and only
+once the articles that came with them were sent to it, so a 304 adds no
+articles only for a caller that already has them. XML feeds are parsed
+incrementally as the response streams in, each item turned into an article
+dict as soon as its closing tag arrives, then dropped from the tree.
+
+Sources come from other agents, so every request, redirects included, must
+go to a public address (or to a host of FEED_ALLOWED_HOSTS, when set): the
+agents' own endpoints and the rest of the private network are off limits.
+"""
+
+import asyncio
+import html
+import ipaddress
+import json
+import logging
+import os
+import re
+import socket
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+from xml.etree.ElementTree import Element, XMLPullParser
+
+from timeparse import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONNECTIONS = 32
+DEFAULT_PER_HOST = 4
+DEFAULT_TIMEOUT_SECONDS = 10.0
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+MAX_REDIRECTS = 5
+# (scope, feed) pairs whose validators are remembered for conditional requests
+MAX_TRACKED_FEEDS = 1024
+USER_AGENT = 'BlockchainVibe/1.0 (News Aggregator)'
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+CONTENT = '{http://purl.org/rss/1.0/modules/content/}'
+DC = '{http://purl.org/dc/elements/1.1/}'
+MEDIA = '{http://search.yahoo.com/mrss/}'
+
+_TAG_RE = re.compile(r'<[^>]*>')
+_SPACE_RE = re.compile(r'\s+')
+_IMG_RE = re.compile(r'<img[^>]+src="([^"]+)"', re.IGNORECASE)
+
+
+def clean_text(text: Optional[str]) -> str:
+    """Text of an HTML fragment: tags removed, entities decoded, whitespace collapsed"""
+    if not text:
+        return ''
+    return _SPACE_RE.sub(' ', html.unescape(_TAG_RE.sub(' ', text))).strip()
+
+
+def iso_timestamp(value: Optional[str]) -> Optional[str]:
+    """A feed date (RFC 2822 or ISO 8601) as ISO 8601 UTC, the raw value if unparseable"""
+    if not value:
+        return None
+    timestamp = parse_timestamp(value.strip())
+    if timestamp is None:
+        return value.strip()
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+def _text(element: Element, *tags: str) -> str:
+    """Text of the first of the tags present as a child of element"""
+    for tag in tags:
+        child = element.find(tag)
+        if child is not None and child.text:
+            return child.text.strip()
+    return ''
+
+
+def _article(source: Dict[str, Any], guid: str, title: str, link: str, summary: str, content: str,
+             published: str, categories: List[str], image_url: Optional[str], author: str) -> Optional[Dict[str, Any]]:
+    """Article dict in the shape the JS aggregator produces, or None without a title or link"""
+    title = clean_text(title)
+    if not title or not link:
+        return None
+    return {
+        "id": guid or link,
+        "title": title,
+        "url": link,
+        "source": source.get('name') or urlsplit(link).netloc,
+        "published_at": iso_timestamp(published),
+        "summary": clean_text(summary),
+        "content": clean_text(content or summary),
+        "categories": categories or ([source['category']] if source.get('category') else []),
+        "image_url": image_url,
+        "author": clean_text(author) or source.get('name', '')
+    }
+
+
+def rss_item(element: Element, source: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    description = _text(element, 'description')
+    image_url = None
+    for tag in (MEDIA + 'thumbnail', MEDIA + 'content', 'enclosure'):
+        media = element.find(tag)
+        if media is not None and media.get('url') and (tag != 'enclosure' or media.get('type', '').startswith('image')):
+            image_url = media.get('url')
+            break
+    if image_url is None:
+        match = _IMG_RE.search(description)
+        image_url = match.group(1) if match else None
+    return _article(
+        source,
+        guid=_text(element, 'guid'),
+        title=_text(element, 'title'),
+        link=_text(element, 'link'),
+        summary=description,
+        content=_text(element, CONTENT + 'encoded'),
+        published=_text(element, 'pubDate', DC + 'date'),
+        categories=[clean_text(c.text) for c in element.findall('category') if c.text and c.text.strip()],
+        image_url=image_url,
+        author=_text(element, DC + 'creator', 'author')
+    )
+
+
+def atom_entry(element: Element, source: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    link = ''
+    for candidate in element.findall(ATOM + 'link'):
+        if candidate.get('rel', 'alternate') == 'alternate' and candidate.get('href'):
+            link = candidate.get('href')
+            break
+    author = element.find(ATOM + 'author')
+    thumbnail = element.find(MEDIA + 'thumbnail')
+    return _article(
+        source,
+        guid=_text(element, ATOM + 'id'),
+        title=_text(element, ATOM + 'title'),
+        link=link,
+        summary=_text(element, ATOM + 'summary'),
+        content=_text(element, ATOM + 'content'),
+        published=_text(element, ATOM + 'published', ATOM + 'updated'),
+        categories=[c.get('term') for c in element.findall(ATOM + 'category') if c.get('term')],
+        image_url=thumbnail.get('url') if thumbnail is not None else None,
+        author=_text(author, ATOM + 'name') if author is not None else ''
+    )
+
+
+def json_feed_items(document: Dict[str, Any], source: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Articles of a JSON Feed (jsonfeed.org) document"""
+    articles = []
+    for item in document.get('items') or ():
+        authors = item.get('authors') or ([item['author']] if item.get('author') else [])
+        article = _article(
+            source,
+            guid=str(item.get('id') or ''),
+            title=item.get('title') or '',
+            link=item.get('url') or item.get('external_url') or '',
+            summary=item.get('summary') or item.get('content_text') or item.get('content_html') or '',
+            content=item.get('content_html') or item.get('content_text') or '',
+            published=item.get('date_published') or item.get('date_modified'),
+            categories=list(item.get('tags') or ()),
+            image_url=item.get('image') or item.get('banner_image'),
+            author=authors[0].get('name', '') if authors and isinstance(authors[0], dict) else ''
+        )
+        if article is not None:
+            articles.append(article)
+    return articles
+
+
+class FeedError(Exception):
+    """A feed answered with an HTTP error or an oversized body"""
+
+
+class StreamingFeedParser:
+    """Incremental RSS/Atom parser: feed() bytes as they arrive, take finished articles from items()"""
+
+    _ITEM_TAGS = {'item': rss_item, ATOM + 'entry': atom_entry}
+
+    def __init__(self, source: Dict[str, Any]):
+        self.source = source
+        self._parser = XMLPullParser(events=('start', 'end'))
+        # Open elements, so finished items can be detached from their parent
+        self._stack: List[Element] = []
+
+    def feed(self, data: bytes):
+        self._parser.feed(data)
+
+    def close(self):
+        self._parser.close()
+
+    def items(self) -> Iterator[Dict[str, Any]]:
+        for event, element in self._parser.read_events():
+            if event == 'start':
+                self._stack.append(element)
+                continue
+            self._stack.pop()
+            build = self._ITEM_TAGS.get(element.tag)
+            if build is None:
+                continue
+            article = build(element, self.source)
+            # Keep memory flat however long the feed is
+            if self._stack:
+                self._stack[-1].remove(element)
+            if article is not None:
+                yield article
+
+
+class FeedResult:
+    """Outcome of fetching one source"""
+
+    __slots__ = ('source', 'status', 'items', 'bytes', 'elapsed', 'error', 'validators')
+
+    def __init__(self, source: Dict[str, Any], status: str, items: List[Dict[str, Any]] = None,
+                 size: int = 0, elapsed: float = 0.0, error: str = None,
+                 validators: Tuple[Optional[str], Optional[str]] = (None, None)):
+        self.source = source
+        self.status = status
+        self.items = items or []
+        self.bytes = size
+        self.elapsed = elapsed
+        self.error = error
+        # ETag and Last-Modified of a fetched response, for FeedFetcher.remember()
+        self.validators = validators
+
+    def report(self) -> Dict[str, Any]:
+        """Per-feed summary sent back with a fetch_sources response"""
+        report = {
+            "name": self.source.get('name'),
+            "url": self.source.get('url'),
+            "status": self.status,
+            "items": len(self.items),
+            "bytes": self.bytes,
+            "elapsed_ms": round(self.elapsed * 1000, 1)
+        }
+        if self.error:
+            report["error"] = self.error
+        return report
+
+
+class FeedFetcher:
+    """Concurrent, conditional feed fetching over one pooled HTTP client.
+
+    Configured by FEED_MAX_CONNECTIONS (pool size), FEED_PER_HOST_LIMIT
+    (concurrent requests per host), FEED_TIMEOUT (seconds per feed) and
+    FEED_MAX_BYTES (larger responses are cut off and reported as errors).
+    FEED_ALLOWED_HOSTS, a comma-separated list of hosts (".example.com" for
+    its subdomains too), restricts sources to those hosts; without it any
+    host is allowed whose addresses are all public.
+    """
+
+    def __init__(self, max_connections: int = DEFAULT_MAX_CONNECTIONS, per_host: int = DEFAULT_PER_HOST,
+                 timeout: float = DEFAULT_TIMEOUT_SECONDS, max_bytes: int = DEFAULT_MAX_BYTES,
+                 allowed_hosts: Optional[List[str]] = None):
+        self.max_connections = max(1, max_connections)
+        self.per_host = max(1, per_host)
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.allowed_hosts = [host.strip().lower() for host in allowed_hosts or [] if host.strip()] or None
+
+        self.fetched = 0
+        self.not_modified = 0
+        self.errors = 0
+        self.bytes = 0
+
+        self._client = None
+        self._hosts: Dict[str, asyncio.Semaphore] = {}
+        # (scope, url) -> (ETag, Last-Modified) of the last full response delivered to the scope
+        self._feeds: 'OrderedDict[Tuple[Hashable, str], Tuple[Optional[str], Optional[str]]]' = OrderedDict()
+
+    @classmethod
+    def from_env(cls) -> 'FeedFetcher':
+        try:
+            return cls(
+                max_connections=int(os.getenv('FEED_MAX_CONNECTIONS', DEFAULT_MAX_CONNECTIONS)),
+                per_host=int(os.getenv('FEED_PER_HOST_LIMIT', DEFAULT_PER_HOST)),
+                timeout=float(os.getenv('FEED_TIMEOUT', DEFAULT_TIMEOUT_SECONDS)),
+                max_bytes=int(os.getenv('FEED_MAX_BYTES', DEFAULT_MAX_BYTES)),
+                allowed_hosts=os.getenv('FEED_ALLOWED_HOSTS', '').split(',')
+            )
+        except ValueError as e:
+            logger.warning(f"Invalid feed fetcher settings, using defaults: {e}")
+            return cls()
+
+    def client(self):
+        """The shared client, created on first use (httpx is only imported then)"""
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                timeout=self.timeout,
+                # Redirects are followed by _fetch, which checks every target
+                follow_redirects=False,
+                headers={'User-Agent': USER_AGENT}
+            )
+        return self._client
+
+    async def fetch_all(self, sources: List[Dict[str, Any]], scope: Hashable = None) -> List[FeedResult]:
+        """Fetch every source concurrently; failures are reported per source, not raised"""
+        return await asyncio.gather(*[self.fetch(source, scope) for source in sources])
+
+    async def fetch(self, source: Dict[str, Any], scope: Hashable = None) -> FeedResult:
+        """Fetch and parse one source ({"url", "name", "category"}) for a scope.
+
+        The request carries the validators remember()ed for the scope; a 304
+        answer is status "not_modified", with no articles: the scope got them
+        with that earlier response.
+        """
+        start = time.perf_counter()
+        url = source.get('url') if isinstance(source, dict) else None
+        if not url:
+            self.errors += 1
+            return FeedResult(source if isinstance(source, dict) else {}, 'error', error="source has no url")
+
+        semaphore = self._hosts.get(urlsplit(url).netloc)
+        if semaphore is None:
+            semaphore = self._hosts[urlsplit(url).netloc] = asyncio.Semaphore(self.per_host)
+        try:
+            async with semaphore:
+                result = await asyncio.wait_for(self._fetch(source, url, (scope, url)), self.timeout)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Failed to fetch feed {source.get('name') or url}: {e!r}")
+            result = FeedResult(source, 'error', error=str(e) or type(e).__name__)
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    async def _fetch(self, source: Dict[str, Any], url: str, key: Tuple[Hashable, str]) -> FeedResult:
+        etag, last_modified = self._feeds.get(key, (None, None))
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        target = url
+        for _ in range(MAX_REDIRECTS + 1):
+            await self.check_url(target)
+            async with self.client().stream('GET', target, headers=headers) as response:
+                if response.is_redirect:
+                    target = str(response.url.join(response.headers['location']))
+                    continue
+                if response.status_code == 304:
+                    # The entry may also have been evicted while the request was in flight
+                    if not headers or key not in self._feeds:
+                        raise FeedError("HTTP 304 to a request without validators")
+                    self.not_modified += 1
+                    self._feeds.move_to_end(key)
+                    return FeedResult(source, 'not_modified')
+                if response.status_code >= 400:
+                    raise FeedError(f"HTTP {response.status_code}")
+
+                items, size = await self._parse(response, source)
+                break
+        else:
+            raise FeedError(f"more than {MAX_REDIRECTS} redirects")
+
+        self.fetched += 1
+        self.bytes += size
+        return FeedResult(source, 'fetched', items, size,
+                          validators=(response.headers.get('etag'), response.headers.get('last-modified')))
+
+    def remember(self, results: List[FeedResult], scope: Hashable = None):
+        """Keep the validators of fetched results for the scope's next requests.
+
+        Call once their articles were sent to the scope: until then its next
+        fetch downloads the feeds in full again, so a response that timed out
+        or failed to send does not turn into articles it never receives.
+        """
+        for result in results:
+            if result.status != 'fetched':
+                continue
+            key = (scope, result.source['url'])
+            if any(result.validators):
+                self._feeds[key] = result.validators
+                self._feeds.move_to_end(key)
+            else:
+                self._feeds.pop(key, None)
+        while len(self._feeds) > MAX_TRACKED_FEEDS:
+            self._feeds.popitem(last=False)
+
+    async def check_url(self, url: str):
+        """Raise FeedError unless url is http(s) on an allowed host.
+
+        With FEED_ALLOWED_HOSTS the host must be listed; otherwise every
+        address it resolves to must be public, not loopback, link-local,
+        private or reserved. The client resolves the host again to connect,
+        so where DNS itself is not trusted, set FEED_ALLOWED_HOSTS.
+        """
+        parts = urlsplit(url)
+        host = (parts.hostname or '').rstrip('.').lower()
+        if parts.scheme not in ('http', 'https') or not host:
+            raise FeedError(f"unsupported feed URL {url!r}")
+        if self.allowed_hosts is not None:
+            if not any(host == allowed or allowed.startswith('.') and host.endswith(allowed)
+                       for allowed in self.allowed_hosts):
+                raise FeedError(f"host {host} is not in FEED_ALLOWED_HOSTS")
+            return
+
+        try:
+            port = parts.port or (443 if parts.scheme == 'https' else 80)
+            addresses = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except (socket.gaierror, ValueError) as e:
+            raise FeedError(f"cannot resolve {host}: {e}")
+        for *_, sockaddr in addresses:
+            address = ipaddress.ip_address(sockaddr[0].split('%')[0])
+            if not address.is_global or address.is_multicast:
+                raise FeedError(f"host {host} resolves to non-public address {address}")
+
+    async def _parse(self, response, source: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], int]:
+        """Articles of a streamed response and its size in bytes"""
+        size = 0
+        items: List[Dict[str, Any]] = []
+        chunks: List[bytes] = []
+        parser = None
+        is_json = 'json' in response.headers.get('content-type', '')
+        async for chunk in response.aiter_bytes():
+            if size == 0:
+                # JSON feeds are sometimes served as text/xml or text/plain
+                is_json = is_json or chunk.lstrip()[:1] == b'{'
+                if not is_json:
+                    parser = StreamingFeedParser(source)
+            size += len(chunk)
+            if size > self.max_bytes:
+                raise FeedError(f"feed larger than {self.max_bytes} bytes")
+            if parser is None:
+                chunks.append(chunk)
+            else:
+                parser.feed(chunk)
+                items.extend(parser.items())
+
+        if parser is not None:
+            parser.close()
+            items.extend(parser.items())
+        elif chunks:
+            # JSON Feed documents are parsed whole
+            items = json_feed_items(json.loads(b''.join(chunks)), source)
+        return items, size
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "feeds": len(self._feeds),
+            "fetched": self.fetched,
+            "not_modified": self.not_modified,
+            "errors": self.errors,
+            "bytes": self.bytes
+        }
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
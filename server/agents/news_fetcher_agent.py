@@ -4,67 +4,243 @@ Fetch.ai uAgents - News Fetcher Agent
 This agent is responsible for fetching and processing news from various sources
 """
 
+from __future__ import annotations
+
 import asyncio
 import json
 import logging
+import time
 from datetime import datetime
-from typing import List, Dict, Any
-from uagents import Agent, Context, Model
-from uagents.network import Network
+from typing import TYPE_CHECKING, List, Dict, Any, Hashable, Optional, Tuple
+
+import langid
+import scoring_engine
+from agent_metrics import agent_placement, metrics, metrics_port, queue_depth
+from article_record import ArticleRecord, wire_payload
+from chunk_stream import ChunkStreams, StreamError
+from compiled_profile import profile_key
+from dedup_index import DedupIndex
+from feed_fetcher import FeedFetcher, FeedResult
+from pattern_matcher import MultiPatternMatcher
+from request_scheduler import Overloaded, RequestScheduler, Ticket
+from feature_cache import feature_key, shared_cache
+from shard_executor import ShardExecutor
+from state_snapshot import StateSnapshots
+from relevance_scorer_agent import RelevanceScorerAgent, validate_page, validate_scoring_mode
+from result_cache import ResultCache, request_key
+from timeparse import Clock, hours_between, parse_timestamp, system_clock
+from wire_codec import WireCodec
+
+if TYPE_CHECKING:
+    from uagents import Context
+    from agent_messages import NewsRequest
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Define models for agent communication
-class NewsRequest(Model):
-    action: str
-    data: List[Dict[str, Any]]
-    user_profile: Dict[str, Any] = None
+# Source lists, compiled once at startup
+CREDIBLE_SOURCES = ['coindesk', 'cointelegraph', 'decrypt', 'the block', 'cryptoslate']
+CREDIBLE_SOURCE_MATCHER = MultiPatternMatcher(CREDIBLE_SOURCES)
 
-class NewsResponse(Model):
-    success: bool
-    data: List[Dict[str, Any]]
-    processing_time: float
-    agent_name: str
+# Credibility tiers in priority order: the first tier with a hit wins
+SOURCE_TIERS = [
+    (['coindesk', 'cointelegraph', 'decrypt', 'the block'], 0.9),  # Tier 1: Highly credible sources
+    (['cryptoslate', 'bitcoin magazine', 'ethereum foundation'], 0.7),  # Tier 2: Good sources
+    (['medium', 'substack', 'blog'], 0.5),  # Tier 3: Average sources
+]
+SOURCE_TIER_MATCHER = MultiPatternMatcher(source for sources, _ in SOURCE_TIERS for source in sources)
+SOURCE_TIER_SCORES = [credibility for sources, credibility in SOURCE_TIERS for _ in sources]
 
 class NewsFetcherAgent:
-    def __init__(self):
+    def __init__(self, create_agent: bool = True, clock: Clock = system_clock):
+        self.clock = clock
+        self.executor = ShardExecutor.from_env()
+        # In-process scorer for process_and_score, sharing this agent's clock
+        self.scorer = RelevanceScorerAgent(create_agent=False, clock=clock)
+        self.streams = ChunkStreams.from_env()
+        self.dedup = DedupIndex.from_env()
+        # Dedup runs on a thread; the index (its band tables and eviction order span
+        # every scope) takes one batch at a time, and snapshots wait for it
+        self.dedup_lock = asyncio.Lock()
+        self.results = ResultCache.from_env()
+        self.codec = WireCodec.from_env()
+        self.feeds = FeedFetcher.from_env()
+        self.scheduler = RequestScheduler.from_env()
+        if not create_agent:
+            # Processing-only instance, e.g. inside a shard worker process
+            return
+        
+        # uagents is only loaded by processes that run an agent
+        from uagents import Agent
+        
+        # Start warm from the last snapshot of any replica, when enabled; before the
+        # first batch, so process pool workers fork with the restored state
+        self.snapshots = StateSnapshots.from_env("news_fetcher")
+        self.snapshots.restore(self)
+        
+        # Replicas started by run_agents.py get their own port, and a seed of their own
+        # so each has a distinct address
+        self.port, self.replica = agent_placement(8001)
+        seed = "blockchainvibe_news_fetcher_2024"
         self.agent = Agent(
             name="news_fetcher",
-            seed="blockchainvibe_news_fetcher_2024",
-            port=8001,
-            endpoint=["http://localhost:8001/submit"]
+            seed=seed if self.replica == 0 else f"{seed}_replica_{self.replica}",
+            port=self.port,
+            endpoint=[f"http://localhost:{self.port}/submit"],
+            # Every message is handed over on arrival; the scheduler decides when it runs
+            handle_messages_concurrently=True
         )
         self.setup_handlers()
     
     def setup_handlers(self):
+        from agent_messages import NewsRequest, NewsResponse
+        
         @self.agent.on_event("startup")
         async def startup(ctx: Context):
             ctx.logger.info(f"News Fetcher Agent started: {self.agent.name}")
             ctx.logger.info(f"Agent address: {self.agent.address}")
+            ctx.logger.info(f"Processing executor: {self.executor.mode} ({self.executor.workers} workers)")
+            metrics.add_source("feature_cache", lambda: {
+                "news_fetcher": shared_cache("news_fetcher").stats()
+            })
+            metrics.add_source("profile_cache", self.scorer.profiles.stats)
+            metrics.add_source("dedup_index", self.dedup.stats)
+            metrics.add_source("tfidf_index", self.scorer.tfidf.stats)
+            metrics.add_source("result_cache", self.results.stats)
+            metrics.add_source("feeds", self.feeds.stats)
+            metrics.add_source("wire_codec", self.codec.stats)
+            metrics.add_source("scheduler", self.scheduler.stats)
+            # Loads httpx now rather than on the first fetch_sources request
+            self.feeds.client()
+            metrics.add_source("agent", lambda: {
+                "name": self.agent.name,
+                "address": self.agent.address,
+                "port": self.port,
+                "replica": self.replica
+            })
+            metrics.add_source("queue", lambda: queue_depth(self.agent))
+            await metrics.start(metrics_port(self.port))
+        
+        if self.snapshots.enabled:
+            @self.agent.on_interval(period=self.snapshots.interval)
+            async def save_snapshot(ctx: Context):
+                await self.save_snapshot()
+        
+        @self.agent.on_event("shutdown")
+        async def shutdown(ctx: Context):
+            await metrics.stop()
+            await self.feeds.close()
+            async with self.dedup_lock:
+                state = self.snapshot_state()
+            self.snapshots.save(state)
+            self.executor.shutdown()
+            self.scorer.executor.shutdown()
+            shared_cache("news_fetcher").close()
         
         @self.agent.on_message(model=NewsRequest)
         async def handle_news_request(ctx: Context, sender: str, msg: NewsRequest):
             ctx.logger.info(f"Received news request: {msg.action}")
             
             start_time = datetime.now()
+            start_ns = metrics.begin_request()
+            success = True
+            ticket = None
             
             try:
-                if msg.action == "process_news":
-                    processed_news = await self.process_news(msg.data)
-                    
-                    response = NewsResponse(
-                        success=True,
-                        data=processed_news,
-                        processing_time=(datetime.now() - start_time).total_seconds(),
-                        agent_name="news_fetcher"
-                    )
+                ticket = await self.scheduler.acquire(msg.priority, msg.deadline_ms)
+                
+                with metrics.timer("decode"):
+                    msg = self.codec.decode_request(msg)
+                
+                if msg.action == "process_news" and msg.stream_id is not None:
+                    await self.process_stream_chunk(ctx, sender, msg, start_time)
+                
+                elif msg.action == "process_news" and msg.chunk_size:
+                    sent = await self.stream_processed_news(ctx, sender, msg, start_time, ticket)
+                    ctx.logger.info(f"Processed {sent} news items in chunks of {msg.chunk_size}")
+                
+                elif msg.action == "process_news":
+                    with metrics.profiler.capture("news_fetcher.process_news", len(msg.data)):
+                        processed_news, duplicates = await ticket.bound(self.results.get_or_compute(
+                            # Deduplicated results depend on the sender's earlier articles
+                            request_key(msg.action, msg.data, msg.deduplicate and sender),
+                            lambda: self.deduplicate_and_process(msg.data, msg.deduplicate, sender)
+                        ))
+                        
+                        with metrics.timer("serialize"):
+                            response = NewsResponse(
+                                success=True,
+                                **self.codec.encode_response(
+                                    wire_payload(processed_news, msg.response_format), msg.accept_encoding
+                                ),
+                                processing_time=(datetime.now() - start_time).total_seconds(),
+                                agent_name="news_fetcher",
+                                duplicates=duplicates
+                            )
                     
-                    await ctx.send(sender, response)
+                    with metrics.timer("send"):
+                        await ctx.send(sender, response)
                     ctx.logger.info(f"Processed {len(processed_news)} news items")
+                    ctx.logger.info(f"Feature cache: {shared_cache('news_fetcher').stats()}")
+                    ctx.logger.info(f"Dedup index: {self.dedup.stats()}")
+                
+                elif msg.action == "fetch_sources":
+                    with metrics.profiler.capture("news_fetcher.fetch_sources", len(msg.data)):
+                        processed_news, duplicates, results = await ticket.bound(
+                            self.fetch_sources(msg.data, msg.deduplicate, sender)
+                        )
+                        
+                        with metrics.timer("serialize"):
+                            response = NewsResponse(
+                                success=True,
+                                **self.codec.encode_response(
+                                    wire_payload(processed_news, msg.response_format), msg.accept_encoding
+                                ),
+                                processing_time=(datetime.now() - start_time).total_seconds(),
+                                agent_name="news_fetcher",
+                                duplicates=duplicates,
+                                feeds=[result.report() for result in results]
+                            )
+                    
+                    with metrics.timer("send"):
+                        await ctx.send(sender, response)
+                    # Only now does the sender have these articles, so only now may a 304 skip them
+                    self.feeds.remember(results, sender)
+                    ctx.logger.info(f"Fetched {len(processed_news)} news items from {len(msg.data)} sources")
+                
+                elif msg.action == "process_and_score":
+                    with metrics.profiler.capture("news_fetcher.process_and_score", len(msg.data)):
+                        with metrics.timer("parse"):
+                            user_profile = self.scorer.resolve_profile(msg.user_profile, msg.profile_id, msg.profile_version)
+                        # Requests naming a profile by id share results with those sending it in full
+                        scored_news, duplicates, total_items = await ticket.bound(self.results.get_or_compute(
+                            request_key(msg.action, msg.data, profile_key(user_profile),
+                                        msg.limit, msg.offset, msg.scoring_mode, msg.deduplicate and sender),
+                            lambda: self.deduplicate_and_score(
+                                msg.data, user_profile, msg.limit, msg.offset, msg.scoring_mode, msg.deduplicate, sender
+                            )
+                        ))
+                        
+                        with metrics.timer("serialize"):
+                            response = NewsResponse(
+                                success=True,
+                                **self.codec.encode_response(
+                                    wire_payload(scored_news, msg.response_format), msg.accept_encoding
+                                ),
+                                processing_time=(datetime.now() - start_time).total_seconds(),
+                                agent_name="news_fetcher",
+                                offset=msg.offset,
+                                total_items=total_items,
+                                duplicates=duplicates
+                            )
+                    
+                    with metrics.timer("send"):
+                        await ctx.send(sender, response)
+                    ctx.logger.info(f"Processed and scored {len(msg.data)} news items")
                 
                 else:
+                    success = False
                     error_response = NewsResponse(
                         success=False,
                         data=[],
@@ -73,33 +249,279 @@ class NewsFetcherAgent:
                     )
                     await ctx.send(sender, error_response)
                     
+            except Overloaded as e:
+                success = False
+                ctx.logger.warning(f"Shed news request: {e}")
+                # A shed stream chunk was not accepted and is resent like one beyond the window
+                stream = {} if msg.stream_id is None else {
+                    "stream_id": msg.stream_id,
+                    "sequence": msg.sequence,
+                    "is_final": False,
+                    "window": self.streams.credits((sender, msg.stream_id))
+                }
+                await ctx.send(sender, NewsResponse(
+                    success=False,
+                    data=[],
+                    processing_time=(datetime.now() - start_time).total_seconds(),
+                    agent_name="news_fetcher",
+                    error=str(e),
+                    retry_after=e.retry_after,
+                    **stream
+                ))
+            
             except Exception as e:
+                success = False
                 ctx.logger.error(f"Error processing news request: {e}")
                 error_response = NewsResponse(
                     success=False,
                     data=[],
                     processing_time=(datetime.now() - start_time).total_seconds(),
-                    agent_name="news_fetcher"
+                    agent_name="news_fetcher",
+                    error=str(e)
                 )
                 await ctx.send(sender, error_response)
+            
+            finally:
+                if ticket is not None:
+                    self.scheduler.release(ticket)
+                metrics.record_request(msg.action, len(msg.data), time.perf_counter_ns() - start_ns, success)
     
     async def process_news(self, news_items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Process news items with enhanced metadata extraction"""
+        with metrics.timer("process"):
+            shard_results = await self.executor.map_shards(process_news_shard, news_items, self.clock.now())
+        return [item for _, shard in shard_results for item in shard]
+    
+    async def deduplicate_and_process(self, news_items: List[Dict[str, Any]], deduplicate: bool = False,
+                                      scope: Hashable = None) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+        """The process_news action: processed items and {dropped id: kept id}"""
+        news_items, duplicates = await self.deduplicate(news_items, deduplicate, scope)
+        return await self.process_news(news_items), duplicates
+    
+    async def fetch_sources(self, sources: List[Dict[str, Any]], deduplicate: bool = False,
+                            scope: Hashable = None) -> Tuple[List[Dict[str, Any]], Dict[str, str], List[FeedResult]]:
+        """Fetch the feeds and process their articles as process_news would.
+
+        Conditional requests use the validators remembered for scope, the
+        sender. Returns (processed items, {dropped id: kept id}, one FeedResult
+        per source); pass the results to feeds.remember() once sent.
+        """
+        with metrics.timer("fetch"):
+            results = await self.feeds.fetch_all(sources, scope)
+        news_items = [item for result in results for item in result.items]
+        processed_news, duplicates = await self.deduplicate_and_process(news_items, deduplicate, scope)
+        return processed_news, duplicates, results
+    
+    async def deduplicate_and_score(self, news_items: List[Dict[str, Any]], user_profile: Dict[str, Any] = None,
+                                    limit: int = None, offset: int = 0, scoring_mode: str = "substring",
+                                    deduplicate: bool = False,
+                                    scope: Hashable = None) -> Tuple[List[Dict[str, Any]], Dict[str, str], int]:
+        """The process_and_score action: the page, {dropped id: kept id} and how many items were ranked"""
+        news_items, duplicates = await self.deduplicate(news_items, deduplicate, scope)
+        scored_news = await self.process_and_score(
+            news_items, user_profile, limit=limit, offset=offset, scoring_mode=scoring_mode
+        )
+        return scored_news, duplicates, len(news_items)
+    
+    async def deduplicate(self, news_items: List[Dict[str, Any]], enabled: bool = True,
+                          scope: Hashable = None) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+        """Drop near-duplicate copies of the same story, here or in earlier batches of the same scope.
+
+        The copy kept is the one with the most credible source, then the best
+        quality score. Returns the kept items and {dropped id: kept id}.
+        Batches the executor would not keep inline run on a thread, one at a
+        time under dedup_lock.
+        """
+        if not enabled:
+            return news_items, {}
+        async with self.dedup_lock:
+            now = self.clock.now()
+
+            def rank(item: Dict[str, Any]) -> Tuple[float, float]:
+                return self.assess_source_credibility(item.get('source', '')), self.calculate_quality_score(item, now)
+
+            with metrics.timer("dedup"):
+                if self.executor.runs_inline(len(news_items)):
+                    return self.dedup.deduplicate(news_items, rank, now, scope)
+                return await self.executor.run_local(self.dedup.deduplicate, news_items, rank, now, scope)
+    
+    async def stream_processed_news(self, ctx: Context, sender: str, msg: NewsRequest, start_time: datetime,
+                                    ticket: Ticket) -> int:
+        """Process the request chunk by chunk, sending each chunk as soon as it is done.
+        
+        Once the request's deadline has passed, the chunk just processed is sent
+        as the final one, marked truncated, and the remaining items are dropped.
+        """
+        from agent_messages import NewsResponse
+        
+        if msg.chunk_size < 1:
+            raise ValueError(f"chunk_size must be positive, got {msg.chunk_size}")
+        
+        news_items, duplicates = await self.deduplicate(msg.data, msg.deduplicate, sender)
+        starts = list(range(0, len(news_items), msg.chunk_size)) or [0]
+        sent = 0
+        for sequence, start in enumerate(starts):
+            processed_news = await self.process_news(news_items[start:start + msg.chunk_size])
+            is_final = sequence == len(starts) - 1
+            truncated = not is_final and ticket.expired
+            response = NewsResponse(
+                success=True,
+                **self.codec.encode_response(
+                    wire_payload(processed_news, msg.response_format), msg.accept_encoding
+                ),
+                processing_time=(datetime.now() - start_time).total_seconds(),
+                agent_name="news_fetcher",
+                offset=start,
+                total_items=len(news_items),
+                sequence=sequence,
+                is_final=is_final or truncated,
+                truncated=truncated,
+                duplicates=duplicates if sequence == 0 else None
+            )
+            await ctx.send(sender, response)
+            sent += len(processed_news)
+            if truncated:
+                ticket.truncate()
+                break
+        
+        return sent
+    
+    async def process_stream_chunk(self, ctx: Context, sender: str, msg: NewsRequest, start_time: datetime):
+        """Accept one chunk of an input stream and answer every chunk it makes ready, in order.
+        
+        Responses carry the sender's remaining window; chunks sent beyond it are
+        rejected with success=False and must be resent once responses arrive.
+        """
+        from agent_messages import NewsResponse
+        
+        key = (sender, msg.stream_id)
+        try:
+            ready = self.streams.accept(key, msg.sequence, msg.data, msg.is_final)
+        except StreamError as e:
+            ctx.logger.warning(f"Rejected chunk {msg.sequence} of stream {msg.stream_id}: {e}")
+            await ctx.send(sender, NewsResponse(
+                success=False,
+                data=[],
+                processing_time=(datetime.now() - start_time).total_seconds(),
+                agent_name="news_fetcher",
+                stream_id=msg.stream_id,
+                sequence=msg.sequence,
+                is_final=False,
+                window=self.streams.credits(key)
+            ))
+            return
+        
+        state = self.streams.state(key)
+        async with state.lock:
+            for sequence, data, is_final in ready:
+                success = True
+                duplicates = None
+                try:
+                    news_items, duplicates = await self.deduplicate(data, msg.deduplicate, sender)
+                    payload = self.codec.encode_response(
+                        wire_payload(await self.process_news(news_items), msg.response_format), msg.accept_encoding
+                    )
+                except Exception as e:
+                    ctx.logger.error(f"Error processing chunk {sequence} of stream {msg.stream_id}: {e}")
+                    success = False
+                    payload = {"data": []}
+                finally:
+                    items_done = state.items_done + len(data)
+                    window = self.streams.complete(key, len(data), is_final)
+                
+                await ctx.send(sender, NewsResponse(
+                    success=success,
+                    **payload,
+                    processing_time=(datetime.now() - start_time).total_seconds(),
+                    agent_name="news_fetcher",
+                    total_items=items_done if is_final else None,
+                    stream_id=msg.stream_id,
+                    sequence=sequence,
+                    is_final=is_final,
+                    window=window,
+                    duplicates=duplicates
+                ))
+                if is_final:
+                    ctx.logger.info(f"Finished stream {msg.stream_id}: {items_done} news items")
+    
+    async def process_and_score(self, news_items: List[Dict[str, Any]], user_profile: Dict[str, Any] = None,
+                                limit: int = None, offset: int = 0,
+                                scoring_mode: str = "substring") -> List[Dict[str, Any]]:
+        """Run process_news and the relevance scorer back to back in this process.
+
+        Equivalent to sending the processed items on to the relevance scorer
+        agent, minus the second serialization and network hop. Each shard is
+        processed and scored by one pool task, so items never leave the worker
+        between the two stages.
+        """
+        validate_page(limit, offset)
+        validate_scoring_mode(scoring_mode)
+        
+        if scoring_engine.supports_profile(user_profile):
+            if user_profile:
+                user_profile = self.scorer.profiles.compile(user_profile)
+            shard_limit = None if limit is None else offset + limit
+            similarity = self.scorer.content_similarities(news_items, user_profile, scoring_mode)
+            with metrics.timer("process_and_score"):
+                shard_results = await self.executor.map_shards(
+                    process_and_score_shard, news_items, user_profile, shard_limit, self.clock.now(),
+                    aligned=similarity
+                )
+            with metrics.timer("merge"):
+                return scoring_engine.merge_ranked_shards(shard_results, limit=limit, offset=offset)
+        
+        processed_items = await self.process_news(news_items)
+        return await self.scorer.calculate_relevance_scores(
+            processed_items, user_profile, limit=limit, offset=offset, scoring_mode=scoring_mode
+        )
+    
+    def process_news_items(self, news_items: List[Dict[str, Any]], now: float = None) -> List[Dict[str, Any]]:
+        """Process news items synchronously, one item at a time"""
         processed_items = []
+        # One clock reading for the whole batch
+        if now is None:
+            now = self.clock.now()
+        processing_timestamp = datetime.now().isoformat()
+        cache = shared_cache("news_fetcher")
         
+        # Cache lookups first, so languages of the missed items are detected in one batch
+        prepared = []
         for item in news_items:
             try:
+                # Content features are reused while the article is unchanged
+                key = feature_key(item)
+                features = cache.get(key)
+                text = self.language_text(item) if features is None else None
+                prepared.append((item, key, features, text))
+            except Exception as e:
+                logger.error(f"Error processing news item {item.get('id', 'unknown')}: {e}")
+                prepared.append((item, None, None, None))
+        
+        missed = [position for position, entry in enumerate(prepared) if entry[3] is not None]
+        languages = dict(zip(missed, langid.detect_languages([prepared[position][3] for position in missed])))
+        
+        for position, (item, key, features, _) in enumerate(prepared):
+            if key is None:
+                # Include the original item even if processing fails
+                processed_items.append(item)
+                continue
+            
+            try:
+                if features is None:
+                    features = self.extract_features(item, language=languages[position])
+                    cache.put(key, features)
+                
                 # Enhance the news item with additional processing
-                enhanced_item = {
-                    **item,
-                    "processed_by": "news_fetcher",
-                    "processing_timestamp": datetime.now().isoformat(),
-                    "quality_score": self.calculate_quality_score(item),
-                    "language": self.detect_language(item.get('title', '') + ' ' + item.get('summary', '')),
-                    "word_count": len(item.get('summary', '').split()),
-                    "has_image": bool(item.get('image_url')),
-                    "source_credibility": self.assess_source_credibility(item.get('source', ''))
-                }
+                enhanced_item = ArticleRecord.derive(
+                    item,
+                    processed_by="news_fetcher",
+                    processing_timestamp=processing_timestamp,
+                    quality_score=self.apply_recency_bonus(features["content_quality"], item, now),
+                    language=features["language"],
+                    word_count=features["word_count"],
+                    has_image=bool(item.get('image_url')),
+                    source_credibility=features["source_credibility"]
+                )
                 
                 processed_items.append(enhanced_item)
                 
@@ -108,10 +530,27 @@ class NewsFetcherAgent:
                 # Include the original item even if processing fails
                 processed_items.append(item)
         
+        cache.flush()
         return processed_items
     
-    def calculate_quality_score(self, item: Dict[str, Any]) -> float:
+    def extract_features(self, item: Dict[str, Any], language: Optional[str] = None) -> Dict[str, Any]:
+        """Compute the cacheable, time-independent features of a news item.
+
+        `language` is passed in when it was already detected as part of a batch.
+        """
+        return {
+            "content_quality": self.calculate_content_quality(item),
+            "language": language or self.detect_language(self.language_text(item)),
+            "word_count": len(item.get('summary', '').split()),
+            "source_credibility": self.assess_source_credibility(item.get('source', ''))
+        }
+    
+    def calculate_quality_score(self, item: Dict[str, Any], now: float = None) -> float:
         """Calculate a quality score for the news item"""
+        return self.apply_recency_bonus(self.calculate_content_quality(item), item, now)
+    
+    def calculate_content_quality(self, item: Dict[str, Any]) -> float:
+        """Quality score from the article content alone, before the recency bonus"""
         score = 0.5  # Base score
         
         # Title quality
@@ -126,62 +565,88 @@ class NewsFetcherAgent:
         
         # Source credibility
         source = item.get('source', '').lower()
-        credible_sources = ['coindesk', 'cointelegraph', 'decrypt', 'the block', 'cryptoslate']
-        if any(credible in source for credible in credible_sources):
+        if CREDIBLE_SOURCE_MATCHER.search(source):
             score += 0.2
         
         # Image presence
         if item.get('image_url'):
             score += 0.1
         
+        return score
+    
+    def apply_recency_bonus(self, score: float, item: Dict[str, Any], now: float = None) -> float:
+        """Add the recent-publication bonus to a content quality score"""
+        if now is None:
+            now = self.clock.now()
+        
         # Recent publication
-        try:
-            pub_date = datetime.fromisoformat(item.get('published_at', '').replace('Z', '+00:00'))
-            hours_old = (datetime.now() - pub_date).total_seconds() / 3600
-            if hours_old < 24:
-                score += 0.1
-        except:
-            pass
+        hours_old = hours_between(parse_timestamp(item.get('published_at')), now)
+        if hours_old is not None and hours_old < 24:
+            score += 0.1
         
         return min(score, 1.0)
     
+    def language_text(self, item: Dict[str, Any]) -> str:
+        """The text an item's language is identified from"""
+        return item.get('title', '') + ' ' + item.get('summary', '')
+    
     def detect_language(self, text: str) -> str:
-        """Simple language detection"""
-        # This is a simplified version - in production, use a proper language detection library
-        english_indicators = ['the', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by']
-        words = text.lower().split()
-        english_word_count = sum(1 for word in words if word in english_indicators)
-        
-        if len(words) > 0 and english_word_count / len(words) > 0.1:
-            return 'en'
-        return 'unknown'
+        """ISO 639-1 code of the text's language (character-trigram model), or 'unknown'"""
+        return langid.detect_language(text)
     
     def assess_source_credibility(self, source: str) -> float:
         """Assess the credibility of the news source"""
-        source_lower = source.lower()
-        
-        # Tier 1: Highly credible sources
-        tier1_sources = ['coindesk', 'cointelegraph', 'decrypt', 'the block']
-        if any(tier1 in source_lower for tier1 in tier1_sources):
-            return 0.9
-        
-        # Tier 2: Good sources
-        tier2_sources = ['cryptoslate', 'bitcoin magazine', 'ethereum foundation']
-        if any(tier2 in source_lower for tier2 in tier2_sources):
-            return 0.7
-        
-        # Tier 3: Average sources
-        tier3_sources = ['medium', 'substack', 'blog']
-        if any(tier3 in source_lower for tier3 in tier3_sources):
-            return 0.5
+        tier_index = SOURCE_TIER_MATCHER.first_match(source.lower())
+        if tier_index >= 0:
+            return SOURCE_TIER_SCORES[tier_index]
         
         # Default for unknown sources
         return 0.3
     
+    def snapshot_state(self) -> Dict[str, Any]:
+        """Feature cache, dedup index and the in-process scorer's state, for state_snapshot"""
+        state = self.scorer.snapshot_state()
+        state["feature_cache"] = {"news_fetcher": shared_cache("news_fetcher").snapshot_state()}
+        state["dedup"] = self.dedup.snapshot_state()
+        return state
+    
+    def restore_state(self, state: Dict[str, Any]):
+        """Load snapshot_state() into this process's caches and indexes"""
+        self.scorer.restore_state(state)
+        shared_cache("news_fetcher").restore_state(state["feature_cache"]["news_fetcher"])
+        self.dedup.restore_state(state["dedup"])
+    
+    async def save_snapshot(self):
+        """Capture the state on the event loop, then write it from a thread"""
+        async with self.dedup_lock:
+            state = self.snapshot_state()
+        await asyncio.get_running_loop().run_in_executor(None, self.snapshots.save, state)
+    
     def run(self):
         """Run the agent"""
         self.agent.run()
 
+def __getattr__(name: str):
+    """The message models, still importable from here; loading them loads uagents"""
+    if name in ('NewsRequest', 'NewsResponse'):
+        import agent_messages
+        return getattr(agent_messages, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+_shard_processor = None
+
+def process_news_shard(news_items: List[Dict[str, Any]], now: float = None) -> List[Dict[str, Any]]:
+    """Process one shard of news items (module-level so process pools can pickle it)"""
+    global _shard_processor
+    if _shard_processor is None:
+        _shard_processor = NewsFetcherAgent(create_agent=False)
+    return _shard_processor.process_news_items(news_items, now)
+
+def process_and_score_shard(news_items: List[Dict[str, Any]], user_profile: Dict[str, Any] = None,
+                            limit: int = None, now: float = None, similarity: List[float] = None) -> List[Any]:
+    """Process one shard and rank it with the scoring engine, as score_shard() entries"""
+    return scoring_engine.score_shard(process_news_shard(news_items, now), user_profile, limit, now, similarity)
+
 if __name__ == "__main__":
     agent = NewsFetcherAgent()
     agent.run()
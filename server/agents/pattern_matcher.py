@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Compiled multi-pattern substring matcher (Aho-Corasick)
+Finds the patterns contained in a text in a single linear scan, so matching
+an article against hundreds of interests or history entries costs one pass
+over the text instead of one pass per pattern; search() and first_match()
+stop at the first hit
+"""
+
+from functools import lru_cache
+from typing import List, Iterable, Optional, Tuple
+
+# Below this many patterns, C-level `in` checks beat a Python automaton walk.
+# Measured on 5000 synthetic articles (~460 characters of title + summary)
+# against history entries that mostly miss: 128 patterns take 0.24 s with
+# `in` checks and 0.36 s with the automaton, 160 both 0.32 s, 256 0.49 s and
+# 0.25 s. Entries that usually hit end both scans early, and favour the
+# automaton from about 128.
+AUTOMATON_MIN_PATTERNS = 160
+
+PROFILE_MATCHER_CACHE_SIZE = 1024
+
+
+class MultiPatternMatcher:
+    """Substring matcher over a fixed, ordered list of patterns.
+
+    Pattern indices follow the input order, so first_match() reproduces the
+    "first pattern in the list that matches" semantics of a for/break loop.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: Tuple[str, ...] = tuple(patterns)
+        self.use_automaton = len(self.patterns) >= AUTOMATON_MIN_PATTERNS
+        if self.use_automaton:
+            self._build()
+
+    def _build(self):
+        """Build the goto/fail/output tables of the automaton"""
+        goto = [{}]
+        output = [0]
+
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for ch in pattern:
+                next_state = goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][ch] = next_state
+                    goto.append({})
+                    output.append(0)
+                state = next_state
+            output[state] |= 1 << index
+
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for state in queue:
+            for ch, next_state in goto[state].items():
+                queue.append(next_state)
+                fallback = fail[state]
+                while fallback and ch not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[next_state] = goto[fallback].get(ch, 0)
+                output[next_state] |= output[fail[next_state]]
+
+        self._goto = goto
+        self._fail = fail
+        self._output = output
+
+    def _first_hit(self, text: str) -> int:
+        """Lowest pattern index ending at the first position where any pattern ends, -1 if none"""
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        state = 0
+        hits = output[0]
+
+        for ch in text:
+            if hits:
+                break
+            transitions = goto[state]
+            while ch not in transitions and state:
+                state = fail[state]
+                transitions = goto[state]
+            state = transitions.get(ch, 0)
+            hits = output[state]
+
+        if not hits:
+            return -1
+        return (hits & -hits).bit_length() - 1
+
+    def first_match(self, text: str) -> int:
+        """Index of the first pattern (in list order) contained in text, -1 if none"""
+        if not self.use_automaton:
+            for index, pattern in enumerate(self.patterns):
+                if pattern in text:
+                    return index
+            return -1
+
+        # Stop at the first hit; only the patterns before it in list order can still come first
+        hit = self._first_hit(text)
+        for index in range(hit):
+            if self.patterns[index] in text:
+                return index
+        return hit
+
+    def search(self, text: str) -> bool:
+        """Whether any pattern is contained in text"""
+        if not self.use_automaton:
+            for pattern in self.patterns:
+                if pattern in text:
+                    return True
+            return False
+        return self._first_hit(text) >= 0
+
+    def first_match_many(self, texts: List[str]) -> List[int]:
+        """first_match() for a whole batch of texts"""
+        if not self.patterns:
+            return [-1] * len(texts)
+        return [self.first_match(text) for text in texts]
+
+    def search_many(self, texts: List[str]) -> List[bool]:
+        """search() for a whole batch of texts"""
+        if not self.patterns:
+            return [False] * len(texts)
+        return [self.search(text) for text in texts]
+
+
+@lru_cache(maxsize=PROFILE_MATCHER_CACHE_SIZE)
+def _compile_cached(patterns: Tuple[str, ...]) -> MultiPatternMatcher:
+    return MultiPatternMatcher(patterns)
+
+
+def compile_patterns(patterns: Optional[Iterable[str]], lowercase: bool = True) -> MultiPatternMatcher:
+    """Compile (or fetch from the LRU cache) a matcher for a list of patterns.
+
+    Profiles are identical across consecutive requests from the same user, so
+    the compiled automaton is cached by the pattern tuple itself and evicted
+    least-recently-used.
+    """
+    patterns = tuple(patterns or ())
+    if lowercase:
+        patterns = tuple(pattern.lower() for pattern in patterns)
+    return _compile_cached(patterns)
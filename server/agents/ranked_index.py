@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Incrementally maintained ranked feeds for the Relevance Scorer Agent
+A feed is re-requested far more often than it changes, and the only part of
+a score that depends on the time is the recency step (1h/6h/24h/72h buckets).
+So the scorer keeps each profile's last ranked feed: articles are scored once,
+when they first appear in it; the ranking is only revisited when one of them
+crosses a recency bucket boundary, and then only the articles that changed
+bucket are moved; and a page is a slice of the kept order, enriched on first
+use. An unchanged feed costs a hash and a lookup instead of a scoring pass.
+
+Only that lookup runs on the event loop. New articles are scored on the
+scorer's ShardExecutor, and rescoring and rebuilding a feed's ranking run on
+a thread, like any other scoring pass of that size.
+"""
+
+import asyncio
+import heapq
+import logging
+import os
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from article_record import ArticleRecord
+from compiled_profile import profile_key
+from result_cache import request_key
+from scoring_engine import ArticleBatch, BatchScores
+from shard_executor import ShardExecutor
+from timeparse import next_recency_change
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_PROFILES = 256
+
+# Largest integer that converts to a float exactly, so pass-through keys keep their order
+_MAX_EXACT_INT = 2 ** 53
+
+
+def _float_key(value: Any) -> Optional[float]:
+    """A pass-through sort key as a float, None when floats would not order it like the original"""
+    if isinstance(value, float):
+        return None if np.isnan(value) else value
+    if isinstance(value, int) and abs(value) <= _MAX_EXACT_INT:
+        return float(value)
+    return None
+
+
+def score_arrivals(news_items: List[Dict[str, Any]], user_profile: Optional[Dict[str, Any]],
+                   now: float) -> BatchScores:
+    """Score one shard of the articles new to a feed (runs on the scorer's executor)"""
+    return BatchScores(ArticleBatch(news_items, now=now), user_profile)
+
+
+class RankedFeed:
+    """One profile's ranking of one list of articles, kept current as time passes.
+
+    Each article points into the BatchScores it was scored in (`slots`); the
+    articles scored together form a group that is rescored as one when the
+    time moves past `next_change`. Feeds with sort keys that cannot be ranked
+    like the batch engine does (e.g. a non-numeric relevance_score passed
+    through from an article the engine cannot score) are not indexable.
+    """
+
+    def __init__(self, key: str, item_keys: List[str], slots: List[Tuple[BatchScores, int]], now: float):
+        self.key = key
+        self.item_keys = item_keys
+        self.slots = slots
+        self.now = now
+
+        n = len(slots)
+        self.valid = np.array([bool(scores.matches.valid[i]) for scores, i in slots], dtype=bool)
+        self.published_ts = np.array([scores.batch.published_ts[i] for scores, i in slots], dtype=np.float64)
+        self.keys = np.zeros(n, dtype=np.float64)
+        self.records: Dict[int, Dict[str, Any]] = {}
+        self.ranked: Optional[List[int]] = None
+        self.next_change = next_recency_change(self.published_ts, now)
+
+        # Positions of each group's articles, and their indices in the group
+        groups: Dict[int, Tuple[BatchScores, List[int], List[int]]] = {}
+        for position, (scores, i) in enumerate(slots):
+            group = groups.setdefault(id(scores), (scores, [], []))
+            group[1].append(position)
+            group[2].append(i)
+        self.groups = [
+            (scores, np.array(positions, dtype=np.int64), np.array(indices, dtype=np.int64))
+            for scores, positions, indices in groups.values()
+        ]
+
+        for position in np.flatnonzero(~self.valid).tolist():
+            scores, i = slots[position]
+            key = _float_key(scores.batch.items[i].get('relevance_score', 0))
+            if key is None:
+                return
+            self.keys[position] = key
+        for scores, positions, indices in self.groups:
+            self._update_keys(scores, positions, indices)
+        if np.isnan(self.keys).any():
+            return
+
+        # Stable descending sort: ties keep feed order, like BatchScores.ranked_indices
+        self.ranked = sorted(range(n), key=self.keys.tolist().__getitem__, reverse=True)
+
+    @property
+    def indexable(self) -> bool:
+        return self.ranked is not None
+
+    def _update_keys(self, scores: BatchScores, positions: np.ndarray, indices: np.ndarray):
+        valid = self.valid[positions]
+        self.keys[positions[valid]] = scores.final[indices[valid]]
+
+    def entries(self) -> Dict[str, Tuple[BatchScores, int]]:
+        """Article key -> (scores, index) of every article in the feed"""
+        return dict(zip(self.item_keys, self.slots))
+
+    def entry_records(self) -> Dict[str, Dict[str, Any]]:
+        """Article key -> enhanced record of the articles enriched so far"""
+        return {self.item_keys[position]: record for position, record in self.records.items()}
+
+    def current(self, now: float) -> bool:
+        """Whether the ranking is still the one as of `now`, no article having changed bucket"""
+        return self.now <= now < self.next_change
+
+    def advance(self, now: float) -> bool:
+        """Bring the ranking up to date as of `now`; False when no article can have changed bucket.
+
+        Only the articles whose recency changed lose their enriched record
+        and are taken out of the ranking and merged back in at their new place.
+        """
+        if self.current(now):
+            return False
+
+        changed = []
+        for scores, positions, indices in self.groups:
+            rescored = scores.rescore(now)
+            if rescored.size:
+                hit = np.isin(indices, rescored)
+                self._update_keys(scores, positions[hit], indices[hit])
+                changed.extend(positions[hit].tolist())
+
+        if changed and self.ranked is not None:
+            for position in changed:
+                self.records.pop(position, None)
+            moved = set(changed)
+            keys = self.keys.tolist()
+            order = lambda position: (-keys[position], position)
+            self.ranked = list(heapq.merge(
+                (position for position in self.ranked if position not in moved),
+                sorted(moved, key=order),
+                key=order
+            ))
+
+        self.now = now
+        self.next_change = next_recency_change(self.published_ts, now)
+        return True
+
+    def page(self, limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+        """The enhanced records of the window [offset, offset + limit) of the ranking.
+
+        Records enriched for an earlier page are re-emitted with this page's
+        processing_timestamp; pass-through articles are returned unchanged.
+        """
+        end = None if limit is None else offset + limit
+        window = self.ranked[offset:end]
+        processing_timestamp = datetime.now().isoformat()
+        page = []
+        for position in window:
+            record = self.records.get(position)
+            if record is None:
+                scores, i = self.slots[position]
+                record = self.records[position] = scores.enhanced_item(i, processing_timestamp)
+            elif self.valid[position]:
+                record = ArticleRecord.derive(record, processing_timestamp=processing_timestamp)
+            page.append(record)
+        return page
+
+
+class RankedIndex:
+    """Per-profile ranked feeds, least recently used profiles evicted beyond max_profiles.
+
+    Only for the substring scoring mode: tfidf similarities depend on the
+    index of all articles seen so far, so earlier scores do not stay valid.
+    Meant for one event loop, like the result cache; a profile's feed is only
+    updated by one request at a time, and pages are shared with later
+    requests and must not be modified.
+    """
+
+    def __init__(self, max_profiles: int = DEFAULT_MAX_PROFILES):
+        self.max_profiles = max(0, max_profiles)
+
+        self.lookups = 0
+        self.rescores = 0
+        self.rebuilds = 0
+        self.inserted = 0
+        self.evictions = 0
+
+        self._feeds: 'OrderedDict[str, RankedFeed]' = OrderedDict()
+        # Held while a profile's feed is rescored or rebuilt off the event loop
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    @classmethod
+    def from_env(cls) -> 'RankedIndex':
+        """Build an index from RANKED_INDEX_SIZE (profiles kept, 0 disables)"""
+        try:
+            max_profiles = int(os.getenv('RANKED_INDEX_SIZE', DEFAULT_MAX_PROFILES))
+        except ValueError as e:
+            logger.warning(f"Invalid RANKED_INDEX_SIZE, using {DEFAULT_MAX_PROFILES}: {e}")
+            max_profiles = DEFAULT_MAX_PROFILES
+        return cls(max_profiles)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_profiles > 0
+
+    async def page(self, news_items: List[Dict[str, Any]], user_profile: Optional[Dict[str, Any]],
+                   now: float, limit: Optional[int] = None, offset: int = 0,
+                   feed_key: Optional[str] = None,
+                   executor: Optional[ShardExecutor] = None) -> Optional[List[Dict[str, Any]]]:
+        """The page of news_items ranked for a (compiled) profile as of `now`, None when not indexable.
+
+        The same as ranking the items with the batch engine. `feed_key` is
+        request_key(news_items), when the caller has it already. Pages of
+        current feeds are served directly; scoring and reranking run on
+        `executor` (inline without one).
+        """
+        key = profile_key(user_profile) if user_profile else ''
+        feed_key = feed_key or await _off_loop(executor, len(news_items), request_key, news_items)
+        lock = self._locks.get(key)
+        feed = self._feeds.get(key)
+        if (feed is not None and feed.key == feed_key and (lock is None or not lock.locked())
+                and (not feed.indexable or feed.current(now))):
+            self._feeds.move_to_end(key)
+            if not feed.indexable:
+                return None
+            self.lookups += 1
+            return feed.page(limit, offset)
+
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        async with lock:
+            # Another request may have updated the feed while this one waited
+            feed = self._feeds.get(key)
+            if feed is not None and feed.key == feed_key:
+                self._feeds.move_to_end(key)
+                if not feed.indexable:
+                    return None
+                if await _off_loop(executor, len(feed.slots), feed.advance, now):
+                    self.rescores += 1
+                else:
+                    self.lookups += 1
+                return feed.page(limit, offset)
+
+            feed = await self._build(feed_key, news_items, user_profile, now, feed, executor)
+            self.rebuilds += 1
+            self._feeds[key] = feed
+            self._feeds.move_to_end(key)
+            while len(self._feeds) > self.max_profiles:
+                evicted, _ = self._feeds.popitem(last=False)
+                self.evictions += 1
+                evicted_lock = self._locks.get(evicted)
+                if evicted_lock is not None and not evicted_lock.locked():
+                    del self._locks[evicted]
+            return feed.page(limit, offset) if feed.indexable else None
+
+    async def _build(self, feed_key: str, news_items: List[Dict[str, Any]], user_profile: Dict[str, Any],
+                     now: float, previous: Optional[RankedFeed], executor: Optional[ShardExecutor]) -> RankedFeed:
+        """Rank a changed feed, scoring only the articles the previous one did not have"""
+        known: Dict[str, Tuple[BatchScores, int]] = {}
+        records: Dict[str, Dict[str, Any]] = {}
+        if previous is not None and previous.indexable:
+            await _off_loop(executor, len(previous.slots), previous.advance, now)
+            known = previous.entries()
+            records = previous.entry_records()
+
+        item_keys, new_items = await _off_loop(executor, len(news_items), _arrivals, news_items, known)
+        shard_results = []
+        if new_items:
+            if executor is None:
+                shard_results = [(0, score_arrivals(new_items, user_profile, now))]
+            else:
+                shard_results = await executor.map_shards(score_arrivals, new_items, user_profile, now)
+            self.inserted += len(new_items)
+        return await _off_loop(executor, len(news_items), _assemble,
+                               feed_key, item_keys, known, shard_results, records, now)
+
+    def clear(self):
+        self._feeds.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Lookup, rescore and rebuild counters and current size"""
+        requests = self.lookups + self.rescores + self.rebuilds
+        return {
+            "profiles": len(self._feeds),
+            "lookups": self.lookups,
+            "rescores": self.rescores,
+            "rebuilds": self.rebuilds,
+            "inserted": self.inserted,
+            "evictions": self.evictions,
+            "hit_rate": (self.lookups + self.rescores) / requests if requests else 0.0
+        }
+
+
+async def _off_loop(executor: Optional[ShardExecutor], size: int, fn: Callable, *args) -> Any:
+    """fn(*args) on a thread of this process, or inline for payloads the executor keeps inline"""
+    if executor is None or executor.runs_inline(size):
+        return fn(*args)
+    return await executor.run_local(fn, *args)
+
+
+def _arrivals(news_items: List[Dict[str, Any]],
+              known: Dict[str, Tuple[BatchScores, int]]) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """The key of every article, and the articles not in `known`, once each"""
+    item_keys = [request_key(item) for item in news_items]
+    seen = set()
+    new_items = []
+    for item, item_key in zip(news_items, item_keys):
+        if item_key not in known and item_key not in seen:
+            seen.add(item_key)
+            new_items.append(item)
+    return item_keys, new_items
+
+
+def _assemble(feed_key: str, item_keys: List[str], known: Dict[str, Tuple[BatchScores, int]],
+              shard_results: List[Tuple[int, BatchScores]], records: Dict[str, Dict[str, Any]],
+              now: float) -> RankedFeed:
+    """The feed of item_keys, from the known articles' scores and the shards of score_arrivals()"""
+    # Arrivals are numbered in order of first appearance, as _arrivals() collected them
+    arrivals: Dict[str, Tuple[BatchScores, int]] = {}
+    shard_scores = iter(scores for _, scores in shard_results)
+    scores, index = None, 0
+    for item_key in item_keys:
+        if item_key in known or item_key in arrivals:
+            continue
+        if scores is None or index == scores.batch.size:
+            scores, index = next(shard_scores), 0
+        arrivals[item_key] = (scores, index)
+        index += 1
+
+    slots = [known[item_key] if item_key in known else arrivals[item_key] for item_key in item_keys]
+    feed = RankedFeed(feed_key, item_keys, slots, now)
+    # Articles still in the feed keep their records, which only depend on the article, profile and time
+    for position, item_key in enumerate(item_keys):
+        if item_key in records:
+            feed.records[position] = records[item_key]
+    return feed
@@ -4,67 +4,184 @@ Fetch.ai uAgents - Relevance Scorer Agent
 This agent calculates relevance scores and personalization for news articles
 """
 
+from __future__ import annotations
+
 import asyncio
 import json
 import logging
 import math
+import time
 from datetime import datetime
-from typing import List, Dict, Any
-from uagents import Agent, Context, Model
+from typing import TYPE_CHECKING, List, Dict, Any, Optional
+
+import scoring_engine
+from agent_metrics import agent_placement, metrics, metrics_port, queue_depth
+from article_record import ArticleRecord, wire_payload
+from compiled_profile import profile_key, shared_profile_cache
+from ranked_index import RankedIndex
+from request_scheduler import Overloaded, RequestScheduler, Ticket
+from result_cache import ResultCache, request_key
+from shard_executor import ShardExecutor
+from state_snapshot import StateSnapshots
+from tfidf_index import TfidfIndex
+from timeparse import Clock, hours_between, parse_timestamp, recency_score, system_clock
+from wire_codec import WireCodec
+
+if TYPE_CHECKING:
+    from uagents import Context
+    from agent_messages import RelevanceRequest
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Define models for agent communication
-class RelevanceRequest(Model):
-    action: str
-    data: List[Dict[str, Any]]
-    user_profile: Dict[str, Any] = None
+def validate_page(limit: int = None, offset: int = 0):
+    """Reject negative paging parameters"""
+    if limit is not None and limit < 0:
+        raise ValueError(f"limit must not be negative, got {limit}")
+    if offset < 0:
+        raise ValueError(f"offset must not be negative, got {offset}")
 
-class RelevanceResponse(Model):
-    success: bool
-    data: List[Dict[str, Any]]
-    processing_time: float
-    agent_name: str
+def validate_scoring_mode(scoring_mode: str):
+    """Reject unknown scoring modes"""
+    if scoring_mode not in scoring_engine.SCORING_MODES:
+        raise ValueError(f"Unknown scoring_mode {scoring_mode!r}, expected one of {scoring_engine.SCORING_MODES}")
 
 class RelevanceScorerAgent:
-    def __init__(self):
+    def __init__(self, create_agent: bool = True, clock: Clock = system_clock):
+        self.clock = clock
+        self.executor = ShardExecutor.from_env()
+        self.tfidf = TfidfIndex.from_env()
+        self.profiles = shared_profile_cache()
+        self.results = ResultCache.from_env()
+        self.codec = WireCodec.from_env()
+        self.ranked = RankedIndex.from_env()
+        self.scheduler = RequestScheduler.from_env()
+        if not create_agent:
+            # Scoring-only instance, e.g. for offline benchmarks
+            return
+        
+        # uagents is only loaded by processes that run an agent
+        from uagents import Agent
+        
+        # Start warm from the last snapshot of any replica, when enabled
+        self.snapshots = StateSnapshots.from_env("relevance_scorer")
+        self.snapshots.restore(self)
+        
+        # Replicas started by run_agents.py get their own port, and a seed of their own
+        # so each has a distinct address
+        self.port, self.replica = agent_placement(8003)
+        seed = "blockchainvibe_relevance_scorer_2024"
         self.agent = Agent(
             name="relevance_scorer",
-            seed="blockchainvibe_relevance_scorer_2024",
-            port=8003,
-            endpoint=["http://localhost:8003/submit"]
+            seed=seed if self.replica == 0 else f"{seed}_replica_{self.replica}",
+            port=self.port,
+            endpoint=[f"http://localhost:{self.port}/submit"],
+            # Every message is handed over on arrival; the scheduler decides when it runs
+            handle_messages_concurrently=True
         )
         self.setup_handlers()
     
     def setup_handlers(self):
+        from agent_messages import RelevanceRequest, RelevanceResponse
+        
         @self.agent.on_event("startup")
         async def startup(ctx: Context):
             ctx.logger.info(f"Relevance Scorer Agent started: {self.agent.name}")
             ctx.logger.info(f"Agent address: {self.agent.address}")
+            ctx.logger.info(f"Scoring executor: {self.executor.mode} ({self.executor.workers} workers)")
+            metrics.add_source("profile_cache", self.profiles.stats)
+            metrics.add_source("tfidf_index", self.tfidf.stats)
+            metrics.add_source("result_cache", self.results.stats)
+            metrics.add_source("ranked_index", self.ranked.stats)
+            metrics.add_source("wire_codec", self.codec.stats)
+            metrics.add_source("scheduler", self.scheduler.stats)
+            metrics.add_source("agent", lambda: {
+                "name": self.agent.name,
+                "address": self.agent.address,
+                "port": self.port,
+                "replica": self.replica
+            })
+            metrics.add_source("queue", lambda: queue_depth(self.agent))
+            await metrics.start(metrics_port(self.port))
+        
+        if self.snapshots.enabled:
+            @self.agent.on_interval(period=self.snapshots.interval)
+            async def save_snapshot(ctx: Context):
+                await self.save_snapshot()
+        
+        @self.agent.on_event("shutdown")
+        async def shutdown(ctx: Context):
+            await metrics.stop()
+            self.snapshots.save(self.snapshot_state())
+            self.executor.shutdown()
         
         @self.agent.on_message(model=RelevanceRequest)
         async def handle_relevance_request(ctx: Context, sender: str, msg: RelevanceRequest):
             ctx.logger.info(f"Received relevance request: {msg.action}")
             
             start_time = datetime.now()
+            start_ns = metrics.begin_request()
+            success = True
+            ticket = None
             
             try:
-                if msg.action == "calculate_relevance":
-                    scored_news = await self.calculate_relevance_scores(msg.data, msg.user_profile)
+                ticket = await self.scheduler.acquire(msg.priority, msg.deadline_ms)
+                
+                with metrics.timer("decode"):
+                    msg = self.codec.decode_request(msg)
+                
+                if msg.action == "calculate_relevance" and msg.chunk_size:
+                    sent = await self.stream_relevance_scores(ctx, sender, msg, start_time, ticket)
+                    ctx.logger.info(f"Streamed relevance for {sent} news items")
+                
+                elif msg.action == "calculate_relevance":
+                    with metrics.profiler.capture("relevance_scorer.calculate_relevance", len(msg.data)):
+                        with metrics.timer("parse"):
+                            user_profile = self.resolve_profile(msg.user_profile, msg.profile_id, msg.profile_version)
+                        scored_news = await ticket.bound(self.cached_relevance_scores(
+                            msg.data, user_profile, limit=msg.limit, offset=msg.offset, scoring_mode=msg.scoring_mode
+                        ))
+                        
+                        with metrics.timer("serialize"):
+                            response = RelevanceResponse(
+                                success=True,
+                                **self.codec.encode_response(
+                                    wire_payload(scored_news, msg.response_format), msg.accept_encoding
+                                ),
+                                processing_time=(datetime.now() - start_time).total_seconds(),
+                                agent_name="relevance_scorer",
+                                offset=msg.offset,
+                                total_items=len(msg.data)
+                            )
+                    
+                    with metrics.timer("send"):
+                        await ctx.send(sender, response)
+                    ctx.logger.info(f"Calculated relevance for {len(scored_news)} news items")
+                
+                elif msg.action == "calculate_relevance_bulk":
+                    with metrics.profiler.capture("relevance_scorer.calculate_relevance_bulk", len(msg.data)):
+                        rankings = await ticket.bound(self.results.get_or_compute(
+                            request_key(msg.action, msg.data, msg.user_profiles or [], msg.limit, msg.offset),
+                            lambda: self.calculate_relevance_bulk(
+                                msg.data, msg.user_profiles or [], limit=msg.limit, offset=msg.offset
+                            )
+                        ))
                     
                     response = RelevanceResponse(
                         success=True,
-                        data=scored_news,
+                        **self.codec.encode_response({"data": rankings}, msg.accept_encoding),
                         processing_time=(datetime.now() - start_time).total_seconds(),
-                        agent_name="relevance_scorer"
+                        agent_name="relevance_scorer",
+                        offset=msg.offset,
+                        total_items=len(msg.data)
                     )
                     
                     await ctx.send(sender, response)
-                    ctx.logger.info(f"Calculated relevance for {len(scored_news)} news items")
+                    ctx.logger.info(f"Ranked {len(msg.data)} news items for {len(rankings)} profiles")
                 
                 else:
+                    success = False
                     error_response = RelevanceResponse(
                         success=False,
                         data=[],
@@ -73,19 +190,191 @@ class RelevanceScorerAgent:
                     )
                     await ctx.send(sender, error_response)
                     
+            except Overloaded as e:
+                success = False
+                ctx.logger.warning(f"Shed relevance request: {e}")
+                await ctx.send(sender, RelevanceResponse(
+                    success=False,
+                    data=[],
+                    processing_time=(datetime.now() - start_time).total_seconds(),
+                    agent_name="relevance_scorer",
+                    error=str(e),
+                    retry_after=e.retry_after
+                ))
+            
             except Exception as e:
+                success = False
                 ctx.logger.error(f"Error processing relevance request: {e}")
                 error_response = RelevanceResponse(
                     success=False,
                     data=[],
                     processing_time=(datetime.now() - start_time).total_seconds(),
-                    agent_name="relevance_scorer"
+                    agent_name="relevance_scorer",
+                    error=str(e)
                 )
                 await ctx.send(sender, error_response)
+            
+            finally:
+                if ticket is not None:
+                    self.scheduler.release(ticket)
+                metrics.record_request(msg.action, len(msg.data), time.perf_counter_ns() - start_ns, success)
+    
+    async def cached_relevance_scores(self, news_items: List[Dict[str, Any]], user_profile: Dict[str, Any] = None,
+                                      limit: int = None, offset: int = 0,
+                                      scoring_mode: str = "substring") -> List[Dict[str, Any]]:
+        """calculate_relevance_scores(), shared with identical requests in flight or answered moments ago"""
+        # Requests naming a profile by id share results with those sending it in full
+        feed_key = request_key(news_items)
+        key = request_key("calculate_relevance", feed_key, profile_key(user_profile),
+                          limit, offset, scoring_mode)
+        return await self.results.get_or_compute(
+            key,
+            lambda: self.calculate_relevance_scores(
+                news_items, user_profile, limit=limit, offset=offset, scoring_mode=scoring_mode,
+                feed_key=feed_key
+            )
+        )
+    
+    async def calculate_relevance_scores(self, news_items: List[Dict[str, Any]], user_profile: Dict[str, Any] = None,
+                                         limit: int = None, offset: int = 0,
+                                         scoring_mode: str = "substring",
+                                         feed_key: str = None) -> List[Dict[str, Any]]:
+        """Calculate relevance scores for news items based on user profile.
+
+        In substring mode the page comes from the profile's ranked feed (see
+        ranked_index) when it is enabled; `feed_key` is request_key(news_items)
+        when the caller has it already.
+        """
+        validate_page(limit, offset)
+        validate_scoring_mode(scoring_mode)
+        
+        if scoring_engine.supports_profile(user_profile):
+            if user_profile:
+                user_profile = self.profiles.compile(user_profile)
+            if scoring_mode == "substring" and self.ranked.enabled:
+                with metrics.timer("ranked_index"):
+                    page = await self.ranked.page(news_items, user_profile, self.clock.now(), limit, offset,
+                                                  feed_key, self.executor)
+                if page is not None:
+                    return page
+            # Each shard keeps its own top offset + limit, the merge picks the global page
+            shard_limit = None if limit is None else offset + limit
+            similarity = self.content_similarities(news_items, user_profile, scoring_mode)
+            with metrics.timer("score_shards"):
+                shard_results = await self.executor.map_shards(
+                    scoring_engine.score_shard, news_items, user_profile, shard_limit, self.clock.now(),
+                    aligned=similarity
+                )
+            with metrics.timer("merge"):
+                return scoring_engine.merge_ranked_shards(shard_results, limit=limit, offset=offset)
+        
+        with metrics.timer("score_per_item"):
+            scored_items = self.calculate_relevance_scores_per_item(news_items, user_profile)
+        end = None if limit is None else offset + limit
+        return scored_items[offset:end]
+    
+    def resolve_profile(self, user_profile: Dict[str, Any] = None, profile_id: str = None,
+                        profile_version: str = None) -> Optional[Dict[str, Any]]:
+        """The profile a request is scored with.
+
+        With profile_id and profile_version, a profile sent along is registered
+        under them and a request without one reuses the registered profile,
+        raising UnknownProfileError when that version is not (or no longer) known.
+        """
+        if profile_id is None:
+            return user_profile
+        if user_profile is None:
+            return self.profiles.lookup(profile_id, profile_version)
+        if user_profile and scoring_engine.supports_profile(user_profile):
+            return self.profiles.register(profile_id, profile_version, user_profile)
+        return user_profile
+    
+    def content_similarities(self, news_items: List[Dict[str, Any]], user_profile: Dict[str, Any] = None,
+                             scoring_mode: str = "substring") -> Optional[List[float]]:
+        """TF-IDF similarity of each item to the profile in tfidf mode, None otherwise.
+
+        Runs here rather than in the shards so every item is weighted by the
+        same index, which is updated with the new articles on the way.
+        """
+        if scoring_mode != "tfidf" or not user_profile:
+            return None
+        with metrics.timer("similarity"):
+            return self.tfidf.similarities(news_items, user_profile)
+    
+    async def calculate_relevance_bulk(self, news_items: List[Dict[str, Any]], user_profiles: List[Dict[str, Any]],
+                                       limit: int = None, offset: int = 0) -> List[Dict[str, Any]]:
+        """Rank one batch of news items for many user profiles, returning ranked ids per user"""
+        validate_page(limit, offset)
+        
+        # Profile-independent features are extracted once and shared by every profile
+        if self.executor.runs_inline(len(news_items) * max(len(user_profiles), 1)):
+            engine_rankings = scoring_engine.rank_ids_for_profiles(news_items, user_profiles, limit, offset, self.clock.now())
+        else:
+            engine_rankings = await self.executor.run(
+                scoring_engine.rank_ids_for_profiles, news_items, user_profiles, limit, offset, self.clock.now()
+            )
+        
+        rankings = []
+        for user_profile, ranking in zip(user_profiles, engine_rankings):
+            if ranking is None:
+                scored_items = await self.calculate_relevance_scores(news_items, user_profile, limit=limit, offset=offset)
+                ranking = {
+                    "ranked_ids": [item.get('id') for item in scored_items],
+                    "relevance_scores": [item.get('relevance_score', 0) for item in scored_items]
+                }
+            
+            user_id = user_profile.get('user_id') if isinstance(user_profile, dict) else None
+            rankings.append({"user_id": user_id, **ranking})
+        
+        return rankings
     
-    async def calculate_relevance_scores(self, news_items: List[Dict[str, Any]], user_profile: Dict[str, Any] = None) -> List[Dict[str, Any]]:
-        """Calculate relevance scores for news items based on user profile"""
+    async def stream_relevance_scores(self, ctx: Context, sender: str, msg: RelevanceRequest, start_time: datetime,
+                                      ticket: Ticket) -> int:
+        """Send the requested page of the ranking back as ranked chunks.
+        
+        Once the request's deadline has passed, the chunk being sent is marked
+        final and truncated and the rest of the page is dropped.
+        """
+        from agent_messages import RelevanceResponse
+        
+        if msg.chunk_size < 1:
+            raise ValueError(f"chunk_size must be positive, got {msg.chunk_size}")
+        
+        user_profile = self.resolve_profile(msg.user_profile, msg.profile_id, msg.profile_version)
+        page = await ticket.bound(self.cached_relevance_scores(
+            msg.data, user_profile, limit=msg.limit, offset=msg.offset, scoring_mode=msg.scoring_mode
+        ))
+        chunks = [page[start:start + msg.chunk_size] for start in range(0, len(page), msg.chunk_size)] or [[]]
+        
+        sent = 0
+        for index, chunk in enumerate(chunks):
+            is_final = index == len(chunks) - 1
+            truncated = not is_final and ticket.expired
+            response = RelevanceResponse(
+                success=True,
+                **self.codec.encode_response(
+                    wire_payload(chunk, msg.response_format), msg.accept_encoding
+                ),
+                processing_time=(datetime.now() - start_time).total_seconds(),
+                agent_name="relevance_scorer",
+                offset=msg.offset + index * msg.chunk_size,
+                total_items=len(msg.data),
+                is_final=is_final or truncated,
+                truncated=truncated
+            )
+            await ctx.send(sender, response)
+            sent += len(chunk)
+            if truncated:
+                ticket.truncate()
+                break
+        
+        return sent
+    
+    def calculate_relevance_scores_per_item(self, news_items: List[Dict[str, Any]], user_profile: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Calculate relevance scores one item at a time (reference path for malformed profiles)"""
         scored_items = []
+        now = self.clock.now()
+        processing_timestamp = datetime.now().isoformat()
         
         for item in news_items:
             try:
@@ -99,7 +388,7 @@ class RelevanceScorerAgent:
                 engagement_score = self.calculate_engagement_potential(item)
                 
                 # Calculate recency score
-                recency_score = self.calculate_recency_score(item)
+                recency_score = self.calculate_recency_score(item, now)
                 
                 # Combine scores with weights
                 final_score = (
@@ -112,16 +401,16 @@ class RelevanceScorerAgent:
                 # Get personalization factors
                 personalization_factors = self.get_personalization_factors(item, user_profile)
                 
-                enhanced_item = {
-                    **item,
-                    "processed_by": "relevance_scorer",
-                    "relevance_score": min(final_score, 1.0),
-                    "personalized_score": personalized_score,
-                    "engagement_potential": engagement_score,
-                    "recency_score": recency_score,
-                    "personalization_factors": personalization_factors,
-                    "processing_timestamp": datetime.now().isoformat()
-                }
+                enhanced_item = ArticleRecord.derive(
+                    item,
+                    processed_by="relevance_scorer",
+                    relevance_score=min(final_score, 1.0),
+                    personalized_score=personalized_score,
+                    engagement_potential=engagement_score,
+                    recency_score=recency_score,
+                    personalization_factors=personalization_factors,
+                    processing_timestamp=processing_timestamp
+                )
                 
                 scored_items.append(enhanced_item)
                 
@@ -198,8 +487,7 @@ class RelevanceScorerAgent:
             score += 0.1
         
         # Emotional words in title
-        emotional_words = ['breakthrough', 'revolutionary', 'exclusive', 'urgent', 'critical', 'major']
-        if any(word in title.lower() for word in emotional_words):
+        if scoring_engine.EMOTIONAL_MATCHER.search(title.lower()):
             score += 0.1
         
         # Question in title
@@ -220,25 +508,14 @@ class RelevanceScorerAgent:
         
         return min(score, 1.0)
     
-    def calculate_recency_score(self, item: Dict[str, Any]) -> float:
+    def calculate_recency_score(self, item: Dict[str, Any], now: float = None) -> float:
         """Calculate recency score based on publication time"""
-        try:
-            pub_date = datetime.fromisoformat(item.get('published_at', '').replace('Z', '+00:00'))
-            hours_old = (datetime.now() - pub_date).total_seconds() / 3600
-            
-            # Exponential decay for recency
-            if hours_old < 1:
-                return 1.0
-            elif hours_old < 6:
-                return 0.9
-            elif hours_old < 24:
-                return 0.7
-            elif hours_old < 72:
-                return 0.5
-            else:
-                return 0.3
-        except:
-            return 0.5
+        if now is None:
+            now = self.clock.now()
+        
+        # Step decay for recency, 0.5 when the publication date is unknown
+        published = parse_timestamp(item.get('published_at'))
+        return recency_score(hours_between(published, now))
     
     def get_personalization_factors(self, item: Dict[str, Any], user_profile: Dict[str, Any] = None) -> List[str]:
         """Get list of personalization factors that influenced the score"""
@@ -286,10 +563,34 @@ class RelevanceScorerAgent:
         
         return factors
     
+    def snapshot_state(self) -> Dict[str, Any]:
+        """Compiled profiles and TF-IDF index, for state_snapshot"""
+        return {
+            "profiles": self.profiles.snapshot_state(),
+            "tfidf": self.tfidf.snapshot_state()
+        }
+    
+    def restore_state(self, state: Dict[str, Any]):
+        """Load snapshot_state() into this process's caches and indexes"""
+        self.profiles.restore_state(state["profiles"])
+        self.tfidf.restore_state(state["tfidf"])
+    
+    async def save_snapshot(self):
+        """Capture the state on the event loop, then write it from a thread"""
+        state = self.snapshot_state()
+        await asyncio.get_running_loop().run_in_executor(None, self.snapshots.save, state)
+    
     def run(self):
         """Run the agent"""
         self.agent.run()
 
+def __getattr__(name: str):
+    """The message models, still importable from here; loading them loads uagents"""
+    if name in ('RelevanceRequest', 'RelevanceResponse'):
+        import agent_messages
+        return getattr(agent_messages, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 if __name__ == "__main__":
     agent = RelevanceScorerAgent()
     agent.run()
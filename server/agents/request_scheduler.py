@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Priority admission of agent requests
+uAgents hands messages to the handlers in arrival order, so one bulk backfill
+batch used to hold up every feed request behind it. The agents now take each
+message as soon as it arrives and run it once the scheduler grants it a slot:
+interactive requests before batch ones, batch requests on at most
+batch_concurrent of the max_concurrent slots so interactive work always finds
+one free, and at most max_queue requests waiting, beyond which the newest
+batch request (or the new one) is shed with a retry hint. A request that is
+still waiting when its deadline passes is dropped, and the handlers stop
+waiting for work that runs past it. That work keeps its slot until it is done.
+Requests have no deadline unless they or the AGENT_*_DEADLINE_MS settings set one.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set
+
+from agent_metrics import LATENCY_BUCKETS_MS, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, the first served first
+PRIORITIES = ('interactive', 'batch')
+DEFAULT_PRIORITY = 'interactive'
+
+DEFAULT_MAX_CONCURRENT = 4
+DEFAULT_BATCH_CONCURRENT = 2
+DEFAULT_MAX_QUEUE = 64
+# Per-class deadline of requests that do not set deadline_ms; 0 is none
+DEFAULT_DEADLINES_MS = {'interactive': 0, 'batch': 0}
+
+# Weight of the latest request in the moving average of service times
+SERVICE_TIME_SMOOTHING = 0.2
+# Shortest retry hint, so shed senders back off even before service times are known
+MIN_RETRY_AFTER = 0.1
+
+
+class Overloaded(Exception):
+    """The request was shed because the queue is full; retry after `retry_after` seconds"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's deadline passed before its work was done"""
+
+
+def _retrieve(task: asyncio.Future):
+    """Retrieve the outcome of work nobody waits for any more, so failures are not reported as unhandled"""
+    if not task.cancelled():
+        task.exception()
+
+
+class Ticket:
+    """One request's place in the scheduler: its class, deadline and queue timings"""
+
+    def __init__(self, priority: str, deadline: Optional[float], counters: Dict[str, int],
+                 free: Callable[['Ticket'], None]):
+        self.priority = priority
+        # time.monotonic() by which the request must be done, None for no deadline
+        self.deadline = deadline
+        # The scheduler's counters of the priority class
+        self.counters = counters
+        self.enqueued = time.monotonic()
+        self.started: Optional[float] = None
+        self.granted: asyncio.Future = asyncio.get_running_loop().create_future()
+        # Gives the slot back to the scheduler, once the handler and any work it stopped waiting for are done
+        self._free = free
+        self.released = False
+        self.abandoned: Set[asyncio.Future] = set()
+
+    def release(self):
+        """The handler is done; the slot is freed now or when the last abandoned work finishes"""
+        self.released = True
+        if not self.abandoned:
+            self._free(self)
+
+    def _abandoned_done(self, task: asyncio.Future):
+        _retrieve(task)
+        self.abandoned.discard(task)
+        if self.released and not self.abandoned:
+            self._free(self)
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left until the deadline, None without one"""
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def truncate(self):
+        """Count a response cut short by the deadline"""
+        self.counters["truncated"] += 1
+
+    async def bound(self, awaitable: Awaitable[Any]) -> Any:
+        """The result of awaitable, or DeadlineExceeded once the deadline passes.
+
+        The work itself is left running, not cancelled: it may be shared with
+        other requests through the result cache, and its result is cached for
+        a retry. It keeps the request's slot until it finishes, so the
+        concurrency limit still bounds the work actually running.
+        """
+        if self.deadline is None:
+            return await awaitable
+        if self.expired:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            self.counters["expired"] += 1
+            raise DeadlineExceeded(f"Deadline exceeded before {self.priority} request started")
+
+        task = asyncio.ensure_future(awaitable)
+        try:
+            done, _ = await asyncio.wait({task}, timeout=self.remaining())
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        if task not in done:
+            self.abandoned.add(task)
+            task.add_done_callback(self._abandoned_done)
+            self.counters["expired"] += 1
+            raise DeadlineExceeded(f"Deadline exceeded after {time.monotonic() - self.enqueued:.3f}s")
+        return task.result()
+
+
+class RequestScheduler:
+    """Priority queue and concurrency limit in front of an agent's handlers.
+
+    Meant for one event loop. Every acquire() that returns must be matched by
+    a release(), e.g. in a finally block.
+    """
+
+    def __init__(self, max_concurrent: int = DEFAULT_MAX_CONCURRENT,
+                 batch_concurrent: int = DEFAULT_BATCH_CONCURRENT, max_queue: int = DEFAULT_MAX_QUEUE,
+                 deadlines_ms: Optional[Dict[str, int]] = None):
+        self.max_concurrent = max(1, max_concurrent)
+        self.batch_concurrent = min(max(1, batch_concurrent), self.max_concurrent)
+        # 0 leaves the queue unbounded
+        self.max_queue = max(0, max_queue)
+        self.deadlines_ms = {**DEFAULT_DEADLINES_MS, **(deadlines_ms or {})}
+
+        self.waiting: Dict[str, Deque[Ticket]] = {priority: deque() for priority in PRIORITIES}
+        self.running: Dict[str, int] = {priority: 0 for priority in PRIORITIES}
+        self.service_time = 0.0
+
+        self.counters: Dict[str, Dict[str, int]] = {
+            priority: {"admitted": 0, "shed": 0, "expired": 0, "truncated": 0} for priority in PRIORITIES
+        }
+        self.queue_wait: Dict[str, Histogram] = {priority: Histogram(LATENCY_BUCKETS_MS) for priority in PRIORITIES}
+
+    @classmethod
+    def from_env(cls) -> 'RequestScheduler':
+        """Build a scheduler from AGENT_MAX_CONCURRENCY, AGENT_BATCH_CONCURRENCY, AGENT_QUEUE_SIZE,
+        AGENT_INTERACTIVE_DEADLINE_MS and AGENT_BATCH_DEADLINE_MS"""
+        try:
+            return cls(
+                max_concurrent=int(os.getenv('AGENT_MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENT)),
+                batch_concurrent=int(os.getenv('AGENT_BATCH_CONCURRENCY', DEFAULT_BATCH_CONCURRENT)),
+                max_queue=int(os.getenv('AGENT_QUEUE_SIZE', DEFAULT_MAX_QUEUE)),
+                deadlines_ms={
+                    priority: int(os.getenv(f'AGENT_{priority.upper()}_DEADLINE_MS', default))
+                    for priority, default in DEFAULT_DEADLINES_MS.items()
+                }
+            )
+        except ValueError as e:
+            logger.warning(f"Invalid scheduler settings, using defaults: {e}")
+            return cls()
+
+    @property
+    def queued(self) -> int:
+        return sum(len(tickets) for tickets in self.waiting.values())
+
+    async def acquire(self, priority: Optional[str] = None, deadline_ms: Optional[int] = None) -> Ticket:
+        """Wait for a slot for a request of a priority class.
+
+        deadline_ms counts from now; None takes the class default and 0 means
+        no deadline. Raises Overloaded when the request is shed and
+        DeadlineExceeded when its deadline passes while it waits.
+        """
+        priority = priority or DEFAULT_PRIORITY
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority!r}, expected one of {PRIORITIES}")
+        if deadline_ms is None:
+            deadline_ms = self.deadlines_ms[priority]
+        if deadline_ms < 0:
+            raise ValueError(f"deadline_ms must not be negative, got {deadline_ms}")
+
+        deadline = time.monotonic() + deadline_ms / 1000 if deadline_ms else None
+        ticket = Ticket(priority, deadline, self.counters[priority], self._free)
+        if self.max_queue and self.queued >= self.max_queue:
+            self._shed_for(ticket)
+        self.waiting[priority].append(ticket)
+        self._dispatch()
+
+        try:
+            if not ticket.granted.done():
+                await asyncio.wait({ticket.granted}, timeout=ticket.remaining())
+        except asyncio.CancelledError:
+            self._abandon(ticket)
+            raise
+        if not ticket.granted.done():
+            self._abandon(ticket)
+            self.counters[priority]["expired"] += 1
+            raise DeadlineExceeded(f"Deadline exceeded after waiting {time.monotonic() - ticket.enqueued:.3f}s "
+                                   f"behind {self.queued} queued requests")
+        # Raises Overloaded when a more urgent request took this one's place in the queue
+        ticket.granted.result()
+        return ticket
+
+    def release(self, ticket: Ticket):
+        """Give a granted request's slot to the next one waiting, once work it abandoned is done"""
+        ticket.release()
+
+    def _free(self, ticket: Ticket):
+        self.running[ticket.priority] -= 1
+        elapsed = time.monotonic() - ticket.started
+        self.service_time += SERVICE_TIME_SMOOTHING * (elapsed - self.service_time)
+        self._dispatch()
+
+    def retry_after(self) -> float:
+        """Seconds until the queue is expected to have drained, from the average service time"""
+        return round(max(MIN_RETRY_AFTER, self.service_time * (self.queued + 1) / self.max_concurrent), 3)
+
+    def _shed_for(self, ticket: Ticket):
+        """Make room in the full queue for ticket by shedding the newest less urgent request, or ticket itself"""
+        rank = PRIORITIES.index(ticket.priority)
+        for priority in reversed(PRIORITIES[rank + 1:]):
+            if self.waiting[priority]:
+                victim = self.waiting[priority].pop()
+                self.counters[priority]["shed"] += 1
+                victim.granted.set_exception(Overloaded(
+                    f"Shed {priority} request for a more urgent one, queue of {self.max_queue} is full",
+                    self.retry_after()
+                ))
+                return
+        self.counters[ticket.priority]["shed"] += 1
+        raise Overloaded(f"Agent overloaded, queue of {self.max_queue} requests is full", self.retry_after())
+
+    def _abandon(self, ticket: Ticket):
+        """Take back a ticket whose request stopped waiting"""
+        if ticket.granted.done() and not ticket.granted.cancelled() and ticket.granted.exception() is None:
+            self.release(ticket)
+            return
+        try:
+            self.waiting[ticket.priority].remove(ticket)
+        except ValueError:
+            pass
+
+    def _dispatch(self):
+        """Grant free slots to the waiting requests, most urgent class first"""
+        for priority in PRIORITIES:
+            tickets = self.waiting[priority]
+            while tickets and sum(self.running.values()) < self.max_concurrent:
+                if priority != DEFAULT_PRIORITY and self.running[priority] >= self.batch_concurrent:
+                    break
+                ticket = tickets.popleft()
+                ticket.started = time.monotonic()
+                self.running[priority] += 1
+                self.counters[priority]["admitted"] += 1
+                self.queue_wait[priority].observe((ticket.started - ticket.enqueued) * 1000)
+                ticket.granted.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queued and running requests, and admission counters and queue wait times per class"""
+        return {
+            "max_concurrent": self.max_concurrent,
+            "batch_concurrent": self.batch_concurrent,
+            "max_queue": self.max_queue,
+            "queued": self.queued,
+            "service_time_ms": self.service_time * 1000,
+            "classes": {
+                priority: {
+                    "queued": len(self.waiting[priority]),
+                    "running": self.running[priority],
+                    **self.counters[priority],
+                    "queue_wait_ms": self.queue_wait[priority].snapshot()
+                }
+                for priority in PRIORITIES
+            }
+        }
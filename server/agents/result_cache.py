@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Request coalescing and short-lived result cache for the agents
+Identical requests (same action, articles, profile and page) are keyed by a
+hash of their payload. While one is being computed, later copies wait for
+its result instead of computing it again (single flight), and the result is
+then served from a bounded LRU for a few seconds, so a burst of identical
+requests after each news refresh costs one computation.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import pickle
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL_SECONDS = 5.0
+
+
+def request_key(*parts: Any) -> str:
+    """Hash of a request's payload.
+
+    Hashes the pickled payload, several times cheaper than canonical JSON
+    for large article lists. Payloads decoded from the same message bytes get
+    equal keys; equal payloads built differently (e.g. another dict key order)
+    may not, which only costs a cache miss.
+    """
+    return hashlib.blake2b(pickle.dumps(parts, protocol=pickle.HIGHEST_PROTOCOL), digest_size=16).hexdigest()
+
+
+class ResultCache:
+    """Single-flight map of in-progress computations plus an LRU + TTL cache of their results.
+
+    Meant for one event loop: computations are awaited on it, not run in threads.
+    A failed computation is raised to every request waiting on it and not cached.
+    With ttl=0 results are not kept, but concurrent requests are still coalesced.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL_SECONDS):
+        self.max_entries = max(0, max_entries)
+        self.ttl = ttl
+
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries: 'OrderedDict[str, Tuple[float, Any]]' = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    @classmethod
+    def from_env(cls) -> 'ResultCache':
+        """Build a cache from RESULT_CACHE_SIZE and RESULT_CACHE_TTL"""
+        try:
+            max_entries = int(os.getenv('RESULT_CACHE_SIZE', DEFAULT_MAX_ENTRIES))
+            ttl = float(os.getenv('RESULT_CACHE_TTL', DEFAULT_TTL_SECONDS))
+        except ValueError as e:
+            logger.warning(f"Invalid result cache settings, using defaults: {e}")
+            max_entries, ttl = DEFAULT_MAX_ENTRIES, DEFAULT_TTL_SECONDS
+        return cls(max_entries=max_entries, ttl=ttl)
+
+    def get(self, key: str) -> Optional[Any]:
+        """The cached result for key if it is still fresh"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, result = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def put(self, key: str, result: Any):
+        if self.ttl <= 0 or self.max_entries == 0:
+            return
+        self._entries[key] = (time.monotonic(), result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """The result for key: cached, shared with an identical request in flight, or computed now.
+
+        Callers get the same result object and must not modify it.
+        """
+        result = self.get(key)
+        if result is not None:
+            self.hits += 1
+            return result
+
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            # Shielded so one waiter being cancelled does not cancel the shared computation
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieved here so a failure nobody else was waiting for is not reported as unhandled
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            self.put(key, result)
+            return result
+        finally:
+            del self._in_flight[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit, coalesced and miss counters and current sizes"""
+        requests = self.hits + self.coalesced + self.misses
+        return {
+            "size": len(self._entries),
+            "in_flight": len(self._in_flight),
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.coalesced) / requests if requests else 0.0
+        }
@@ -4,90 +4,348 @@ Run all uAgents for BlockchainVibe
 This script starts all the necessary agents for news processing
 """
 
-import asyncio
+import importlib.metadata
+import importlib.util
+import json
+import socket
 import subprocess
 import sys
+import threading
 import time
 import signal
 import os
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 
+from agent_metrics import PROMETHEUS_CONTENT_TYPE, PrometheusExposition, metrics_port
+
+DEFAULT_MANAGER_METRICS_PORT = 9000
+# Seconds between supervision passes and between health reports
+SUPERVISE_INTERVAL = 1.0
+REPORT_INTERVAL = 10.0
+# A replica that stays up this long has its crash count reset
+STABLE_SECONDS = 60.0
+
+
+def env_number(name, default, cast=int):
+    """Numeric setting from the environment, default when unset or invalid"""
+    try:
+        return cast(os.getenv(name, default))
+    except ValueError:
+        print(f"Invalid {name}, using {default}")
+        return default
+
+
+class Replica:
+    """One process of an agent, with its lifecycle state and restart backoff"""
+    
+    def __init__(self, agent_config, index):
+        self.name = agent_config['name']
+        self.script = agent_config['script']
+        self.index = index
+        # Replica 0 keeps the agent's well-known port, the others use consecutive ports after replica_port_base
+        self.port = agent_config['port'] if index == 0 else agent_config['replica_port_base'] + index
+        self.metrics_port = metrics_port(self.port)
+        self.label = self.name if index == 0 else f"{self.name}#{index}"
+        
+        self.process = None
+        # stopped -> starting -> ready; a replica that exits or never gets ready waits in backoff
+        self.state = 'stopped'
+        self.started_at = 0.0
+        self.ready_at = None
+        self.failures = 0
+        self.restarts = 0
+        self.retry_at = 0.0
+    
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+    
+    def describe(self):
+        return {
+            'label': self.label,
+            'port': self.port,
+            'metrics_port': self.metrics_port,
+            'state': self.state,
+            'pid': self.process.pid if self.alive() else None,
+            'restarts': self.restarts
+        }
+
+
 class AgentManager:
     def __init__(self):
-        self.processes = []
         self.agents = [
             {
                 'name': 'news_fetcher',
                 'script': 'news_fetcher_agent.py',
-                'port': 8001
+                'port': 8001,
+                'replica_port_base': 8100
             },
             {
                 'name': 'relevance_scorer', 
                 'script': 'relevance_scorer_agent.py',
-                'port': 8003
+                'port': 8003,
+                'replica_port_base': 8300
             }
         ]
+        for agent_config in self.agents:
+            # Extra replicas have addresses of their own and get no traffic unless a
+            # caller sends to them directly: nothing balances requests across them
+            agent_config['replicas'] = min(99, max(1, env_number(f"{agent_config['name'].upper()}_REPLICAS", 1)))
+        
+        self.backoff_base = env_number('RESTART_BACKOFF_BASE', 1.0, float)
+        self.backoff_max = env_number('RESTART_BACKOFF_MAX', 60.0, float)
+        self.readiness_timeout = env_number('READINESS_TIMEOUT', 60.0, float)
+        self.log_dir = os.getenv('AGENT_LOG_DIR') or None
+        
+        self.replicas = {agent_config['name']: [] for agent_config in self.agents}
+        self.metrics_server = None
+    
+    def all_replicas(self):
+        return [replica for replicas in self.replicas.values() for replica in replicas]
     
-    def start_agent(self, agent_config):
-        """Start a single agent process"""
+    def start_agent(self, agent_config, index=0):
+        """Add replica `index` of an agent and start its process"""
+        replica = Replica(agent_config, index)
+        self.replicas[agent_config['name']].append(replica)
+        return self.start_replica(replica)
+    
+    def start_replica(self, replica):
+        """Start (or restart) a replica's process"""
         try:
-            script_path = Path(__file__).parent / agent_config['script']
-            process = subprocess.Popen([
+            script_path = Path(__file__).parent / replica.script
+            env = dict(os.environ, AGENT_PORT=str(replica.port), AGENT_REPLICA=str(replica.index),
+                       PYTHONUNBUFFERED='1')
+            # One pipe for both streams, drained by a thread so a chatty agent never blocks on a full pipe
+            replica.process = subprocess.Popen([
                 sys.executable, str(script_path)
-            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            
-            self.processes.append({
-                'name': agent_config['name'],
-                'process': process,
-                'port': agent_config['port']
-            })
+            ], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+            threading.Thread(target=self.drain_logs, args=(replica, replica.process), daemon=True).start()
             
-            print(f"Started {agent_config['name']} agent (PID: {process.pid})")
+            replica.state = 'starting'
+            replica.started_at = time.time()
+            replica.ready_at = None
+            print(f"Started {replica.label} agent on port {replica.port} (PID: {replica.process.pid})")
             return True
             
         except Exception as e:
-            print(f"Failed to start {agent_config['name']} agent: {e}")
+            print(f"Failed to start {replica.label} agent: {e}")
+            self.schedule_restart(replica)
             return False
     
+    def drain_logs(self, replica, process):
+        """Copy a replica's output line by line to AGENT_LOG_DIR/<label>.log, or to stdout with its label"""
+        log_file = None
+        if self.log_dir:
+            os.makedirs(self.log_dir, exist_ok=True)
+            log_file = open(os.path.join(self.log_dir, f"{replica.label}.log"), 'a', encoding='utf-8')
+        try:
+            for line in iter(process.stdout.readline, b''):
+                text = line.decode('utf-8', 'replace').rstrip()
+                if log_file is not None:
+                    log_file.write(text + '\n')
+                    log_file.flush()
+                else:
+                    sys.stdout.write(f"[{replica.label}] {text}\n")
+        except (OSError, ValueError):
+            pass
+        finally:
+            process.stdout.close()
+            if log_file is not None:
+                log_file.close()
+    
     def start_all_agents(self):
-        """Start all agents"""
+        """Start every agent's replicas"""
         print("Starting BlockchainVibe uAgents...")
         
         for agent_config in self.agents:
-            if not self.start_agent(agent_config):
-                print(f"Failed to start {agent_config['name']}, continuing with other agents...")
+            for index in range(agent_config['replicas']):
+                if not self.start_agent(agent_config, index):
+                    print(f"Failed to start {agent_config['name']}, will retry...")
         
-        print(f"Started {len(self.processes)} agents")
-        return len(self.processes) > 0
+        started = sum(replica.alive() for replica in self.all_replicas())
+        print(f"Started {started} agent processes")
+        return started > 0
+    
+    def stop_replica(self, replica):
+        """Stop a replica's process, leaving it in the stopped state"""
+        replica.state = 'stopped'
+        if not replica.alive():
+            return
+        try:
+            replica.process.terminate()
+            replica.process.wait(timeout=5)
+            print(f"Stopped {replica.label} agent")
+        except subprocess.TimeoutExpired:
+            replica.process.kill()
+            replica.process.wait()
+            print(f"Force killed {replica.label} agent")
+        except Exception as e:
+            print(f"Error stopping {replica.label} agent: {e}")
     
     def stop_all_agents(self):
         """Stop all running agents"""
         print("Stopping all agents...")
         
-        for agent_info in self.processes:
-            try:
-                agent_info['process'].terminate()
-                agent_info['process'].wait(timeout=5)
-                print(f"Stopped {agent_info['name']} agent")
-            except subprocess.TimeoutExpired:
-                agent_info['process'].kill()
-                print(f"Force killed {agent_info['name']} agent")
-            except Exception as e:
-                print(f"Error stopping {agent_info['name']} agent: {e}")
+        for replica in self.all_replicas():
+            self.stop_replica(replica)
         
-        self.processes.clear()
+        for replicas in self.replicas.values():
+            replicas.clear()
+    
+    def schedule_restart(self, replica):
+        """Put a failed replica in backoff: 1, 2, 4 ... RESTART_BACKOFF_MAX seconds after consecutive failures"""
+        replica.failures += 1
+        delay = min(self.backoff_base * 2 ** (replica.failures - 1), self.backoff_max)
+        replica.state = 'backoff'
+        replica.retry_at = time.time() + delay
+        print(f"Restarting {replica.label} in {delay:g}s (failure {replica.failures})")
+    
+    def is_ready(self, replica):
+        """Readiness: the agent's metrics endpoint answers, or its port accepts connections when metrics are off"""
+        if replica.metrics_port:
+            return 'error' not in self.fetch_agent_metrics(replica, timeout=0.5)
+        try:
+            with socket.create_connection(('127.0.0.1', replica.port), timeout=0.5):
+                return True
+        except OSError:
+            return False
+    
+    def supervise(self):
+        """One supervision pass: detect exits, check readiness, and restart after backoff"""
+        now = time.time()
+        for replica in self.all_replicas():
+            if replica.state in ('starting', 'ready') and not replica.alive():
+                code = replica.process.returncode if replica.process is not None else None
+                print(f"Agent {replica.label} exited with code {code}")
+                self.schedule_restart(replica)
+            
+            elif replica.state == 'starting':
+                if self.is_ready(replica):
+                    replica.state = 'ready'
+                    replica.ready_at = now
+                    print(f"Agent {replica.label} ready after {now - replica.started_at:.1f}s")
+                elif now - replica.started_at > self.readiness_timeout:
+                    print(f"Agent {replica.label} not ready after {self.readiness_timeout:.0f}s")
+                    self.stop_replica(replica)
+                    self.schedule_restart(replica)
+            
+            elif replica.state == 'ready' and replica.failures and now - replica.ready_at >= STABLE_SECONDS:
+                replica.failures = 0
+            
+            elif replica.state == 'backoff' and now >= replica.retry_at:
+                replica.restarts += 1
+                self.start_replica(replica)
     
     def check_agent_health(self):
-        """Check if all agents are still running"""
-        healthy_agents = []
+        """Labels of the replicas that are running"""
+        return [replica.label for replica in self.all_replicas() if replica.alive()]
+    
+    def fetch_agent_metrics(self, replica, timeout=2.0):
+        """Metrics snapshot of one replica from its local endpoint"""
+        if not replica.metrics_port:
+            return {'error': 'metrics endpoint disabled'}
+        try:
+            url = f"http://127.0.0.1:{replica.metrics_port}/metrics.json"
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                return json.loads(response.read())
+        except Exception as e:
+            return {'error': str(e)}
+    
+    def collect_metrics(self):
+        """Metrics of every running replica, with request counts summed across replicas per action"""
+        replicas = [replica for replica in self.all_replicas() if replica.alive()]
+        agents = {replica.label: self.fetch_agent_metrics(replica) for replica in replicas}
+        
+        totals = {}
+        for snapshot in agents.values():
+            for action, entry in snapshot.get('requests', {}).items():
+                total = totals.setdefault(action, {'count': 0, 'errors': 0, 'items': 0})
+                total['count'] += entry['count']
+                total['errors'] += entry['errors']
+                total['items'] += int(entry['batch_size']['sum'])
+        
+        return {
+            'agents': agents,
+            'totals': totals,
+            'replicas': [replica.describe() for replica in self.all_replicas()]
+        }
+    
+    def prometheus_metrics(self):
+        """Metrics of every running replica in the Prometheus text format, labelled by replica"""
+        exposition = PrometheusExposition()
+        for replica in self.all_replicas():
+            labels = {'agent': replica.name, 'replica': replica.label}
+            exposition.sample('agent_replica_ready', 'gauge', "Whether the replica is running and ready",
+                              labels, int(replica.state == 'ready'))
+            exposition.sample('agent_replica_restarts_total', 'counter', "Restarts of the replica by the supervisor",
+                              labels, replica.restarts)
+            if replica.alive():
+                snapshot = self.fetch_agent_metrics(replica)
+                if 'error' not in snapshot:
+                    exposition.add_snapshot(snapshot, labels)
+        return exposition.text()
+    
+    def serve_metrics(self):
+        """Serve the aggregated metrics on MANAGER_METRICS_PORT (default 9000, 0 disables):
+        Prometheus text on /metrics, JSON on /metrics.json"""
+        try:
+            port = int(os.getenv('MANAGER_METRICS_PORT', DEFAULT_MANAGER_METRICS_PORT))
+        except ValueError:
+            print(f"Invalid MANAGER_METRICS_PORT, using {DEFAULT_MANAGER_METRICS_PORT}")
+            port = DEFAULT_MANAGER_METRICS_PORT
+        if not port:
+            return
         
-        for agent_info in self.processes:
-            if agent_info['process'].poll() is None:
-                healthy_agents.append(agent_info['name'])
-            else:
-                print(f"Agent {agent_info['name']} has stopped")
+        manager = self
         
-        return healthy_agents
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path == '/metrics':
+                    content_type, body = PROMETHEUS_CONTENT_TYPE, manager.prometheus_metrics().encode()
+                elif path == '/metrics.json':
+                    content_type, body = 'application/json', json.dumps(manager.collect_metrics()).encode()
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        try:
+            self.metrics_server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+        except OSError as e:
+            print(f"Aggregated metrics disabled, cannot listen on port {port}: {e}")
+            return
+        threading.Thread(target=self.metrics_server.serve_forever, daemon=True).start()
+        print(f"Aggregated agent metrics on http://127.0.0.1:{port}/metrics")
+    
+    def metrics_summary(self):
+        """One line per agent: requests, errors, worst p99 latency, queueing, load shed and event-loop lag"""
+        lines = []
+        for name, snapshot in self.collect_metrics()['agents'].items():
+            if 'error' in snapshot:
+                lines.append(f"{name}: metrics unavailable ({snapshot['error']})")
+                continue
+            requests = snapshot.get('requests', {})
+            count = sum(entry['count'] for entry in requests.values())
+            errors = sum(entry['errors'] for entry in requests.values())
+            p99 = max((entry['latency_ms']['p99'] for entry in requests.values()), default=0.0)
+            lag = snapshot['event_loop_lag_ms']['max']
+            depth = snapshot.get('queue', {}).get('depth', 0)
+            classes = snapshot.get('scheduler', {}).get('classes', {})
+            wait = classes.get('interactive', {}).get('queue_wait_ms', {}).get('p99', 0.0)
+            shed = sum(entry['shed'] for entry in classes.values())
+            lines.append(f"{name}: {count} requests, {errors} errors, p99 {p99:.1f} ms, "
+                         f"queue depth {depth}, interactive queue wait p99 {wait:.1f} ms, {shed} shed, "
+                         f"max loop lag {lag:.1f} ms")
+        return lines
     
     def run(self):
         """Run the agent manager"""
@@ -101,35 +359,42 @@ class AgentManager:
         
         if not self.start_all_agents():
             print("Failed to start any agents")
+            self.stop_all_agents()
             return
         
+        self.serve_metrics()
+        
         try:
             print("All agents are running. Press Ctrl+C to stop.")
             
+            reported_at = time.time()
             while True:
-                time.sleep(10)
-                healthy_agents = self.check_agent_health()
+                time.sleep(SUPERVISE_INTERVAL)
+                self.supervise()
                 
-                if not healthy_agents:
-                    print("All agents have stopped")
-                    break
+                if time.time() - reported_at < REPORT_INTERVAL:
+                    continue
+                reported_at = time.time()
                 
-                print(f"Healthy agents: {', '.join(healthy_agents)}")
+                healthy_agents = self.check_agent_health()
+                print(f"Healthy agents: {', '.join(healthy_agents) or 'none'}")
+                for line in self.metrics_summary():
+                    print(f"  {line}")
                 
         except KeyboardInterrupt:
             print("\nReceived keyboard interrupt")
         finally:
+            if self.metrics_server is not None:
+                self.metrics_server.shutdown()
             self.stop_all_agents()
 
 if __name__ == "__main__":
-    # Check if uagents is installed
-    try:
-        import uagents
-        print(f"uAgents version: {uagents.__version__}")
-    except ImportError:
-        print("uAgents not installed. Installing...")
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "uagents"])
-        print("uAgents installed successfully")
+    # Check that uagents is installed without importing it: only the agent
+    # processes load it, and installing packages is left to the deployment
+    if importlib.util.find_spec("uagents") is None:
+        print("uAgents is not installed; run `pip install -r requirements.txt` first")
+        sys.exit(1)
+    print(f"uAgents version: {importlib.metadata.version('uagents')}")
     
     manager = AgentManager()
     manager.run()
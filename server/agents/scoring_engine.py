@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+"""
+Batch scoring engine for the Relevance Scorer Agent
+Turns a whole request payload into columnar NumPy arrays and computes
+personalized, engagement, recency and final scores in one vectorized pass.
+
+The output is the same as the per-item methods of RelevanceScorerAgent. Ranking
+one feed for one profile is not materially faster: extracting the columns,
+matching the profile's patterns and building the records is per-article Python
+work either way, and only the blend of the scores is vectorized. The batch
+pays off when it is reused: scored once for many profiles
+(rank_ids_for_profiles), enriched only for the requested page, or kept and
+rescored as time passes (ranked_index).
+"""
+
+import heapq
+import itertools
+import logging
+import sys
+from datetime import datetime
+from typing import List, Dict, Any, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+from agent_metrics import metrics
+from article_record import ArticleRecord
+from compiled_profile import CompiledProfile, compile_profile
+from pattern_matcher import MultiPatternMatcher
+from timeparse import parse_timestamp, recency_scores, system_clock
+
+logger = logging.getLogger(__name__)
+
+# Emotional title words, shared with RelevanceScorerAgent.calculate_engagement_potential
+EMOTIONAL_WORDS = ['breakthrough', 'revolutionary', 'exclusive', 'urgent', 'critical', 'major']
+EMOTIONAL_MATCHER = MultiPatternMatcher(EMOTIONAL_WORDS)
+
+# Bits of the per-article match bitmask
+MATCH_INTEREST = 1
+MATCH_HISTORY = 2
+MATCH_SOURCE = 4
+MATCH_TOPIC = 8
+MATCH_READING_TIME = 16
+
+PROFILE_LIST_KEYS = ('interests', 'reading_history', 'preferred_sources', 'topic_preferences')
+
+# "substring" credits interest/history phrases found in the text, "tfidf" the
+# cosine similarity of the text to the profile (see tfidf_index)
+SCORING_MODES = ('substring', 'tfidf')
+# Cosine similarity at which an article gets the full interest + history credit
+SIMILARITY_SATURATION = 0.3
+
+
+def supports_profile(user_profile: Dict[str, Any] = None) -> bool:
+    """Check whether a profile can be scored by the batch engine.
+
+    Malformed profiles (e.g. interests sent as a bare string) are left to the
+    per-item code path so that its exact error behaviour is preserved.
+    """
+    if not user_profile or isinstance(user_profile, CompiledProfile):
+        return True
+    if not isinstance(user_profile, dict):
+        return False
+
+    for key in PROFILE_LIST_KEYS:
+        if key in user_profile:
+            values = user_profile[key]
+            if not isinstance(values, (list, tuple)):
+                return False
+            if not all(isinstance(value, str) for value in values):
+                return False
+
+    return True
+
+
+class ArticleBatch:
+    """Columnar, profile-independent features for a batch of news items"""
+
+    def __init__(self, items: List[Dict[str, Any]], now: Optional[float] = None):
+        self.items = items
+        # One "now" (epoch seconds) for the whole batch
+        self.now = system_clock.now() if now is None else now
+
+        n = len(items)
+        self.size = n
+        # Items whose profile-independent scores can be computed at all
+        self.valid = np.ones(n, dtype=bool)
+        # Items whose title/summary text (and so any profile match) cannot be built
+        self.text_error = np.zeros(n, dtype=bool)
+        self.source_error = np.zeros(n, dtype=bool)
+        # Categories are lowered lazily in the per-item code, so only a miss
+        # that reaches the first bad entry is an error
+        self.categories_truncated = np.zeros(n, dtype=bool)
+
+        self.title_length = np.zeros(n, dtype=np.int64)
+        self.word_count = np.zeros(n, dtype=np.int64)
+        self.has_question = np.zeros(n, dtype=bool)
+        self.has_emotional = np.zeros(n, dtype=bool)
+        self.has_image = np.zeros(n, dtype=bool)
+        self.base_score = np.full(n, 0.5, dtype=np.float64)
+        self.credibility = np.full(n, 0.5, dtype=np.float64)
+        self.quality = np.full(n, 0.5, dtype=np.float64)
+        # Publication time in epoch seconds, NaN when missing or unparseable
+        self.published_ts = np.full(n, np.nan, dtype=np.float64)
+
+        self.texts: List[str] = [''] * n
+        self.sources: List[str] = [''] * n
+        self.categories: List[tuple] = [()] * n
+        self.raw_categories: List[tuple] = [()] * n
+        self._engagement: Optional[np.ndarray] = None
+        self._recency: Optional[np.ndarray] = None
+
+        for i, item in enumerate(items):
+            try:
+                self._extract(i, item)
+            except Exception as e:
+                logger.error(f"Error extracting features for item {item.get('id', 'unknown')}: {e}")
+                self.valid[i] = False
+
+    def _extract(self, i: int, item: Dict[str, Any]):
+        """Extract the features of a single item into the columns"""
+        self._extract_profile_features(i, item)
+
+        published_ts = parse_timestamp(item.get('published_at'))
+        if published_ts is not None:
+            self.published_ts[i] = published_ts
+
+        title = item.get('title', '')
+        base_score = item.get('relevance_score', 0.5)
+        credibility = item.get('source_credibility', 0.5)
+        quality = item.get('quality_score', 0.5)
+        for value in (base_score, credibility, quality):
+            if not isinstance(value, (int, float)):
+                raise TypeError(f"non-numeric score value: {value!r}")
+
+        # Cheaper to recompute than to look up in a feature cache
+        features = self._title_features(title)
+
+        self.title_length[i] = features["title_length"]
+        self.has_question[i] = features["has_question"]
+        self.has_emotional[i] = features["has_emotional"]
+        self.has_image[i] = bool(item.get('image_url'))
+        self.base_score[i] = base_score
+        self.credibility[i] = credibility
+        self.quality[i] = quality
+
+    @staticmethod
+    def _title_features(title: str) -> Dict[str, Any]:
+        """The title features engagement potential depends on"""
+        return {
+            "title_length": len(title),
+            "has_question": '?' in title,
+            "has_emotional": EMOTIONAL_MATCHER.search(title.lower())
+        }
+
+    def _extract_profile_features(self, i: int, item: Dict[str, Any]):
+        """Extract the text features only personalization depends on"""
+        try:
+            summary = item.get('summary', '')
+            self.texts[i] = (item.get('title', '') + ' ' + summary).lower()
+            self.word_count[i] = len(summary.split())
+        except Exception:
+            self.text_error[i] = True
+
+        try:
+            # Interned: a feed has a few dozen distinct sources across thousands of items
+            self.sources[i] = sys.intern(item.get('source', '').lower())
+        except Exception:
+            self.source_error[i] = True
+
+        categories = []
+        raw_categories = []
+        try:
+            for category in item.get('categories', []):
+                categories.append(sys.intern(category.lower()))
+                raw_categories.append(category)
+        except Exception:
+            self.categories_truncated[i] = True
+        self.categories[i] = tuple(categories)
+        self.raw_categories[i] = tuple(raw_categories)
+
+    def engagement_scores(self) -> np.ndarray:
+        """Vectorized equivalent of calculate_engagement_potential (profile-independent, computed once)"""
+        if self._engagement is None:
+            self._engagement = self._compute_engagement_scores()
+        return self._engagement
+
+    def recency_scores(self) -> np.ndarray:
+        """Vectorized equivalent of calculate_recency_score (profile-independent, computed once)"""
+        if self._recency is None:
+            self._recency = self._compute_recency_scores()
+        return self._recency
+
+    def _compute_engagement_scores(self) -> np.ndarray:
+        score = np.full(self.size, 0.5, dtype=np.float64)
+        score = np.where((self.title_length > 30) & (self.title_length < 100), score + 0.1, score)
+        score = np.where(self.has_emotional, score + 0.1, score)
+        score = np.where(self.has_question, score + 0.05, score)
+        score = np.where(self.has_image, score + 0.1, score)
+        score = score + self.credibility * 0.2
+        score = score + self.quality * 0.1
+        return np.minimum(score, 1.0)
+
+    def _compute_recency_scores(self) -> np.ndarray:
+        return recency_scores((self.now - self.published_ts) / 3600)
+
+
+class ProfileMatches:
+    """Per-article match bitmask and first-hit indices for one user profile.
+
+    With `similarity` (content similarity to the profile per article, tfidf
+    mode) interests and reading history are credited from it instead of
+    substring matches.
+    """
+
+    def __init__(self, batch: ArticleBatch, user_profile: Dict[str, Any] = None,
+                 similarity: Optional[Sequence[float]] = None):
+        n = batch.size
+        # Compiled once per distinct profile, see compiled_profile
+        self.profile = compile_profile(user_profile) if user_profile else None
+        self.similarity = None if similarity is None else np.asarray(similarity, dtype=np.float64)
+        self.bitmask = np.zeros(n, dtype=np.uint8)
+        self.first_interest = np.full(n, -1, dtype=np.int64)
+        self.first_topic = np.full(n, -1, dtype=np.int64)
+        # Items the per-item code would fail on for this profile
+        self.valid = batch.valid.copy()
+
+        profile = self.profile
+        if not profile:
+            return
+
+        self.valid &= ~batch.text_error
+
+        if profile.interest_matcher is not None and self.similarity is None:
+            self.first_interest = np.array(profile.interest_matcher.first_match_many(batch.texts), dtype=np.int64)
+            self.bitmask[self.first_interest >= 0] |= MATCH_INTEREST
+
+        if profile.history_matcher is not None and self.similarity is None:
+            hits = np.array(profile.history_matcher.search_many(batch.texts), dtype=bool)
+            self.bitmask[hits] |= MATCH_HISTORY
+
+        if profile.preferred_sources is not None:
+            preferred_sources = profile.preferred_sources
+            hits = np.fromiter((source in preferred_sources for source in batch.sources), dtype=bool, count=n)
+            self.bitmask[hits] |= MATCH_SOURCE
+            self.valid &= ~batch.source_error
+
+        if profile.topic_preferences is not None:
+            topic_preferences = profile.topic_preferences
+            for i, categories in enumerate(batch.categories):
+                for position, category in enumerate(categories):
+                    if category in topic_preferences:
+                        self.first_topic[i] = position
+                        self.bitmask[i] |= MATCH_TOPIC
+                        break
+                else:
+                    if batch.categories_truncated[i]:
+                        self.valid[i] = False
+
+        if profile.has_reading_time():
+            self.bitmask[profile.length_matches(batch.word_count)] |= MATCH_READING_TIME
+
+    def has(self, flag: int) -> np.ndarray:
+        """Boolean column of articles whose bitmask has the given flag"""
+        return (self.bitmask & flag) != 0
+
+    def personalized_scores(self) -> np.ndarray:
+        """Vectorized equivalent of calculate_personalized_relevance"""
+        n = len(self.bitmask)
+        score = np.full(n, 0.5, dtype=np.float64)
+        if not self.profile:
+            return score
+
+        if self.similarity is not None:
+            score = score + 0.3 * np.minimum(self.similarity / SIMILARITY_SATURATION, 1.0)
+        score = np.where(self.has(MATCH_INTEREST), score + 0.2, score)
+        score = np.where(self.has(MATCH_HISTORY), score + 0.1, score)
+        score = np.where(self.has(MATCH_SOURCE), score + 0.15, score)
+        score = np.where(self.has(MATCH_TOPIC), score + 0.1, score)
+        score = np.where(self.has(MATCH_READING_TIME), score + 0.1, score)
+        return np.minimum(score, 1.0)
+
+    def factors(self, batch: ArticleBatch, i: int) -> List[str]:
+        """Equivalent of get_personalization_factors for article i"""
+        factors = []
+        if not self.profile:
+            return factors
+
+        mask = int(self.bitmask[i])
+        if self.similarity is not None and self.similarity[i] > 0:
+            factors.append(f"content_similarity:{round(float(self.similarity[i]), 3)}")
+        if mask & MATCH_INTEREST:
+            factors.append(f"matches_interest:{self.profile.interests[self.first_interest[i]]}")
+        if mask & MATCH_SOURCE:
+            factors.append("preferred_source")
+        if mask & MATCH_TOPIC:
+            factors.append(f"matches_topic:{batch.raw_categories[i][self.first_topic[i]]}")
+        if mask & MATCH_READING_TIME:
+            factors.append(f"matches_reading_time:{self.profile.reading_time_preference}")
+        return factors
+
+
+class BatchScores:
+    """Score columns for one batch scored against one profile"""
+
+    def __init__(self, batch: ArticleBatch, user_profile: Dict[str, Any] = None,
+                 similarity: Optional[Sequence[float]] = None):
+        self.batch = batch
+        self.matches = ProfileMatches(batch, user_profile, similarity)
+        self.personalized = self.matches.personalized_scores()
+        self.engagement = batch.engagement_scores()
+        self.recency = batch.recency_scores()
+        self.final = self._final_scores()
+        self._keys: Optional[List[Any]] = None
+
+    def _final_scores(self) -> np.ndarray:
+        return np.minimum(
+            self.batch.base_score * 0.3 +
+            self.personalized * 0.4 +
+            self.engagement * 0.2 +
+            self.recency * 0.1,
+            1.0
+        )
+
+    def rescore(self, now: float) -> np.ndarray:
+        """Recompute the recency and final scores as of `now`, returning the indices whose recency changed.
+
+        Everything else about an article is independent of the time, so this
+        is all that goes stale as a scored batch ages (see ranked_index).
+        """
+        previous = self.recency
+        self.batch.now = now
+        self.batch._recency = None
+        self.recency = self.batch.recency_scores()
+        self.final = self._final_scores()
+        self._keys = None
+        return np.flatnonzero(self.recency != previous)
+
+    def sort_keys(self) -> List[Any]:
+        """Ranking key per item: the final score, or the original relevance_score for pass-through items"""
+        if self._keys is None:
+            keys = self.final.tolist()
+            for i in np.flatnonzero(~self.matches.valid).tolist():
+                keys[i] = self.batch.items[i].get('relevance_score', 0)
+            self._keys = keys
+        return self._keys
+
+    def ranked_indices(self, limit: Optional[int] = None, offset: int = 0) -> List[int]:
+        """Item indices in ranked order, optionally only the window [offset, offset + limit).
+
+        Ties keep input order, matching a stable descending sort. With a limit
+        only a bounded heap of offset + limit candidates is kept.
+        """
+        keys = self.sort_keys()
+        if limit is None:
+            ranked = sorted(range(len(keys)), key=keys.__getitem__, reverse=True)
+        else:
+            try:
+                ranked = heapq.nsmallest(offset + limit, range(len(keys)), key=lambda i: (-keys[i], i))
+            except TypeError:
+                # Pass-through keys that cannot be negated (e.g. string relevance_scores) rank like the full sort
+                ranked = sorted(range(len(keys)), key=keys.__getitem__, reverse=True)[:offset + limit]
+        return ranked[offset:]
+
+    def enhanced_item(self, i: int, processing_timestamp: str) -> Dict[str, Any]:
+        """Build the enhanced record for item i; invalid items are passed through unchanged"""
+        item = self.batch.items[i]
+        if not self.matches.valid[i]:
+            return item
+        return ArticleRecord.derive(
+            item,
+            processed_by="relevance_scorer",
+            relevance_score=float(self.final[i]),
+            personalized_score=float(self.personalized[i]),
+            engagement_potential=float(self.engagement[i]),
+            recency_score=float(self.recency[i]),
+            personalization_factors=self.matches.factors(self.batch, i),
+            processing_timestamp=processing_timestamp
+        )
+
+    def enhanced_items(self, indices: Iterable[int], processing_timestamp: str = None) -> List[Dict[str, Any]]:
+        """Build the enhanced records for the given items, in the given order"""
+        processing_timestamp = processing_timestamp or datetime.now().isoformat()
+        return [self.enhanced_item(i, processing_timestamp) for i in indices]
+
+
+def score_items(news_items: List[Dict[str, Any]], user_profile: Dict[str, Any] = None,
+                limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+    """Score and rank a batch of news items in one vectorized pass.
+
+    Only the items inside the requested page are enriched.
+    """
+    scores = BatchScores(ArticleBatch(news_items), user_profile)
+    return scores.enhanced_items(scores.ranked_indices(limit, offset))
+
+
+def score_shard(news_items: List[Dict[str, Any]], user_profile: Dict[str, Any] = None,
+                limit: Optional[int] = None, now: Optional[float] = None,
+                similarity: Optional[Sequence[float]] = None) -> List[Tuple[Any, int, Dict[str, Any]]]:
+    """Score one shard of a larger batch, returning its ranked (sort key, local index, enhanced item) entries.
+
+    With a limit only the shard's own top `limit` items are enriched; the
+    global page is always among the union of the shard winners. `similarity`
+    is the shard's slice of the tfidf-mode content similarities.
+    """
+    with metrics.timer("feature_extraction"):
+        batch = ArticleBatch(news_items, now=now)
+    with metrics.timer("scoring"):
+        scores = BatchScores(batch, user_profile, similarity)
+        keys = scores.sort_keys()
+    with metrics.timer("sort"):
+        ranked = scores.ranked_indices(limit)
+    with metrics.timer("enrich"):
+        processing_timestamp = datetime.now().isoformat()
+        return [(keys[i], i, scores.enhanced_item(i, processing_timestamp)) for i in ranked]
+
+
+def merge_ranked_shards(shard_results: List[Tuple[int, List[Tuple[Any, int, Dict[str, Any]]]]],
+                        limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+    """Merge (shard start, score_shard() result) pairs into the global ranked page"""
+    end = None if limit is None else offset + limit
+    if len(shard_results) == 1:
+        # Already ranked; the merge key would also reject pass-through keys that cannot be negated
+        return [item for _, _, item in shard_results[0][1][offset:end]]
+    ranked_shards = [
+        [(-key, start + index, item) for key, index, item in entries]
+        for start, entries in shard_results
+    ]
+    merged = heapq.merge(*ranked_shards, key=lambda entry: (entry[0], entry[1]))
+    return [item for _, _, item in itertools.islice(merged, offset, end)]
+
+
+def rank_ids(batch: ArticleBatch, user_profile: Dict[str, Any] = None,
+             limit: Optional[int] = None, offset: int = 0) -> Dict[str, List[Any]]:
+    """Rank an already-extracted batch for one profile, returning ids and scores instead of article copies.
+
+    Text, timestamps, engagement and recency live on the batch, so scoring the
+    same batch for many profiles only repeats the profile matching and blend.
+    """
+    scores = BatchScores(batch, user_profile)
+    keys = scores.sort_keys()
+    ranked = scores.ranked_indices(limit, offset)
+    return {
+        "ranked_ids": [batch.items[i].get('id') for i in ranked],
+        "relevance_scores": [keys[i] for i in ranked]
+    }
+
+
+def rank_ids_for_profiles(news_items: List[Dict[str, Any]], user_profiles: List[Dict[str, Any]],
+                          limit: Optional[int] = None, offset: int = 0,
+                          now: Optional[float] = None) -> List[Optional[Dict[str, List[Any]]]]:
+    """rank_ids() for many profiles over one shared batch; None for profiles the engine does not support"""
+    batch = ArticleBatch(news_items, now=now)
+    return [
+        rank_ids(batch, user_profile, limit=limit, offset=offset) if supports_profile(user_profile) else None
+        for user_profile in user_profiles
+    ]
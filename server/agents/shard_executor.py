@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Shard executor for CPU-bound agent work
+Runs scoring off the event loop on a thread or process pool, splitting large
+payloads into shards that are processed in parallel and merged back in order
+"""
+
+import asyncio
+import logging
+import math
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+EXECUTOR_MODES = ('inline', 'thread', 'process')
+
+DEFAULT_MODE = 'thread'
+# Below this many items work stays on the event loop: pool hand-off (and
+# pickling, for processes) would cost more than the scoring itself
+DEFAULT_INLINE_THRESHOLD = 500
+DEFAULT_MIN_SHARD_SIZE = 250
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logger.warning(f"Ignoring invalid {name}={value!r}, using {default}")
+        return default
+
+
+class ShardExecutor:
+    """Thread/process pool that shards list payloads and keeps the event loop responsive"""
+
+    def __init__(self, mode: str = DEFAULT_MODE, workers: Optional[int] = None,
+                 inline_threshold: int = DEFAULT_INLINE_THRESHOLD,
+                 min_shard_size: int = DEFAULT_MIN_SHARD_SIZE):
+        if mode not in EXECUTOR_MODES:
+            raise ValueError(f"Unknown executor mode {mode!r}, expected one of {EXECUTOR_MODES}")
+
+        self.mode = mode
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.inline_threshold = inline_threshold
+        self.min_shard_size = max(1, min_shard_size)
+        self._pool: Optional[Executor] = None
+
+    @classmethod
+    def from_env(cls, prefix: str = 'AGENT') -> 'ShardExecutor':
+        """Build an executor from <prefix>_EXECUTOR, _WORKERS, _INLINE_THRESHOLD and _MIN_SHARD_SIZE"""
+        mode = os.getenv(f'{prefix}_EXECUTOR', DEFAULT_MODE).lower()
+        if mode not in EXECUTOR_MODES:
+            logger.warning(f"Ignoring invalid {prefix}_EXECUTOR={mode!r}, using {DEFAULT_MODE}")
+            mode = DEFAULT_MODE
+
+        return cls(
+            mode=mode,
+            workers=_env_int(f'{prefix}_WORKERS', 0) or None,
+            inline_threshold=_env_int(f'{prefix}_INLINE_THRESHOLD', DEFAULT_INLINE_THRESHOLD),
+            min_shard_size=_env_int(f'{prefix}_MIN_SHARD_SIZE', DEFAULT_MIN_SHARD_SIZE)
+        )
+
+    @property
+    def pool(self) -> Executor:
+        """The worker pool, created on first use"""
+        if self._pool is None:
+            if self.mode == 'process':
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='shard')
+        return self._pool
+
+    def runs_inline(self, size: int) -> bool:
+        """Whether a payload of this size is processed directly on the event loop"""
+        return self.mode == 'inline' or size < self.inline_threshold
+
+    def split(self, items: List[Any]) -> List[Tuple[int, List[Any]]]:
+        """Split items into at most `workers` contiguous shards of at least min_shard_size, with their start offsets"""
+        if not items:
+            return [(0, items)]
+
+        shard_count = max(1, min(self.workers, len(items) // self.min_shard_size))
+        shard_size = math.ceil(len(items) / shard_count)
+        return [(start, items[start:start + shard_size]) for start in range(0, len(items), shard_size)]
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """Run a single call on the pool (process mode requires a picklable, module-level fn)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, fn, *args)
+
+    async def run_local(self, fn: Callable, *args) -> Any:
+        """Run a call that works on this process's objects off the event loop.
+
+        Uses the thread pool, or the loop's default one in process mode; inline
+        mode runs it directly.
+        """
+        if self.mode == 'inline':
+            return fn(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool if self.mode == 'thread' else None, fn, *args)
+
+    async def map_shards(self, fn: Callable, items: List[Any], *args,
+                         aligned: Optional[Sequence[Any]] = None) -> List[Tuple[int, Any]]:
+        """Call fn(shard, *args) for every shard of items, returning (start, result) in input order.
+
+        Small payloads stay inline as a single shard. When `aligned` (one value
+        per item) is given, each call also gets the slice matching its shard
+        as a last argument.
+        """
+        if self.runs_inline(len(items)):
+            return [(0, fn(items, *args) if aligned is None else fn(items, *args, aligned))]
+
+        shards = self.split(items)
+        results = await asyncio.gather(*(
+            self.run(fn, shard, *args) if aligned is None else
+            self.run(fn, shard, *args, aligned[start:start + len(shard)])
+            for start, shard in shards
+        ))
+        return [(start, result) for (start, _), result in zip(shards, results)]
+
+    def shutdown(self):
+        """Stop the worker pool"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
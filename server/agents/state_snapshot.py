@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Warm-state snapshots of the agents
+An agent's caches and indexes (feature caches, compiled profiles, dedup and
+TF-IDF indexes) are pickled with protocol 5 into one file, with the numpy
+arrays written out of band as aligned raw buffers. On boot the file is
+memory-mapped and unpickled over those buffers, so the arrays are used in
+place (copy-on-write) instead of being read and copied, and a restarted or
+added replica starts with its predecessors' warm state.
+
+The file is trusted local state written by the agents themselves: unpickling
+it runs arbitrary code, so AGENT_SNAPSHOT_DIR must not be writable by others.
+
+Layout: header (magic, format version, buffer count, pickle length), one
+(offset, length) pair per buffer, the pickle, then the buffers, each
+starting on a BUFFER_ALIGNMENT boundary.
+"""
+
+import gc
+import logging
+import mmap
+import os
+import pickle
+import struct
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'AGSNAP'
+FORMAT_VERSION = 1
+BUFFER_ALIGNMENT = 64
+DEFAULT_INTERVAL_SECONDS = 300.0
+
+_HEADER = struct.Struct('<6sHIQ')
+_BUFFER_ENTRY = struct.Struct('<QQ')
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // BUFFER_ALIGNMENT) * BUFFER_ALIGNMENT
+
+
+def write_snapshot(path: str, state: Dict[str, Any]) -> int:
+    """Write state to path atomically; returns the file size"""
+    buffers: List[pickle.PickleBuffer] = []
+    payload = pickle.dumps(state, protocol=5, buffer_callback=buffers.append)
+    raws = [buffer.raw() for buffer in buffers]
+
+    offset = _HEADER.size + _BUFFER_ENTRY.size * len(raws) + len(payload)
+    table = []
+    for raw in raws:
+        offset = _aligned(offset)
+        table.append((offset, raw.nbytes))
+        offset += raw.nbytes
+
+    # Replicas of one agent share the file, so each writes its own temporary copy
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(raws), len(payload)))
+            for entry in table:
+                f.write(_BUFFER_ENTRY.pack(*entry))
+            f.write(payload)
+            for (start, _), raw in zip(table, raws):
+                f.write(b'\0' * (start - f.tell()))
+                f.write(raw)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return offset
+
+
+def read_snapshot(path: str) -> Dict[str, Any]:
+    """Memory-map a snapshot and unpickle it over the mapped buffers.
+
+    The mapping is private (ACCESS_COPY): arrays restored from it are
+    writable, and pages are only copied once they are written to.
+    """
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    view = memoryview(mapped)
+
+    magic, version, count, payload_length = _HEADER.unpack_from(view)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"not a version {FORMAT_VERSION} agent snapshot")
+    table_end = _HEADER.size + _BUFFER_ENTRY.size * count
+    buffers = [
+        view[start:start + length]
+        for start, length in _BUFFER_ENTRY.iter_unpack(view[_HEADER.size:table_end])
+    ]
+    return pickle.loads(view[table_end:table_end + payload_length], buffers=buffers)
+
+
+class StateSnapshots:
+    """Where and how often an agent saves its warm state.
+
+    Configured by AGENT_SNAPSHOT_DIR (unset disables snapshots) and
+    AGENT_SNAPSHOT_INTERVAL (seconds between periodic saves).
+    """
+
+    def __init__(self, path: Optional[str] = None, interval: float = DEFAULT_INTERVAL_SECONDS):
+        self.path = path
+        self.interval = interval
+
+    @classmethod
+    def from_env(cls, agent_name: str) -> 'StateSnapshots':
+        directory = os.getenv('AGENT_SNAPSHOT_DIR')
+        try:
+            interval = float(os.getenv('AGENT_SNAPSHOT_INTERVAL', DEFAULT_INTERVAL_SECONDS))
+        except ValueError as e:
+            logger.warning(f"Invalid AGENT_SNAPSHOT_INTERVAL, using {DEFAULT_INTERVAL_SECONDS}: {e}")
+            interval = DEFAULT_INTERVAL_SECONDS
+        return cls(os.path.join(directory, f"{agent_name}.snapshot") if directory else None, interval)
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def restore(self, target: Any) -> bool:
+        """Load the saved state into target.restore_state(); False when disabled, missing or unreadable.
+
+        The cyclic garbage collector is paused while the restored objects are
+        built, since collections triggered by their allocation would scan them
+        over and over, and they are then moved out of later collections with
+        gc.freeze() (which also keeps forked pool workers from copying them).
+        """
+        if self.path is None or not os.path.exists(self.path):
+            return False
+        start = time.perf_counter()
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            target.restore_state(read_snapshot(self.path))
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable snapshot {self.path}: {e}")
+            return False
+        finally:
+            if enabled:
+                gc.enable()
+        gc.freeze()
+        logger.info(f"Restored snapshot {self.path} in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return True
+
+    def save(self, state: Dict[str, Any]):
+        """Write the state; failures are logged, not raised"""
+        if self.path is None:
+            return
+        start = time.perf_counter()
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            size = write_snapshot(self.path, state)
+        except Exception as e:
+            logger.warning(f"Failed to save snapshot {self.path}: {e}")
+            return
+        logger.info(f"Saved snapshot {self.path} ({size / (1024 * 1024):.1f} MiB) "
+                    f"in {(time.perf_counter() - start) * 1000:.1f} ms")
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Deterministic synthetic news feeds and user profiles
+Generates articles and profiles shaped like the ones the frontend sends the
+agents, from a seed, so benchmarks and comparisons see identical payloads on
+every run and every machine
+"""
+
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Reference "now" of generated feeds; pair it with timeparse.FixedClock(BENCHMARK_EPOCH)
+BENCHMARK_EPOCH = datetime(2025, 1, 15, 12, 0, tzinfo=timezone.utc).timestamp()
+
+# (source, weight) pairs covering every credibility tier plus unknown sources
+DEFAULT_SOURCE_MIX: Tuple[Tuple[str, float], ...] = (
+    ('CoinDesk', 3.0),
+    ('CoinTelegraph', 3.0),
+    ('Decrypt', 2.0),
+    ('The Block', 2.0),
+    ('CryptoSlate', 1.5),
+    ('Bitcoin Magazine', 1.0),
+    ('Ethereum Foundation', 0.5),
+    ('Medium', 1.0),
+    ('Substack', 0.5),
+    ('Personal Blog', 0.5),
+    ('Crypto Daily Wire', 1.0),
+)
+
+TOPICS = (
+    'bitcoin', 'ethereum', 'defi', 'nft', 'layer 2', 'stablecoins', 'regulation', 'mining',
+    'solana', 'staking', 'dao', 'web3', 'security', 'exchanges', 'cbdc', 'gaming',
+)
+
+CATEGORIES = (
+    'Markets', 'Technology', 'Policy', 'DeFi', 'NFTs', 'Business', 'Security', 'Research',
+)
+
+_TITLE_TEMPLATES = (
+    '{topic} {verb} as {subject} {action}',
+    'Why {topic} {verb} after {subject} {action}?',
+    '{subject} {action}: what it means for {topic}',
+    'Breaking: {topic} {verb} amid {subject} news',
+    'Analysis: can {topic} keep its momentum?',
+    '{topic} hits record high while {subject} {action}',
+)
+_VERBS = ('surges', 'slides', 'stalls', 'rallies', 'crashes', 'recovers', 'climbs', 'drops')
+_SUBJECTS = ('regulators', 'developers', 'institutional investors', 'miners', 'exchanges', 'lawmakers')
+_ACTIONS = ('weigh new rules', 'ship an upgrade', 'pour money in', 'pull back', 'announce a merger')
+
+_WORDS = (
+    'the', 'market', 'network', 'price', 'protocol', 'investors', 'and', 'of', 'to', 'in',
+    'token', 'analysts', 'said', 'growth', 'liquidity', 'with', 'for', 'on', 'blockchain',
+    'volume', 'trading', 'users', 'fees', 'report', 'week', 'quarter', 'funds', 'while',
+    'transactions', 'validators', 'community', 'governance', 'proposal', 'upgrade', 'risk',
+    'adoption', 'wallets', 'custody', 'supply', 'demand', 'data', 'shows', 'record', 'new',
+)
+
+_READING_TIMES = ('short', 'medium', 'long')
+
+
+def _published_at(rng: random.Random, now: float, max_age_hours: float) -> str:
+    """ISO-8601 publication time spread across every recency bucket"""
+    published = datetime.fromtimestamp(now, tz=timezone.utc) - timedelta(hours=rng.uniform(0, max_age_hours))
+    return published.isoformat()
+
+
+def _title(rng: random.Random) -> str:
+    topic = rng.choice(TOPICS)
+    return rng.choice(_TITLE_TEMPLATES).format(
+        topic=topic[0].upper() + topic[1:],
+        verb=rng.choice(_VERBS),
+        subject=rng.choice(_SUBJECTS),
+        action=rng.choice(_ACTIONS)
+    )
+
+
+def _summary(rng: random.Random, words: int) -> str:
+    body = [rng.choice(_WORDS) for _ in range(words)]
+    # Mention a topic now and then so interest and history matching has hits
+    for _ in range(max(1, words // 40)):
+        body[rng.randrange(words)] = rng.choice(TOPICS)
+    return ' '.join(body)
+
+
+def generate_articles(count: int, seed: int = 0, summary_words: int = 60,
+                      source_mix: Optional[Sequence[Tuple[str, float]]] = None,
+                      now: float = BENCHMARK_EPOCH, max_age_hours: float = 120,
+                      image_ratio: float = 0.6, duplicate_ratio: float = 0.0) -> List[Dict[str, Any]]:
+    """`count` articles in the news aggregator's item format, identical for identical arguments.
+
+    About `duplicate_ratio` of them are syndicated copies of an earlier
+    article: same summary, a source-tagged title and a different source.
+    """
+    rng = random.Random(seed)
+    sources, weights = zip(*(source_mix or DEFAULT_SOURCE_MIX))
+
+    articles = []
+    for index in range(count):
+        if duplicate_ratio and articles and rng.random() < duplicate_ratio:
+            articles.append(_syndicated_copy(rng, rng.choice(articles), f"article_{seed}_{index}", sources, weights))
+            continue
+        words = max(1, int(rng.gauss(summary_words, summary_words / 4)))
+        articles.append({
+            "id": f"article_{seed}_{index}",
+            "title": _title(rng),
+            "summary": _summary(rng, words),
+            "url": f"https://news.example.com/{seed}/{index}",
+            "source": rng.choices(sources, weights)[0],
+            "published_at": _published_at(rng, now, max_age_hours),
+            "image_url": f"https://images.example.com/{index}.jpg" if rng.random() < image_ratio else None,
+            "categories": rng.sample(CATEGORIES, rng.randint(0, 3)),
+            "relevance_score": round(rng.uniform(0.3, 0.7), 3)
+        })
+    return articles
+
+
+def _syndicated_copy(rng: random.Random, original: Dict[str, Any], article_id: str,
+                     sources: Sequence[str], weights: Sequence[float]) -> Dict[str, Any]:
+    """A republication of `original` by another source"""
+    source = rng.choices(sources, weights)[0]
+    return {
+        **original,
+        "id": article_id,
+        "title": f"{original['title']} | {source}",
+        "url": f"https://syndicated.example.com/{article_id}",
+        "source": source
+    }
+
+
+def generate_profile(seed: int = 0, interests: int = 5, history_length: int = 20,
+                     preferred_sources: int = 2, topic_preferences: int = 2,
+                     source_mix: Optional[Sequence[Tuple[str, float]]] = None) -> Dict[str, Any]:
+    """A user profile with every field the relevance scorer reads"""
+    rng = random.Random(seed)
+    sources = [source for source, _ in (source_mix or DEFAULT_SOURCE_MIX)]
+
+    # History entries are mostly topics with a tail of article-style phrases
+    history = [
+        rng.choice(TOPICS) if rng.random() < 0.5 else f"{rng.choice(_WORDS)} {rng.choice(TOPICS)}"
+        for _ in range(history_length)
+    ]
+
+    return {
+        "user_id": f"user_{seed}",
+        "interests": rng.sample(TOPICS, min(interests, len(TOPICS))),
+        "reading_history": history,
+        "preferred_sources": rng.sample(sources, min(preferred_sources, len(sources))),
+        "topic_preferences": rng.sample(CATEGORIES, min(topic_preferences, len(CATEGORIES))),
+        "reading_time_preference": rng.choice(_READING_TIMES)
+    }
+
+
+def generate_profiles(count: int, seed: int = 0, **options) -> List[Dict[str, Any]]:
+    """`count` distinct profiles, see generate_profile() for the options"""
+    return [generate_profile(seed * 100003 + index, **options) for index in range(count)]
+
+
+def parse_source_mix(spec: str) -> List[Tuple[str, float]]:
+    """Parse "CoinDesk=3,Medium=1" into (source, weight) pairs"""
+    mix = []
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        if not name.strip():
+            raise ValueError(f"Empty source name in source mix {spec!r}")
+        mix.append((name.strip(), float(weight) if weight else 1.0))
+    return mix
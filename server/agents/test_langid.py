@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Tests for langid: short headlines must not be forced onto the wrong language
+Run with: python -m unittest test_langid
+"""
+
+import unittest
+
+import langid
+
+# Short English headlines, mostly names and tickers
+HEADLINES = [
+    "Polygon zkEVM Mainnet Beta Goes Live",
+    "Cardano ADA Price Prediction",
+    "Bitcoin Hits New All-Time High",
+    "Ethereum ETF Approval Expected Soon",
+    "Solana Network Suffers Another Outage",
+    "SEC Sues Major Crypto Exchange",
+    "Ripple Wins Partial Victory Against SEC",
+    "Binance CEO Steps Down",
+    "Uniswap Launches Version Four",
+    "Dogecoin Rallies After Musk Tweet",
+    "Chainlink Integrates With Swift",
+    "Avalanche Foundation Buys Back Tokens",
+    "Arbitrum DAO Approves Grant Program",
+    "Tether Mints Another Billion USDT",
+    "Coinbase Reports Quarterly Earnings",
+    "Stablecoin Bill Advances in Congress",
+    "Lido Staking Rewards Drop",
+    "Aave Proposes New Risk Parameters",
+    "NFT Trading Volume Falls Sharply",
+    "MicroStrategy Buys More Bitcoin",
+]
+
+SENTENCES = {
+    "en": "The price of bitcoin rose sharply after regulators approved the new exchange traded funds",
+    "es": "El precio de bitcoin subió con fuerza después de que los reguladores aprobaran los nuevos fondos cotizados",
+    "fr": "Le prix du bitcoin a fortement augmenté après que les régulateurs ont approuvé les nouveaux fonds négociés en bourse",
+    "de": "Der Bitcoin-Kurs ist stark gestiegen, nachdem die Aufsichtsbehörden die neuen börsengehandelten Fonds genehmigt hatten",
+    "it": "Il prezzo del bitcoin è salito con forza dopo che le autorità hanno approvato i nuovi fondi quotati in borsa",
+    "pt": "O preço do bitcoin subiu com força depois que os reguladores aprovaram os novos fundos negociados em bolsa",
+    "nl": "De koers van bitcoin steeg sterk nadat de toezichthouders de nieuwe beursgenoteerde fondsen hadden goedgekeurd",
+    "pl": "Cena bitcoina mocno wzrosła po tym, jak regulatorzy zatwierdzili nowe fundusze notowane na giełdzie",
+    "tr": "Düzenleyiciler yeni borsa yatırım fonlarını onayladıktan sonra bitcoin fiyatı güçlü bir şekilde yükseldi",
+    "sv": "Priset på bitcoin steg kraftigt efter att tillsynsmyndigheterna godkänt de nya börshandlade fonderna",
+    "id": "Harga bitcoin naik tajam setelah regulator menyetujui dana yang diperdagangkan di bursa yang baru",
+    "vi": "Giá bitcoin tăng mạnh sau khi các cơ quan quản lý phê duyệt các quỹ giao dịch trên sàn mới",
+    "ru": "Цена биткоина резко выросла после того, как регуляторы одобрили новые биржевые фонды",
+    "uk": "Ціна біткоїна різко зросла після того, як регулятори схвалили нові біржові фонди",
+    "ar": "ارتفع سعر البيتكوين بقوة بعد أن وافقت الجهات التنظيمية على صناديق المؤشرات الجديدة",
+    "fa": "قیمت بیت کوین پس از تایید صندوق های جدید قابل معامله در بورس توسط نهادهای نظارتی به شدت افزایش یافت",
+}
+
+
+class ShortHeadlineTest(unittest.TestCase):
+
+    def test_headlines_are_english_or_unknown(self):
+        for headline in HEADLINES:
+            with self.subTest(headline=headline):
+                self.assertIn(langid.detect_language(headline), ('en', langid.UNKNOWN_LANGUAGE))
+
+    def test_batch_matches_single(self):
+        texts = HEADLINES + list(SENTENCES.values())
+        self.assertEqual(langid.detect_languages(texts), [langid.detect_language(text) for text in texts])
+
+    def test_too_short(self):
+        self.assertEqual(langid.detect_language("BTC ETH"), langid.UNKNOWN_LANGUAGE)
+        self.assertEqual(langid.detect_language(""), langid.UNKNOWN_LANGUAGE)
+
+
+class SentenceTest(unittest.TestCase):
+
+    def test_sentences(self):
+        for language, sentence in SENTENCES.items():
+            with self.subTest(language=language):
+                self.assertEqual(langid.detect_language(sentence), language)
+
+
+if __name__ == '__main__':
+    unittest.main()
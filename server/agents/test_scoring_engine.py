@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Tests for scoring_engine: the vectorized path must rank exactly like the per-item one
+Run with: python -m unittest test_scoring_engine
+"""
+
+import asyncio
+import unittest
+
+import scoring_engine
+from ranked_index import RankedIndex
+from relevance_scorer_agent import RelevanceScorerAgent
+from shard_executor import ShardExecutor
+from synthetic_data import BENCHMARK_EPOCH, generate_articles, generate_profile
+from timeparse import FixedClock
+
+PROFILES = {
+    "full": generate_profile(seed=1),
+    "interests_only": {"interests": ["bitcoin", "DeFi", "regulation"]},
+    "empty": {},
+    "none": None,
+}
+
+
+def without_timestamps(items):
+    """Scored items minus processing_timestamp, which differs between runs"""
+    return [{key: value for key, value in item.items() if key != 'processing_timestamp'} for item in items]
+
+
+def malformed_articles():
+    """Synthetic articles with the broken fields feeds actually send"""
+    articles = generate_articles(60, seed=3)
+    articles[0]["title"] = None
+    articles[1].pop("summary")
+    articles[2]["published_at"] = "not a date"
+    articles[3]["published_at"] = None
+    articles[4]["categories"] = ["bitcoin", None]
+    articles[5]["relevance_score"] = 1
+    articles[6].pop("source")
+    articles[7]["image_url"] = ""
+    articles[8] = {"id": articles[8]["id"]}
+    return articles
+
+
+class VectorizedMatchesPerItemTest(unittest.TestCase):
+
+    def setUp(self):
+        self.agent = RelevanceScorerAgent(create_agent=False, clock=FixedClock(BENCHMARK_EPOCH))
+        self.agent.executor = ShardExecutor(mode='inline')
+        self.agent.ranked = RankedIndex(0)
+        self.articles = generate_articles(200, seed=7)
+
+    def score(self, news_items, user_profile, limit=None, offset=0):
+        return asyncio.run(self.agent.calculate_relevance_scores(news_items, user_profile, limit, offset))
+
+    def per_item(self, news_items, user_profile, limit=None, offset=0):
+        end = None if limit is None else offset + limit
+        return self.agent.calculate_relevance_scores_per_item(news_items, user_profile)[offset:end]
+
+    def test_ranked_output(self):
+        for name, profile in PROFILES.items():
+            with self.subTest(profile=name):
+                self.assertEqual(without_timestamps(self.score(self.articles, profile)),
+                                 without_timestamps(self.per_item(self.articles, profile)))
+
+    def test_paging(self):
+        profile = PROFILES["full"]
+        for limit, offset in [(0, 0), (1, 0), (10, 0), (10, 25), (50, 190), (None, 40), (10, 500)]:
+            with self.subTest(limit=limit, offset=offset):
+                self.assertEqual(without_timestamps(self.score(self.articles, profile, limit, offset)),
+                                 without_timestamps(self.per_item(self.articles, profile, limit, offset)))
+
+    def test_malformed_items(self):
+        articles = malformed_articles()
+        for name, profile in PROFILES.items():
+            with self.subTest(profile=name):
+                self.assertEqual(without_timestamps(self.score(articles, profile)),
+                                 without_timestamps(self.per_item(articles, profile)))
+
+    def test_shard_merge(self):
+        profile = PROFILES["full"]
+        now = self.agent.clock.now()
+        shards = ShardExecutor(mode='thread', workers=4, min_shard_size=10).split(self.articles)
+        self.assertGreater(len(shards), 1)
+        for limit, offset in [(None, 0), (5, 0), (20, 30), (60, 150)]:
+            with self.subTest(limit=limit, offset=offset):
+                shard_limit = None if limit is None else offset + limit
+                shard_results = [
+                    (start, scoring_engine.score_shard(shard, profile, shard_limit, now))
+                    for start, shard in shards
+                ]
+                merged = scoring_engine.merge_ranked_shards(shard_results, limit=limit, offset=offset)
+                self.assertEqual(without_timestamps(merged),
+                                 without_timestamps(self.per_item(self.articles, profile, limit, offset)))
+
+    def test_threaded_shards(self):
+        self.agent.executor = ShardExecutor(mode='thread', workers=3, inline_threshold=50, min_shard_size=20)
+        try:
+            self.assertEqual(without_timestamps(self.score(self.articles, PROFILES["full"], 15, 5)),
+                             without_timestamps(self.per_item(self.articles, PROFILES["full"], 15, 5)))
+        finally:
+            self.agent.executor.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
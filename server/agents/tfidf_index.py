@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Incremental TF-IDF index for content-similarity scoring
+Articles are tokenized once, when first seen, into rows of a compressed
+sparse row (CSR) term matrix that grows in place, and the document
+frequencies of their terms are updated alongside. Scoring a batch against a
+profile vector built from interests and reading history is then one sparse
+matrix-vector product over the batch's rows, with IDF weights taken from
+every article indexed so far.
+"""
+
+import logging
+import math
+import os
+import re
+import threading
+import zlib
+from typing import Any, Dict, Hashable, List, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_DOCUMENTS = 100000
+# Weight of interest terms relative to reading-history terms in the profile vector
+INTEREST_WEIGHT = 2.0
+HISTORY_WEIGHT = 1.0
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased word tokens"""
+    return _TOKEN_RE.findall(text.lower())
+
+
+def article_text(item: Dict[str, Any]) -> str:
+    """The text an article is indexed by"""
+    return item.get('title', '') + ' ' + item.get('summary', '')
+
+
+def _grow(array: np.ndarray, needed: int) -> np.ndarray:
+    """array, reallocated to at least `needed` elements with doubling"""
+    if needed <= len(array):
+        return array
+    grown = np.zeros(max(needed, 2 * len(array)), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class TfidfIndex:
+    """Term matrix of recently seen articles, addressed by article id.
+
+    Rows of edited articles are superseded and rows of articles not seen for
+    a while are dropped when the index outgrows max_documents; both are
+    reclaimed by compacting the matrix, never by rebuilding it from text.
+    """
+
+    def __init__(self, max_documents: int = DEFAULT_MAX_DOCUMENTS):
+        self.max_documents = max(1, max_documents)
+
+        self.vocabulary: Dict[str, int] = {}
+        self.document_frequency = np.zeros(1024, dtype=np.int64)
+
+        # CSR storage: row r holds terms[indptr[r]:indptr[r + 1]] with their counts
+        self.indptr = np.zeros(1025, dtype=np.int64)
+        self.terms = np.zeros(1 << 16, dtype=np.int32)
+        self.counts = np.zeros(1 << 16, dtype=np.float32)
+        self.row_count = 0
+
+        # Live rows: article key -> row, with each row's text hash and last use
+        self.rows: Dict[Hashable, int] = {}
+        self.row_hash = np.zeros(1024, dtype=np.int64)
+        self.row_seen = np.zeros(1024, dtype=np.int64)
+        self._tick = 0
+
+        self.indexed = 0
+        self.reused = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'TfidfIndex':
+        """Build an index from TFIDF_INDEX_SIZE"""
+        try:
+            return cls(max_documents=int(os.getenv('TFIDF_INDEX_SIZE', DEFAULT_MAX_DOCUMENTS)))
+        except ValueError as e:
+            logger.warning(f"Invalid TF-IDF index settings, using defaults: {e}")
+            return cls()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def add(self, items: Sequence[Dict[str, Any]]) -> np.ndarray:
+        """Index the items not seen with their current text yet; returns every item's row"""
+        self._tick += 1
+        rows = np.empty(len(items), dtype=np.int64)
+        for position, item in enumerate(items):
+            try:
+                text = article_text(item)
+                key = item.get('id') or item.get('url')
+                hash(key)
+            except Exception:
+                # Malformed articles are passed through by the scorers; index them as empty
+                text, key = '', None
+            text_hash = zlib.crc32(text.encode('utf-8', 'surrogatepass'))
+            key = key or text_hash
+
+            row = self.rows.get(key)
+            if row is not None and self.row_hash[row] == text_hash:
+                self.reused += 1
+            else:
+                if row is not None:
+                    self._forget(row)
+                row = self._append(tokenize(text), text_hash)
+                self.rows[key] = row
+                self.indexed += 1
+            self.row_seen[row] = self._tick
+            rows[position] = row
+        return rows
+
+    def _append(self, tokens: List[str], text_hash: int) -> int:
+        """Add one row and count its terms into the document frequencies"""
+        term_counts: Dict[int, int] = {}
+        vocabulary = self.vocabulary
+        for token in tokens:
+            term = vocabulary.get(token)
+            if term is None:
+                term = vocabulary[token] = len(vocabulary)
+            term_counts[term] = term_counts.get(term, 0) + 1
+
+        row = self.row_count
+        start = self.indptr[row]
+        end = start + len(term_counts)
+        self.indptr = _grow(self.indptr, row + 2)
+        self.terms = _grow(self.terms, end)
+        self.counts = _grow(self.counts, end)
+        self.row_hash = _grow(self.row_hash, row + 1)
+        self.row_seen = _grow(self.row_seen, row + 1)
+        self.document_frequency = _grow(self.document_frequency, len(vocabulary))
+
+        terms = np.fromiter(term_counts.keys(), dtype=np.int32, count=len(term_counts))
+        self.terms[start:end] = terms
+        self.counts[start:end] = np.fromiter(term_counts.values(), dtype=np.float32, count=len(term_counts))
+        self.indptr[row + 1] = end
+        self.row_hash[row] = text_hash
+        self.document_frequency[terms] += 1
+        self.row_count += 1
+        return row
+
+    def _forget(self, row: int):
+        """Take a superseded row out of the document frequencies; its storage is reclaimed on compaction"""
+        self.document_frequency[self.terms[self.indptr[row]:self.indptr[row + 1]]] -= 1
+
+    def idf(self) -> np.ndarray:
+        """Smoothed inverse document frequency of every vocabulary term"""
+        documents = len(self.rows)
+        return np.log((1 + documents) / (1 + self.document_frequency[:len(self.vocabulary)])) + 1.0
+
+    def profile_vector(self, user_profile: Dict[str, Any], idf: np.ndarray) -> np.ndarray:
+        """Dense TF-IDF vector of the profile's interests and reading history over the vocabulary"""
+        vector = np.zeros(len(idf), dtype=np.float64)
+        for key, weight in (('interests', INTEREST_WEIGHT), ('reading_history', HISTORY_WEIGHT)):
+            for phrase in user_profile.get(key) or ():
+                for token in tokenize(phrase):
+                    term = self.vocabulary.get(token)
+                    if term is not None:
+                        vector[term] += weight
+        return vector * idf
+
+    def similarities(self, items: Sequence[Dict[str, Any]], user_profile: Dict[str, Any]) -> np.ndarray:
+        """Cosine similarity of each item's TF-IDF vector to the profile vector.
+
+        New articles are indexed first, so they count towards the IDF weights
+        they are scored with.
+        """
+        with self._lock:
+            rows = self.add(items)
+            idf = self.idf()
+            profile = self.profile_vector(user_profile, idf)
+            profile_norm = math.sqrt(float(profile @ profile))
+
+            entries, lengths = self._gather(rows)
+            owner = np.repeat(np.arange(len(rows)), lengths)
+            terms = self.terms[entries]
+
+            # Sublinear term frequency
+            weights = (1.0 + np.log(self.counts[entries].astype(np.float64))) * idf[terms]
+            norms = np.sqrt(np.bincount(owner, weights=weights * weights, minlength=len(rows)))
+            dots = np.bincount(owner, weights=weights * profile[terms], minlength=len(rows))
+
+            self._compact()
+
+        denominator = norms * profile_norm
+        return np.divide(dots, denominator, out=np.zeros(len(rows)), where=denominator > 0)
+
+    def _gather(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Storage positions of the given rows' entries, concatenated in row order, and each row's length"""
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        offsets = np.cumsum(lengths) - lengths
+        return np.arange(int(lengths.sum())) - np.repeat(offsets, lengths) + np.repeat(starts, lengths), lengths
+
+    def _compact(self):
+        """Drop superseded rows, and the least recently used rows beyond max_documents"""
+        live = len(self.rows)
+        if live <= self.max_documents and self.row_count <= 2 * max(live, 1024):
+            return
+
+        keys = list(self.rows)
+        old_rows = np.fromiter(self.rows.values(), dtype=np.int64, count=live)
+        if live > self.max_documents:
+            # Keep the most recently used ones, leaving headroom so this does not run every batch
+            keep = max(1, self.max_documents * 9 // 10)
+            order = np.argsort(-self.row_seen[old_rows], kind='stable')[:keep]
+            order.sort()
+            for dropped in np.setdiff1d(np.arange(live), order).tolist():
+                self._forget(int(old_rows[dropped]))
+            keys = [keys[position] for position in order.tolist()]
+            old_rows = old_rows[order]
+
+        entries, lengths = self._gather(old_rows)
+
+        # Renumber the terms still in use so the vocabulary does not grow forever
+        frequency = self.document_frequency[:len(self.vocabulary)]
+        used = frequency > 0
+        renumbered = np.cumsum(used) - 1
+        self.vocabulary = {token: int(renumbered[term]) for token, term in self.vocabulary.items() if used[term]}
+        self.document_frequency = frequency[used].copy()
+
+        count = len(old_rows)
+        self.terms = renumbered[self.terms[entries]].astype(np.int32)
+        self.counts = self.counts[entries].copy()
+        self.indptr = np.concatenate(([0], np.cumsum(lengths)))
+        self.row_hash = self.row_hash[old_rows].copy()
+        self.row_seen = self.row_seen[old_rows].copy()
+        self.row_count = count
+        self.rows = dict(zip(keys, range(count)))
+        logger.info(f"TF-IDF index compacted to {count} articles")
+
+    def snapshot_state(self) -> Dict[str, Any]:
+        """Copies of the term matrix, vocabulary and live rows, for a state snapshot"""
+        with self._lock:
+            rows = self.row_count
+            return {
+                "vocabulary": dict(self.vocabulary),
+                "document_frequency": self.document_frequency[:len(self.vocabulary)].copy(),
+                "indptr": self.indptr[:rows + 1].copy(),
+                "terms": self.terms[:self.indptr[rows]].copy(),
+                "counts": self.counts[:self.indptr[rows]].copy(),
+                "rows": dict(self.rows),
+                "row_hash": self.row_hash[:rows].copy(),
+                "row_seen": self.row_seen[:rows].copy(),
+                "tick": self._tick
+            }
+
+    def restore_state(self, state: Dict[str, Any]):
+        """Replace the index with snapshot_state()'s; the arrays are used as given, not copied"""
+        with self._lock:
+            self.vocabulary = state["vocabulary"]
+            self.document_frequency = state["document_frequency"]
+            self.indptr = state["indptr"]
+            self.terms = state["terms"]
+            self.counts = state["counts"]
+            self.rows = state["rows"]
+            self.row_hash = state["row_hash"]
+            self.row_seen = state["row_seen"]
+            self.row_count = len(self.row_hash)
+            self._tick = state["tick"]
+            self._compact()
+
+    def stats(self) -> Dict[str, Any]:
+        """Index size and how many articles were tokenized versus reused"""
+        return {
+            "documents": len(self.rows),
+            "rows": self.row_count,
+            "vocabulary": len(self.vocabulary),
+            "indexed": self.indexed,
+            "reused": self.reused
+        }
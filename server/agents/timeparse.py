@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Timestamp parsing and the agents' clock
+Publication dates are parsed once (ISO-8601 or RFC-2822) to epoch seconds and
+cached, and each batch captures a single "now" from an injectable clock, so
+recency math is plain float arithmetic that can be bucketed in one vectorized step
+"""
+
+import math
+import time
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from typing import Any, Optional
+
+import numpy as np
+
+TIMESTAMP_CACHE_SIZE = 65536
+
+# Recency buckets: articles younger than RECENCY_BOUNDS_HOURS[i] score RECENCY_SCORES[i]
+RECENCY_BOUNDS_HOURS = (1, 6, 24, 72)
+RECENCY_SCORES = (1.0, 0.9, 0.7, 0.5, 0.3)
+# Score for articles without a usable publication date
+UNKNOWN_RECENCY_SCORE = 0.5
+# How much earlier than a bucket boundary next_recency_change() reports it
+BUCKET_MARGIN_SECONDS = 0.001
+
+_RECENCY_BOUNDS = np.array(RECENCY_BOUNDS_HOURS, dtype=np.float64)
+_RECENCY_SCORES = np.array(RECENCY_SCORES, dtype=np.float64)
+
+
+class Clock:
+    """Source of the current time as epoch seconds"""
+
+    def now(self) -> float:
+        return time.time()
+
+
+class FixedClock(Clock):
+    """Clock frozen at a given epoch time, for tests and reproducible benchmarks"""
+
+    def __init__(self, timestamp: float):
+        self.timestamp = timestamp
+
+    def now(self) -> float:
+        return self.timestamp
+
+
+system_clock = Clock()
+
+
+@lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def _parse_string(value: str) -> Optional[float]:
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        try:
+            parsed = parsedate_to_datetime(value)
+        except (TypeError, ValueError, IndexError):
+            return None
+        if parsed is None:
+            return None
+
+    # Naive timestamps are local time, as datetime.now() comparisons always assumed
+    try:
+        return parsed.timestamp()
+    except (OverflowError, OSError, ValueError):
+        return None
+
+
+def parse_timestamp(value: Any) -> Optional[float]:
+    """Parse an ISO-8601 or RFC-2822 timestamp to epoch seconds, None if missing or invalid"""
+    if not isinstance(value, str) or not value:
+        return None
+    return _parse_string(value)
+
+
+def hours_between(published: Optional[float], now: float) -> Optional[float]:
+    """Age in hours of a parsed timestamp, None when it is unknown"""
+    if published is None:
+        return None
+    return (now - published) / 3600
+
+
+def recency_score(hours_old: Optional[float]) -> float:
+    """Recency bucket score for an article age in hours"""
+    if hours_old is None or math.isnan(hours_old):
+        return UNKNOWN_RECENCY_SCORE
+    for bound, score in zip(RECENCY_BOUNDS_HOURS, RECENCY_SCORES):
+        if hours_old < bound:
+            return score
+    return RECENCY_SCORES[-1]
+
+
+def recency_scores(hours_old: np.ndarray) -> np.ndarray:
+    """Vectorized recency_score(); NaN ages get UNKNOWN_RECENCY_SCORE"""
+    # NaN sorts after every bound, so it lands in the last bucket before being masked
+    scores = _RECENCY_SCORES[np.searchsorted(_RECENCY_BOUNDS, hours_old, side='right')]
+    return np.where(np.isnan(hours_old), UNKNOWN_RECENCY_SCORE, scores)
+
+
+def next_recency_change(published_ts: np.ndarray, now: float) -> float:
+    """Earliest epoch time after `now` at which recency_scores() of these publication times can change.
+
+    That is the first bucket boundary one of the articles still has to cross,
+    inf when all are past the last bound or undated. The result is slightly
+    early (by BUCKET_MARGIN_SECONDS) so float rounding of the age cannot make
+    an article change buckets before it.
+    """
+    hours_old = (now - published_ts) / 3600
+    buckets = np.searchsorted(_RECENCY_BOUNDS, hours_old, side='right')
+    pending = (buckets < len(_RECENCY_BOUNDS)) & ~np.isnan(hours_old)
+    if not pending.any():
+        return math.inf
+    crossings = published_ts[pending] + _RECENCY_BOUNDS[buckets[pending]] * 3600
+    return float(crossings.min()) - BUCKET_MARGIN_SECONDS
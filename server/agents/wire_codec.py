@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Compact encodings of the agents' message payloads
+The message models carry articles as List[Dict[str, Any]], which uAgents
+serializes with pydantic's generic JSON encoder and validates dict by dict on
+receipt, a large share of the time spent on big batches. Instead, the bulky
+fields of a message (ENCODED_FIELDS) can travel in its `encoded` field as one
+"json" (orjson) or "msgpack" document, zstd-compressed when it is large
+("json+zstd", "msgpack+zstd"), base64 text so it still fits the JSON envelope.
+
+Requests list the encodings their sender can read in `accept_encoding`, most
+preferred first; responses use the first one this process supports and are
+sent as plain fields when there is none. Requests may be encoded the same
+way. orjson, msgpack and zstandard are all optional: a missing package only
+takes its encodings off the list, and JSON fields remain the fallback.
+"""
+
+import base64
+import importlib
+import logging
+import os
+from functools import lru_cache
+from types import ModuleType
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Message fields moved into `encoded`; the rest stay plain
+ENCODED_FIELDS = ('data', 'columns', 'user_profiles')
+# Encodings by the module implementing them
+CODECS = {'json': 'orjson', 'msgpack': 'msgpack'}
+COMPRESSION = 'zstd'
+
+DEFAULT_ZSTD_MIN_BYTES = 64 * 1024
+DEFAULT_ZSTD_LEVEL = 3
+
+
+@lru_cache(maxsize=None)
+def _module(name: str) -> Optional[ModuleType]:
+    """An optional dependency, None when it is not installed"""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+def supported_encodings() -> List[str]:
+    """The encodings this process can read and write"""
+    compressed = _module('zstandard') is not None
+    encodings = []
+    for codec, module in CODECS.items():
+        if _module(module) is not None:
+            encodings.append(codec)
+            if compressed:
+                encodings.append(f"{codec}+{COMPRESSION}")
+    return encodings
+
+
+def _split(encoding: str) -> Tuple[str, bool]:
+    codec, _, compression = encoding.partition('+')
+    if codec not in CODECS or compression not in ('', COMPRESSION):
+        raise ValueError(f"Unknown encoding {encoding!r}")
+    return codec, compression == COMPRESSION
+
+
+class WireCodec:
+    """Negotiates, encodes and decodes the `encoded` payload of the agents' messages.
+
+    Compression is only applied to documents of at least zstd_min_bytes;
+    a smaller document is sent with the uncompressed encoding, which every
+    reader of the compressed one can also read.
+    """
+
+    def __init__(self, zstd_min_bytes: int = DEFAULT_ZSTD_MIN_BYTES, zstd_level: int = DEFAULT_ZSTD_LEVEL):
+        self.zstd_min_bytes = zstd_min_bytes
+        self.zstd_level = zstd_level
+        self.encodings = supported_encodings()
+
+        self.encoded: Dict[str, int] = {}
+        self.decoded: Dict[str, int] = {}
+        self.fallbacks = 0
+        self.plain_bytes = 0
+        self.wire_bytes = 0
+
+    @classmethod
+    def from_env(cls) -> 'WireCodec':
+        """Build a codec from WIRE_ZSTD_MIN_BYTES and WIRE_ZSTD_LEVEL"""
+        try:
+            zstd_min_bytes = int(os.getenv('WIRE_ZSTD_MIN_BYTES', DEFAULT_ZSTD_MIN_BYTES))
+            zstd_level = int(os.getenv('WIRE_ZSTD_LEVEL', DEFAULT_ZSTD_LEVEL))
+        except ValueError as e:
+            logger.warning(f"Invalid wire codec settings, using defaults: {e}")
+            zstd_min_bytes, zstd_level = DEFAULT_ZSTD_MIN_BYTES, DEFAULT_ZSTD_LEVEL
+        return cls(zstd_min_bytes, zstd_level)
+
+    def negotiate(self, accept_encoding: Optional[List[str]]) -> Optional[str]:
+        """The first accepted encoding this process supports, None for plain fields.
+
+        A compressed encoding without zstandard installed falls back to its
+        uncompressed form, which its readers also read.
+        """
+        for encoding in accept_encoding or ():
+            codec = encoding.partition('+')[0]
+            if encoding in self.encodings:
+                return encoding
+            if codec in self.encodings:
+                return codec
+        return None
+
+    def encode(self, fields: Dict[str, Any], encoding: str) -> Tuple[str, str]:
+        """(encoding used, base64 text) of a dict of fields"""
+        codec, compress = _split(encoding)
+        if codec == 'json':
+            document = _module('orjson').dumps(fields)
+        else:
+            document = _module('msgpack').packb(fields, use_bin_type=True)
+
+        self.plain_bytes += len(document)
+        if compress and len(document) >= self.zstd_min_bytes:
+            document = _module('zstandard').ZstdCompressor(level=self.zstd_level).compress(document)
+        else:
+            encoding = codec
+        self.wire_bytes += len(document)
+        self.encoded[encoding] = self.encoded.get(encoding, 0) + 1
+        return encoding, base64.b64encode(document).decode('ascii')
+
+    def decode(self, encoding: str, encoded: str) -> Dict[str, Any]:
+        """The dict of fields encode() produced"""
+        codec, compressed = _split(encoding)
+        if encoding not in self.encodings:
+            raise ValueError(f"Encoding {encoding!r} is not supported here, supported: {self.encodings}")
+
+        document = base64.b64decode(encoded)
+        if compressed:
+            document = _module('zstandard').ZstdDecompressor().decompress(document)
+        if codec == 'json':
+            fields = _module('orjson').loads(document)
+        else:
+            fields = _module('msgpack').unpackb(document, raw=False)
+        if not isinstance(fields, dict):
+            raise ValueError(f"Encoded payload must be a map of fields, got {type(fields).__name__}")
+
+        self.decoded[encoding] = self.decoded.get(encoding, 0) + 1
+        return fields
+
+    def encode_response(self, fields: Dict[str, Any], accept_encoding: Optional[List[str]]) -> Dict[str, Any]:
+        """Response fields with the bulky ones encoded, when the requester accepts an encoding we have.
+
+        Payloads an encoder cannot represent (e.g. integers beyond 64 bits)
+        are sent as plain fields.
+        """
+        encoding = self.negotiate(accept_encoding)
+        if encoding is None:
+            return fields
+
+        bulky = {name: value for name, value in fields.items() if name in ENCODED_FIELDS and value is not None}
+        try:
+            encoding, encoded = self.encode(bulky, encoding)
+        except (TypeError, ValueError, OverflowError) as e:
+            logger.warning(f"Sending plain fields, payload cannot be encoded as {encoding}: {e}")
+            self.fallbacks += 1
+            return fields
+
+        plain = {name: value for name, value in fields.items() if name not in ENCODED_FIELDS}
+        return {**plain, "data": [], "encoding": encoding, "encoded": encoded}
+
+    def decode_request(self, msg: Any) -> Any:
+        """The request with its encoded fields restored as plain fields (unchanged when not encoded).
+
+        The result is validated like a plain request, so a malformed encoded
+        payload raises pydantic's ValidationError (a ValueError).
+        """
+        if not msg.encoding:
+            return msg
+        fields = self.decode(msg.encoding, msg.encoded or '')
+        unknown = set(fields) - (set(ENCODED_FIELDS) & set(msg.__fields__))
+        if unknown:
+            raise ValueError(f"Unexpected encoded fields {sorted(unknown)}")
+        return type(msg).parse_obj({**msg.dict(), **fields, "encoding": None, "encoded": None})
+
+    def stats(self) -> Dict[str, Any]:
+        """Messages encoded and decoded per encoding, plain fallbacks, and bytes before/after compression"""
+        return {
+            "supported": self.encodings,
+            "encoded": dict(self.encoded),
+            "decoded": dict(self.decoded),
+            "fallbacks": self.fallbacks,
+            "plain_bytes": self.plain_bytes,
+            "wire_bytes": self.wire_bytes
+        }
@@ -4,12 +4,52 @@
 import { MeTTaIntegration } from './metta-integration.js';
 import { ChatProtocolIntegration } from './chat-protocol.js';
 
+// Delta/columns response layout understood by mergeAgentResponse
+const WIRE_SCHEMA_VERSION = 1;
+
+// Compact encodings this client reads and writes (the Python agents' wire_codec).
+// The agents also speak msgpack and zstd, which would need packages Workers lack.
+const WIRE_ENCODINGS = ['json'];
+// Message fields carried in `encoded` when a message is encoded (wire_codec.ENCODED_FIELDS)
+const ENCODED_FIELDS = ['data', 'columns', 'user_profiles'];
+// Requests with fewer articles are sent as plain JSON fields
+const WIRE_ENCODE_MIN_ITEMS = 100;
+
+// Fields the Python agents compute, in wire order (article_record.RECORD_FIELDS)
+const AGENT_FIELDS = [
+  'processed_by', 'processing_timestamp', 'quality_score', 'language', 'word_count',
+  'has_image', 'source_credibility', 'relevance_score', 'personalized_score',
+  'engagement_potential', 'recency_score', 'personalization_factors'
+];
+
+// Base64 of bytes, in slices small enough to spread into String.fromCharCode
+function bytesToBase64(bytes) {
+  let binary = '';
+  for (let start = 0; start < bytes.length; start += 0x8000) {
+    binary += String.fromCharCode(...bytes.subarray(start, start + 0x8000));
+  }
+  return btoa(binary);
+}
+
+function base64ToBytes(text) {
+  const binary = atob(text);
+  const bytes = new Uint8Array(binary.length);
+  for (let i = 0; i < binary.length; i++) {
+    bytes[i] = binary.charCodeAt(i);
+  }
+  return bytes;
+}
+
 export class UAgentsIntegration {
   constructor() {
     this.agents = new Map();
     this.agentEndpoints = new Map();
     this.mettaIntegration = new MeTTaIntegration();
     this.chatProtocol = new ChatProtocolIntegration();
+    // `${agentName}:${profileId}` -> profile version the agent has registered
+    this.profileVersions = new Map();
+    // Profiles registered with the simulated agents, by the same key
+    this.simulatedProfiles = new Map();
   }
 
   // Initialize uAgents for news processing
@@ -98,12 +138,44 @@ export class UAgentsIntegration {
   }
 
   // Process news using uAgents
-  async processNewsWithAgents(newsItems, userProfile = null) {
+  // With options.pipeline (the default) the news fetcher processes and scores
+  // in one request; otherwise the enriched items are sent on to the scorer.
+  // Agents answer in the delta format unless options.responseFormat says otherwise.
+  // Backfills should pass { priority: 'batch' } so they queue behind live feed requests;
+  // options.deadlineMs overrides the agents' default deadline for the priority.
+  async processNewsWithAgents(newsItems, userProfile = null, options = {}) {
+    const {
+      pipeline = true, limit = null, offset = 0, responseFormat = 'delta',
+      priority = 'interactive', deadlineMs = null
+    } = options;
+
     try {
+      if (pipeline) {
+        // Step 1: Content Processor Agent categorizes and extracts entities
+        const processedNews = await this.callAgent('content_processor', {
+          action: 'process_content',
+          data: newsItems
+        });
+
+        // Step 2: News Fetcher Agent processes and scores in-process, no second hop
+        return await this.callAgentWithProfile('news_fetcher', {
+          action: 'process_and_score',
+          data: processedNews,
+          limit: limit,
+          offset: offset,
+          responseFormat: responseFormat,
+          priority: priority,
+          deadlineMs: deadlineMs
+        }, userProfile);
+      }
+
       // Step 1: News Fetcher Agent processes raw news
       const fetchedNews = await this.callAgent('news_fetcher', {
         action: 'process_news',
-        data: newsItems
+        data: newsItems,
+        responseFormat: responseFormat,
+        priority: priority,
+        deadlineMs: deadlineMs
       });
 
       // Step 2: Content Processor Agent categorizes and extracts entities
@@ -113,11 +185,15 @@ export class UAgentsIntegration {
       });
 
       // Step 3: Relevance Scorer Agent calculates personalization scores
-      const scoredNews = await this.callAgent('relevance_scorer', {
+      const scoredNews = await this.callAgentWithProfile('relevance_scorer', {
         action: 'calculate_relevance',
         data: processedNews,
-        userProfile: userProfile
-      });
+        limit: limit,
+        offset: offset,
+        responseFormat: responseFormat,
+        priority: priority,
+        deadlineMs: deadlineMs
+      }, userProfile);
 
       return scoredNews;
     } catch (error) {
@@ -135,15 +211,181 @@ export class UAgentsIntegration {
     }
 
     try {
+      // Large requests carry their articles encoded, and every request asks for an encoded response
+      const request = this.encodeAgentRequest({ ...payload, acceptEncoding: WIRE_ENCODINGS });
+
       // In a real implementation, this would make HTTP requests to the agent
       // For now, we'll simulate the agent responses
-      return await this.simulateAgentResponse(agentName, payload);
+      const agentRequest = this.decodeWireMessage(request);
+      const items = await this.simulateAgentResponse(agentName, agentRequest);
+      const format = payload.responseFormat || 'full';
+      // Delta and columns responses only carry ids and computed fields
+      const response = format === 'full'
+        ? { response_format: 'full', data: items }
+        : this.encodeAgentResponse(items, format);
+      const received = this.decodeWireMessage(this.encodeWireMessage(response, agentRequest.acceptEncoding));
+      return this.mergeAgentResponse(payload.data, received);
     } catch (error) {
       console.error(`Error calling agent ${agentName}:`, error);
       throw error;
     }
   }
 
+  // Call an agent that scores with a user profile. The full profile is sent once
+  // with its id and a content version; later calls send only the id and version
+  // while the profile is unchanged, and resend it if the agent no longer has it.
+  async callAgentWithProfile(agentName, payload, userProfile) {
+    const profileId = userProfile?.user_id;
+    if (!profileId) {
+      return this.callAgent(agentName, { ...payload, userProfile });
+    }
+
+    const key = `${agentName}:${profileId}`;
+    const profileVersion = this.profileVersion(userProfile);
+    if (this.profileVersions.get(key) === profileVersion) {
+      try {
+        return await this.callAgent(agentName, { ...payload, profileId, profileVersion });
+      } catch (error) {
+        if (!/not registered/.test(error.message)) throw error;
+        this.profileVersions.delete(key);
+      }
+    }
+
+    const result = await this.callAgent(agentName, { ...payload, userProfile, profileId, profileVersion });
+    this.profileVersions.set(key, profileVersion);
+    return result;
+  }
+
+  // Content version of a profile (FNV-1a over its JSON), so edits register a new version
+  profileVersion(userProfile) {
+    const json = JSON.stringify(userProfile);
+    let hash = 0x811c9dc5;
+    for (let i = 0; i < json.length; i++) {
+      hash ^= json.charCodeAt(i);
+      hash = Math.imul(hash, 0x01000193);
+    }
+    return (hash >>> 0).toString(16);
+  }
+
+  // The profile a simulated agent scores with, following the Python agents' resolve_profile
+  resolveSimulatedProfile(agentName, payload) {
+    const { userProfile = null, profileId, profileVersion } = payload;
+    if (!profileId) return userProfile;
+
+    const key = `${agentName}:${profileId}`;
+    if (userProfile) {
+      this.simulatedProfiles.set(key, { version: profileVersion, userProfile });
+      return userProfile;
+    }
+    const registered = this.simulatedProfiles.get(key);
+    if (!registered || registered.version !== profileVersion) {
+      throw new Error(`Profile ${profileId} version ${profileVersion} is not registered, send user_profile with it`);
+    }
+    return registered.userProfile;
+  }
+
+  // Build a delta or columns response the way the Python agents do (article_record.wire_payload)
+  encodeAgentResponse(items, responseFormat) {
+    const deltas = items.map(item => {
+      const delta = { id: item.id };
+      AGENT_FIELDS.forEach(field => {
+        if (field in item) delta[field] = item[field];
+      });
+      return delta;
+    });
+
+    if (responseFormat === 'delta') {
+      return { response_format: 'delta', schema_version: WIRE_SCHEMA_VERSION, data: deltas };
+    }
+    if (responseFormat === 'columns') {
+      const columns = { id: deltas.map(delta => delta.id) };
+      AGENT_FIELDS.forEach(field => {
+        if (deltas.some(delta => field in delta)) {
+          columns[field] = deltas.map(delta => (field in delta ? delta[field] : null));
+        }
+      });
+      return { response_format: 'columns', schema_version: WIRE_SCHEMA_VERSION, data: [], columns };
+    }
+    throw new Error(`Unknown response format ${responseFormat}`);
+  }
+
+  // Move a request's articles into `encoded` when it is large enough to be worth it
+  encodeAgentRequest(request) {
+    if ((request.data?.length || 0) < WIRE_ENCODE_MIN_ITEMS) {
+      return request;
+    }
+    return this.encodeWireMessage(request, WIRE_ENCODINGS);
+  }
+
+  // Encode a message's bulky fields with the first accepted encoding (wire_codec.encode_response);
+  // messages stay plain JSON when no accepted encoding is supported here
+  encodeWireMessage(message, acceptEncoding) {
+    const encoding = (acceptEncoding || []).find(candidate => WIRE_ENCODINGS.includes(candidate));
+    if (!encoding) {
+      return message;
+    }
+
+    const bulky = {};
+    const plain = {};
+    Object.entries(message).forEach(([field, value]) => {
+      if (!ENCODED_FIELDS.includes(field)) {
+        plain[field] = value;
+      } else if (value !== null && value !== undefined) {
+        bulky[field] = value;
+      }
+    });
+    return { ...plain, data: [], encoding, encoded: bytesToBase64(new TextEncoder().encode(JSON.stringify(bulky))) };
+  }
+
+  // Restore the bulky fields of an encoded message (wire_codec.decode)
+  decodeWireMessage(message) {
+    if (!message.encoding) {
+      return message;
+    }
+    if (!WIRE_ENCODINGS.includes(message.encoding)) {
+      throw new Error(`Unsupported agent message encoding ${message.encoding}`);
+    }
+
+    const fields = JSON.parse(new TextDecoder().decode(base64ToBytes(message.encoded)));
+    const { encoding: _encoding, encoded: _encoded, ...plain } = message;
+    return { ...plain, ...fields };
+  }
+
+  // Merge a response into the articles that were sent, in the response's (ranked) order
+  mergeAgentResponse(requestItems, response) {
+    const format = response.response_format || 'full';
+    if (format === 'full') {
+      return response.data;
+    }
+    if (response.schema_version > WIRE_SCHEMA_VERSION) {
+      throw new Error(`Unsupported agent response schema version ${response.schema_version}`);
+    }
+
+    let deltas = response.data;
+    if (format === 'columns') {
+      const { id: ids = [], ...fields } = response.columns || {};
+      deltas = ids.map((id, index) => {
+        const delta = { id };
+        Object.entries(fields).forEach(([field, values]) => {
+          if (values[index] !== null && values[index] !== undefined) delta[field] = values[index];
+        });
+        return delta;
+      });
+    }
+
+    // Ids may repeat in a feed, so each delta takes the next unused article with its id
+    const byId = new Map();
+    requestItems.forEach(item => {
+      if (!byId.has(item.id)) byId.set(item.id, []);
+      byId.get(item.id).push(item);
+    });
+
+    return deltas.map(delta => {
+      const original = byId.get(delta.id)?.shift() || {};
+      return { ...original, ...delta };
+    });
+  }
+
   // Simulate agent responses (replace with real agent calls)
   async simulateAgentResponse(agentName, payload) {
     switch (agentName) {
@@ -160,13 +402,19 @@ export class UAgentsIntegration {
 
   // Simulate News Fetcher Agent
   simulateNewsFetcher(payload) {
-    const { data } = payload;
-    return data.map(article => ({
+    const { action, data } = payload;
+    const fetched = data.map(article => ({
       ...article,
       processed_by: 'news_fetcher',
       processing_timestamp: new Date().toISOString(),
       quality_score: Math.random() * 0.3 + 0.7 // 0.7-1.0
     }));
+
+    if (action === 'process_and_score') {
+      const userProfile = this.resolveSimulatedProfile('news_fetcher', payload);
+      return this.simulateRelevanceScorer({ ...payload, data: fetched, userProfile, profileId: null });
+    }
+    return fetched;
   }
 
   // Simulate Content Processor Agent
@@ -184,14 +432,19 @@ export class UAgentsIntegration {
 
   // Simulate Relevance Scorer Agent
   simulateRelevanceScorer(payload) {
-    const { data, userProfile } = payload;
-    return data.map(article => ({
+    const { data, limit = null, offset = 0 } = payload;
+    const userProfile = this.resolveSimulatedProfile('relevance_scorer', payload);
+    const scored = data.map(article => ({
       ...article,
       processed_by: 'relevance_scorer',
       relevance_score: this.calculateRelevanceScore(article, userProfile),
       personalization_factors: this.getPersonalizationFactors(article, userProfile),
       processing_timestamp: new Date().toISOString()
     }));
+
+    // Ranked best first and paged like the Python agent
+    scored.sort((a, b) => b.relevance_score - a.relevance_score);
+    return limit == null ? scored.slice(offset) : scored.slice(offset, offset + limit);
   }
 
   // Helper methods for agent simulation